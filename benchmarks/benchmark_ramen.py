@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import platform
+import numpy as np
+import pandas as pd
+PROJECT_ROOT = os.path.abspath(os.path.join(
+                  os.path.dirname(__file__),
+                  os.pardir)
+)
+sys.path.append(PROJECT_ROOT)
+
+import mistlib as mist
+import ramenlib as ramen
+
+# --------------------------------------------------------------------------------
+# Benchmarks for the hot paths of ramenlib
+# Times get_P_JH, get_eutectic_lamellar_spacing, the strengthening chain,
+# ProcessMap2D.interpolate_point_data_to_grid (linear and cubic) and
+# ProcessMap2D.add_gridded_region for a range of input and grid sizes, and writes the
+# results to a JSON file. The material is examples/AlCu.json; the point data are
+# synthetic and have the same columns as tests/pmap_test_data.csv.
+#
+# Usage:
+#   python benchmark_ramen.py --output results.json
+#   python benchmark_ramen.py --baseline baseline.json --tolerance 0.25
+# With --baseline, every benchmark that is more than (1 + tolerance) times slower
+# than in the baseline is reported and the script exits with status 1. --quick only
+# runs the smaller sizes.
+#
+# Independently of the baseline, predict_yield_strength has to be at most
+# (1 + tolerance) times slower than strengthening_chain, the same models called one
+# after the other on the whole arrays, for every size of at least
+# MIN_PIPELINE_CHECK_SIZE that both of them ran for (smaller sizes take well under a
+# millisecond and are dominated by timing noise); otherwise the script also exits with
+# status 1.
+# --------------------------------------------------------------------------------
+
+ARRAY_SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+GRID_SIZES = [100, 250, 500, 1000, 2000]
+QUICK_ARRAY_SIZES = [10**3, 10**5]
+QUICK_GRID_SIZES = [100, 500]
+
+MIN_PIPELINE_CHECK_SIZE = 10**5
+
+# Number of synthetic process data points (power, speed) for the process maps
+NUM_POINTS = 2000
+
+def time_function(func, repeat):
+    # Returns the best and median wall times of repeat calls, after one warm-up
+    # call (caches such as the interpolation weights are built in the warm-up)
+    func()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), float(np.median(times))
+
+def get_synthetic_point_data(num_points, seed=0):
+    # Columns as in pmap_test_data.csv: "1" is the power (W), "2" the speed (mm/s)
+    # and "5" the melt pool depth (um)
+    rng = np.random.default_rng(seed)
+    power = rng.uniform(100.0, 400.0, num_points)
+    speed = rng.uniform(2.0, 30.0, num_points)
+    depth = 6.0 * power / np.sqrt(speed)
+    return pd.DataFrame({"0": np.zeros(num_points), "1": power, "2": speed,
+                         "3": np.zeros(num_points), "4": np.zeros(num_points), "5": depth})
+
+def depth_func(data):
+    return data["5"].values
+
+def keyhole_classifier(Z):
+    return ramen.keyhole_porosity_classifier(Z[0], 55)
+
+def keyhole_classifier_per_cell(Z, i, j):
+    return ramen.keyhole_porosity_classifier(Z[0][i,j], 55)
+
+def get_benchmarks(mat, array_sizes, grid_sizes):
+    # List of (name, parameters, setup); setup() builds the inputs and returns the
+    # function to time, so the inputs of the benchmarks that are filtered out are
+    # never built, and the inputs of each benchmark are freed after it ran. The
+    # compositions are above the solubility limit of alpha (2.48 wt% Cu), where the
+    # eutectic models apply.
+    phases = ['alpha', 'theta']
+    benchmarks = []
+
+    for size in array_sizes:
+        def setup(size=size):
+            g = np.random.default_rng(0).uniform(0.0, 1.0, size)
+            return lambda: ramen.get_P_JH(g)
+        benchmarks.append(('get_P_JH', {'size': size}, setup))
+
+    for size in array_sizes:
+        def setup(size=size):
+            rng = np.random.default_rng(1)
+            c_Cu = rng.uniform(2.6, 17.0, size)
+            velocity = rng.uniform(0.01, 2.0, size)
+            phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, c_Cu)
+            return lambda: ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity)
+        benchmarks.append(('get_eutectic_lamellar_spacing', {'size': size}, setup))
+
+    def get_strengthening_inputs(size):
+        rng = np.random.default_rng(2)
+        return rng.uniform(2.6, 17.0, size), rng.uniform(0.01, 2.0, size), rng.uniform(1.0e-6, 1.0e-4, size)
+
+    for size in array_sizes:
+        def setup(size=size):
+            c_Cu, velocity, grain_diameter = get_strengthening_inputs(size)
+
+            def strengthening_chain():
+                phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, c_Cu)
+                spacing = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity)
+                return ramen.get_orowan_strengthening_lamella(mat, 'alpha', 'theta', spacing, phase_fractions) \
+                       + ramen.get_solid_solution_strengthening(mat, 'alpha') \
+                       + ramen.get_grain_boundary_strengthening(mat, grain_diameter)
+            return strengthening_chain
+        benchmarks.append(('strengthening_chain', {'size': size}, setup))
+
+        def setup(size=size):
+            c_Cu, velocity, grain_diameter = get_strengthening_inputs(size)
+            return lambda: ramen.predict_yield_strength(mat, phases, c_Cu, velocity, grain_diameter)
+        benchmarks.append(('predict_yield_strength', {'size': size}, setup))
+
+    data = get_synthetic_point_data(NUM_POINTS)
+    grid_bounds_x = (min(data["2"]), max(data["2"]))
+    grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+    def get_process_map(grid_size):
+        return ramen.ProcessMap2D(num_grid_points=[grid_size, grid_size], grid_bounds_x=grid_bounds_x,
+                                  grid_bounds_y=grid_bounds_y, lazy=True)
+
+    for grid_size in grid_sizes:
+        for interpolator in ['linear', 'cubic']:
+            def setup(grid_size=grid_size, interpolator=interpolator):
+                pmap = get_process_map(grid_size)
+                return lambda: pmap.interpolate_point_data_to_grid(data, depth_func, "2", "1", interpolator)
+            benchmarks.append(('interpolate_point_data_to_grid', {'grid_size': grid_size, 'interpolator': interpolator,
+                                                                  'num_points': NUM_POINTS}, setup))
+
+        # The per-cell classifiers loop in Python over every grid point
+        for classifier in [keyhole_classifier, keyhole_classifier_per_cell]:
+            vectorized = (classifier is keyhole_classifier)
+            if not vectorized and grid_size > 500:
+                continue
+            def setup(grid_size=grid_size, classifier=classifier):
+                pmap = get_process_map(grid_size)
+                Z = pmap.interpolate_point_data_to_grid(data, depth_func, "2", "1")
+                return lambda: pmap.add_gridded_region([Z], classifier, color='k')
+            benchmarks.append(('add_gridded_region', {'grid_size': grid_size, 'vectorized': vectorized}, setup))
+
+        # Refreshing the map after one more simulation point; every call appends the
+        # next point of the extended data
+        def setup(grid_size=grid_size):
+            pmap = get_process_map(grid_size)
+            extended_data = pd.concat([data, get_synthetic_point_data(1000, seed=1)], ignore_index=True)
+            incremental = ramen.IncrementalClassification(pmap.x, pmap.y, data, [depth_func], keyhole_classifier, "2", "1")
+            return lambda: incremental.update(extended_data.iloc[:incremental.num_points+1])
+        benchmarks.append(('incremental_region_update', {'grid_size': grid_size, 'num_points': NUM_POINTS}, setup))
+
+    # Point queries on a saved artifact of the largest map, which is only built once
+    artifacts = []
+
+    def get_artifact():
+        if len(artifacts) == 0:
+            pmap = get_process_map(grid_sizes[-1])
+            pmap.add_point_data_plot(data, depth_func, "2", "1", label="Depth")
+            pmap.add_point_data_region(data, [depth_func], keyhole_classifier, "2", "1", region_name="Keyhole")
+            artifact_file = os.path.join(tempfile.mkdtemp(), "map.ramen")
+            pmap.save_artifact(artifact_file)
+            artifacts.append(ramen.ProcessMapArtifact(artifact_file))
+        return artifacts[0]
+
+    for size in array_sizes:
+        def setup(size=size):
+            artifact = get_artifact()
+            rng = np.random.default_rng(3)
+            x = rng.uniform(grid_bounds_x[0], grid_bounds_x[1], size)
+            y = rng.uniform(grid_bounds_y[0], grid_bounds_y[1], size)
+            return lambda: artifact.query(x, y)
+        benchmarks.append(('artifact_query', {'grid_size': grid_sizes[-1], 'size': size}, setup))
+
+    return benchmarks
+
+def get_key(result):
+    return json.dumps([result['name'], result['parameters']], sort_keys=True)
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Returns the benchmarks that are slower than the baseline by more than the
+    # tolerance (a fraction of the baseline time)
+    baseline_times = {get_key(result): result['best_time'] for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        key = get_key(result)
+        if key in baseline_times and result['best_time'] > (1.0 + tolerance) * baseline_times[key]:
+            regressions.append((result, baseline_times[key]))
+    return regressions
+
+def compare_pipeline_to_chain(results, tolerance):
+    # Returns (pipeline result, chain time) for the sizes at which
+    # predict_yield_strength is slower than strengthening_chain by more than the
+    # tolerance
+    chain_times = {result['parameters']['size']: result['best_time'] for result in results['results']
+                   if result['name'] == 'strengthening_chain'}
+    slow = []
+    for result in results['results']:
+        size = result['parameters'].get('size')
+        if result['name'] == 'predict_yield_strength' and size in chain_times and size >= MIN_PIPELINE_CHECK_SIZE \
+                and result['best_time'] > (1.0 + tolerance) * chain_times[size]:
+            slow.append((result, chain_times[size]))
+    return slow
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for ramenlib')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the results')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown relative to the baseline')
+    parser.add_argument('--repeat', type=int, default=3, help='timed calls per benchmark')
+    parser.add_argument('--quick', action='store_true', help='only run the smaller sizes')
+    parser.add_argument('--filter', default=None, help='only run the benchmarks with this string in their name')
+    args = parser.parse_args()
+
+    mat = mist.core.MaterialInformation(os.path.join(PROJECT_ROOT, 'examples', 'AlCu.json'))
+
+    if args.quick:
+        benchmarks = get_benchmarks(mat, QUICK_ARRAY_SIZES, QUICK_GRID_SIZES)
+    else:
+        benchmarks = get_benchmarks(mat, ARRAY_SIZES, GRID_SIZES)
+
+    results = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+               'repeat': args.repeat, 'results': []}
+    for name, parameters, setup in benchmarks:
+        if args.filter is not None and args.filter not in name:
+            continue
+        best_time, median_time = time_function(setup(), args.repeat)
+        results['results'].append({'name': name, 'parameters': parameters, 'best_time': best_time, 'median_time': median_time})
+        print(name, parameters, "%.6f s" % best_time)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    failed = False
+    for result, chain_time in compare_pipeline_to_chain(results, args.tolerance):
+        print("Slower than the chained calls:", result['name'], result['parameters'],
+              "%.6f s (chain %.6f s)" % (result['best_time'], chain_time))
+        failed = True
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for result, baseline_time in regressions:
+            print("Regression:", result['name'], result['parameters'], "%.6f s (baseline %.6f s)" % (result['best_time'], baseline_time))
+        failed = failed or len(regressions) > 0
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
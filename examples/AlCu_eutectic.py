@@ -47,3 +47,10 @@ print("Grain boundary strengthening:", grain_boundary_strengthening * 1e-6, "MPa
 yield_strength = orowan_strengthening_lamella + solid_solution_strengthening + grain_boundary_strengthening
 print("")
 print("Predicted yield strength:", yield_strength * 1e-6, "MPa")
+
+# The same chain for arrays of inputs in one call
+velocities = np.array([0.1, 0.5, 1.3]) # m/s
+results = ramen.predict_yield_strength(mat, phases, c_Cu, velocities, grain_diameter)
+print("")
+print("Velocities:", velocities, "m/s")
+print("Predicted yield strengths:", results['yield_strength'] * 1e-6, "MPa")
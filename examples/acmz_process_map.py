@@ -13,19 +13,19 @@ import ramenlib as ramen
 def get_depth(data):
     return data["5"].values
 
-# Functions for classifying regions
-def keyhole_classifer(Z, i, j):
+# Functions for classifying regions, evaluated on whole arrays of gridded data
+def keyhole_classifer(Z):
     spot_size = 55
-    depth = Z[0][i,j]
+    depth = Z[0]
     return ramen.keyhole_porosity_classifier(depth, spot_size)
     
-def lack_of_fusion_classifier(Z, i, j):
+def lack_of_fusion_classifier(Z):
     layer_thickness = 30
-    depth = Z[0][i,j]
+    depth = Z[0]
     return ramen.lack_of_fusion_porosity_classifier(depth, layer_thickness)
     
-def nan_classifier(Z, i, j):
-    depth = Z[0][i,j]
+def nan_classifier(Z):
+    depth = Z[0]
     return ramen.nan_classifier(depth)
 
 # Load the AdditiveFOAM process data
@@ -1,2 +1,45 @@
 from ramenlib.core import *
-from ramenlib.process_maps import *
\ No newline at end of file
+from ramenlib.compiled_material import *
+from ramenlib.material_registry import *
+from ramenlib.pipelines import *
+from ramenlib.inverse_design import *
+from ramenlib.fields import *
+from ramenlib.uncertainty import *
+from ramenlib.adaptive_maps import *
+from ramenlib.process_windows import *
+from ramenlib.process_maps_nd import *
+from ramenlib.process_map_artifacts import *
+from ramenlib.instrumentation import *
+from ramenlib.memoization import *
+
+# The process map and point data modules need matplotlib, scipy and/or pandas, so
+# they are only imported on first use of one of their names (e.g.
+# ramen.ProcessMap2D); `import ramenlib` itself only needs numpy and mist.
+_lazy_names = {
+    'ProcessMap2D': 'ramenlib.process_maps',
+    'render_process_maps': 'ramenlib.process_maps',
+    'IncrementalClassification': 'ramenlib.incremental_maps',
+    'IncrementalUpdate': 'ramenlib.incremental_maps',
+    'ProcessMapJob': 'ramenlib.process_map_jobs',
+    'build_process_map': 'ramenlib.process_map_jobs',
+    'run_process_map_jobs': 'ramenlib.process_map_jobs',
+    'PointData': 'ramenlib.point_data',
+    'read_point_data': 'ramenlib.point_data',
+}
+
+# The public names of every module (its __all__); `from ramenlib import *` still
+# gives the lazy names too, loading their modules
+_eager_modules = [core, compiled_material, material_registry, pipelines, inverse_design, fields, uncertainty,
+                  adaptive_maps, process_windows, process_maps_nd, process_map_artifacts, instrumentation, memoization]
+__all__ = [name for module in _eager_modules for name in module.__all__] + list(_lazy_names.keys())
+
+def __getattr__(name):
+    if name in _lazy_names:
+        import importlib
+        value = getattr(importlib.import_module(_lazy_names[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'ramenlib' has no attribute '" + name + "'")
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy_names.keys()))
@@ -0,0 +1,118 @@
+import numpy as np
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['AdaptiveClassification', 'classify_adaptive']
+
+# --------------------------------------------------------------------------------
+# Adaptive classification of process map regions
+# Instead of evaluating the fields and the classifier on every point of a uniform
+# (ny, nx) grid, classify_adaptive starts from every coarse_stride-th grid point and
+# refines quadtree-style: a cell is split into four while its corners do not all
+# have the same classification (or a field changes by more than field_tol, or
+# changes between NaN and a number). Cells whose corners agree are filled with that
+# classification without evaluating their interior, so regions and holes smaller
+# than the coarse cells can be missed.
+#
+# All points are on the uniform grid, so the result can be used directly as a
+# region mask on that grid.
+# --------------------------------------------------------------------------------
+class AdaptiveClassification:
+    def __init__(self, x, y, mask, num_evaluations):
+        self.x = x
+        self.y = y
+        # Classification on the full uniform grid, shape (len(y), len(x))
+        self.mask = mask
+        # Number of grid points where the fields and the classifier were evaluated
+        self.num_evaluations = num_evaluations
+
+    def get_boundary_polylines(self):
+        # List of (n, 2) arrays of (x, y) vertices along the region boundaries
+        import contourpy
+        generator = contourpy.contour_generator(self.x, self.y, self.mask.astype(float))
+        return generator.lines(0.5)
+
+@instrumented()
+def classify_adaptive(x, y, field_func, classifier_func, coarse_stride=16, field_tol=None):
+    # x, y: 1D grid coordinates
+    # field_func(x_points, y_points): list of 1D arrays of the fields at the points
+    # classifier_func(Z_collection): vectorized classifier returning a boolean array
+    nx = len(x)
+    ny = len(y)
+    mask = np.zeros((ny, nx), dtype=bool)
+    evaluated = np.zeros((ny, nx), dtype=bool)
+    fields = None
+
+    def evaluate(i, j):
+        # Evaluates the new points among the (i, j) grid indices
+        nonlocal fields
+        points = np.unique(i * nx + j)
+        points = points[np.logical_not(evaluated.reshape(-1)[points])]
+        if points.size == 0:
+            return 0
+        i_new = points // nx
+        j_new = points % nx
+
+        Z_collection = field_func(np.asarray(x)[j_new], np.asarray(y)[i_new])
+        mask[i_new, j_new] = np.asarray(classifier_func(Z_collection), dtype=bool)
+        evaluated[i_new, j_new] = True
+
+        if fields is None:
+            fields = [np.full((ny, nx), np.nan) for Z in Z_collection]
+        for field, Z in zip(fields, Z_collection):
+            field[i_new, j_new] = Z
+        return points.size
+
+    # Coarse cells
+    coarse_i = np.unique(np.append(np.arange(0, ny, coarse_stride), ny-1))
+    coarse_j = np.unique(np.append(np.arange(0, nx, coarse_stride), nx-1))
+    i0, j0 = np.meshgrid(coarse_i[:-1], coarse_j[:-1], indexing='ij')
+    i1, j1 = np.meshgrid(coarse_i[1:], coarse_j[1:], indexing='ij')
+    i0, i1, j0, j1 = i0.reshape(-1), i1.reshape(-1), j0.reshape(-1), j1.reshape(-1)
+
+    num_evaluations = evaluate(np.concatenate((i0, i0, i1, i1)), np.concatenate((j0, j1, j0, j1)))
+
+    uniform_cells = []
+    while i0.size > 0:
+        corners = [mask[i0,j0], mask[i0,j1], mask[i1,j0], mask[i1,j1]]
+        changes = np.logical_not((corners[0] == corners[1]) & (corners[0] == corners[2]) & (corners[0] == corners[3]))
+
+        for field in fields:
+            field_corners = np.stack((field[i0,j0], field[i0,j1], field[i1,j0], field[i1,j1]))
+            is_nan = np.isnan(field_corners)
+            changes |= np.any(is_nan, axis=0) & np.logical_not(np.all(is_nan, axis=0))
+            if field_tol is not None:
+                is_number = np.logical_not(is_nan)
+                field_range = np.max(field_corners, axis=0, initial=-np.inf, where=is_number) \
+                              - np.min(field_corners, axis=0, initial=np.inf, where=is_number)
+                changes |= np.all(is_number, axis=0) & (field_range > field_tol)
+
+        uniform = np.logical_not(changes)
+        uniform_cells.append((i0[uniform], i1[uniform], j0[uniform], j1[uniform], corners[0][uniform]))
+
+        # Cells that change and can still be split
+        split = changes & ((i1 - i0 > 1) | (j1 - j0 > 1))
+        i0, i1, j0, j1 = i0[split], i1[split], j0[split], j1[split]
+        i_mid = (i0 + i1) // 2
+        j_mid = (j0 + j1) // 2
+
+        # Four children per cell; children with zero height or width (cells that
+        # are already one grid spacing across in that direction) are dropped
+        i0 = np.concatenate((i0, i0, i_mid, i_mid))
+        i1 = np.concatenate((i_mid, i_mid, i1, i1))
+        j0, j1, j_mid = np.tile(j0, 4), np.tile(j1, 4), np.tile(j_mid, 4)
+        n = j_mid.size // 4
+        j0 = np.concatenate((j0[:n], j_mid[n:2*n], j0[2*n:3*n], j_mid[3*n:]))
+        j1 = np.concatenate((j_mid[:n], j1[n:2*n], j_mid[2*n:3*n], j1[3*n:]))
+        keep = (i1 > i0) & (j1 > j0)
+        i0, i1, j0, j1 = i0[keep], i1[keep], j0[keep], j1[keep]
+
+        num_evaluations = num_evaluations + evaluate(np.concatenate((i0, i0, i1, i1)), np.concatenate((j0, j1, j0, j1)))
+
+    # Fill the interiors of the uniform cells, keeping every evaluated point
+    for cells_i0, cells_i1, cells_j0, cells_j1, values in uniform_cells:
+        for ci0, ci1, cj0, cj1, value in zip(cells_i0, cells_i1, cells_j0, cells_j1, values):
+            block = (slice(ci0, ci1+1), slice(cj0, cj1+1))
+            mask[block] = np.where(evaluated[block], mask[block], value)
+
+    return AdaptiveClassification(np.asarray(x), np.asarray(y), mask, num_evaluations)
+# --------------------------------------------------------------------------------
@@ -0,0 +1,108 @@
+import numpy as np
+
+__all__ = ['CompiledMaterial']
+
+# --------------------------------------------------------------------------------
+# Compiled material parameters
+# A flat snapshot of the scalar properties that the models in ramenlib.core read
+# from a mist MaterialInformation object, for one pair of phases. phases[0] is the
+# alpha/matrix phase and phases[1] is the beta/secondary phase. Every model function
+# in ramenlib.core accepts a CompiledMaterial in place of the mist object, which
+# avoids walking the nested property dictionaries on every call.
+#
+# Properties that the material does not define are stored as NaN, so a snapshot
+# can be built for materials that only support some of the models. The snapshot is
+# not updated if the mist object changes afterwards.
+# --------------------------------------------------------------------------------
+def _get_value(properties, name):
+    try:
+        return properties[name].value
+    except KeyError:
+        return np.nan
+
+def _get_first_solute_value(properties, name):
+    # NOTE: For now assume a binary alloy, as in ramenlib.core
+    try:
+        solute_values = properties[name]
+    except KeyError:
+        return np.nan
+    key = list(solute_values.keys())[0]
+    return solute_values[key].value
+
+def _get_phase_properties(mat, phase):
+    try:
+        return mat.phase_properties[phase].properties
+    except KeyError:
+        return {}
+
+class CompiledMaterial:
+    __slots__ = ('phases',
+                 'Dl',
+                 'c_e_alpha', 'c_e_beta',
+                 'm_lalpha', 'm_lbeta',
+                 'gamma_alphal', 'gamma_betal',
+                 'theta_alpha', 'theta_beta',
+                 'M', 'G', 'b', 'poisson_ratio',
+                 'solute_misfit',
+                 'solutes', 'solute_misfits',
+                 'k_HP')
+
+    def __init__(self, mat, phases):
+        self.phases = (phases[0], phases[1])
+
+        liquid = _get_phase_properties(mat, 'liquid')
+        alpha = _get_phase_properties(mat, phases[0])
+        beta = _get_phase_properties(mat, phases[1])
+
+        # Liquid diffusivity
+        self.Dl = _get_first_solute_value(liquid, 'solute_diffusivities')
+
+        # Solubility limits
+        self.c_e_alpha = _get_value(alpha, 'solubility_limit')
+        self.c_e_beta = _get_value(beta, 'solubility_limit')
+
+        # Liquidus slopes
+        self.m_lalpha = _get_value(alpha, 'liquidus_slope')
+        self.m_lbeta = _get_value(beta, 'liquidus_slope')
+
+        # Gibbs-Thomson coefficients
+        self.gamma_alphal = _get_value(alpha, 'gibbs_thomson_coeff')
+        self.gamma_betal = _get_value(beta, 'gibbs_thomson_coeff')
+
+        # Eutectic contact angles, converted from degrees to radians
+        self.theta_alpha = _get_value(alpha, 'eutectic_contact_angle') * 2.0*np.pi/360.0
+        self.theta_beta = _get_value(beta, 'eutectic_contact_angle') * 2.0*np.pi/360.0
+
+        # Matrix properties for the strengthening models
+        self.M = _get_value(alpha, 'taylor_factor')
+        self.G = _get_value(alpha, 'shear_modulus_base_element')
+        self.b = _get_value(alpha, 'burgers_vector_base_element')
+        self.poisson_ratio = _get_value(alpha, 'poisson_ratio_base_element')
+        self.solute_misfit = _get_first_solute_value(alpha, 'solute_misfit_strains')
+
+        # Misfit strains of all of the solutes in the matrix, in the order of the
+        # material data, for the multicomponent solid solution model
+        solute_misfits = alpha.get('solute_misfit_strains', {})
+        self.solutes = tuple(solute_misfits.keys())
+        self.solute_misfits = np.array([solute_misfits[solute].value for solute in self.solutes], dtype=float)
+
+        # Hall-Petch coefficient
+        self.k_HP = _get_value(mat.properties, 'hall_petch_coefficient')
+
+    def with_values(self, values):
+        # Copy of the snapshot with some of the parameters replaced, e.g. by arrays
+        # of sampled values: values is a dictionary of parameter name -> value
+        material = CompiledMaterial.__new__(CompiledMaterial)
+        for name in CompiledMaterial.__slots__:
+            setattr(material, name, getattr(self, name))
+        for name, value in values.items():
+            if name not in CompiledMaterial.__slots__ or name in ('phases', 'solutes'):
+                raise ValueError("Unknown material parameter '" + str(name) + "'")
+            setattr(material, name, value)
+        return material
+
+    def check_phases(self, alpha_phase, beta_phase=None):
+        # The models can only be evaluated for the phase pair the snapshot was built for
+        if alpha_phase != self.phases[0] or (beta_phase is not None and beta_phase != self.phases[1]):
+            raise ValueError("CompiledMaterial was built for phases " + str(list(self.phases))
+                             + ", not " + str([alpha_phase, beta_phase]))
@@ -1,71 +1,436 @@
+import os
+import tempfile
 import mistlib as mist
 import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.instrumentation import instrumented
+from ramenlib.memoization import memoized
+
+__all__ = ['get_P_JH', 'get_dP_JH_dg', 'set_P_JH_backend', 'get_P_JH_backend',
+           'get_P_JH_table_error_bound', 'build_P_JH_table', 'load_P_JH_table',
+           'get_P_JH_interpolated', 'get_dP_JH_dg_interpolated', 'get_AR_JH', 'get_AC_JH',
+           'get_eutectic_lamellar_spacing',
+           'get_eutectic_phase_fractions', 'get_orowan_strengthening_lamella',
+           'get_solid_solution_strengthening', 'SOLID_SOLUTION_SUPERPOSITION_RULES',
+           'get_multicomponent_solid_solution_strengthening', 'get_grain_boundary_strengthening',
+           'keyhole_porosity_classifier', 'lack_of_fusion_porosity_classifier', 'nan_classifier']
 
 # --------------------------------------------------------------------------------
 # Jackson-Hunt model for lamellar spacing for eutectic solidification
 # Model taken from: 
 # Dantzig and Rappaz, Solidification, Chapter 9, EPFL Press, 2017.
 # --------------------------------------------------------------------------------
-def get_P_JH(g, n_max = 10000):
-    # The semianalytic part of of the Jackson-Hunt model is the evaluation of this
-    # infinite sum. Emprically, it seems like 10,000 terms is enough for the 
-    # result to converge. This sum is the slowest part of the calculation by far.
-    # Potentially we could cache P for various values of g if we really need better
-    # performance.
-
-    n = np.arange(1, n_max)
-    return np.sum(np.sin(n*np.pi*g)*np.sin(n*np.pi*g) / ((n*np.pi)*(n*np.pi)*(n*np.pi)))
+def _get_P_JH_coefficients(num_terms):
+    # Coefficients zeta(2n) / (n (2n+1) (2n+2)), n = 1, 2, ..., of the power series
+    # part of the closed form for P(g) (see get_P_JH). The first few even zeta
+    # values are exact, the rest come from a direct sum that converges quickly.
+    n = np.arange(1, num_terms+1)
+    k = np.arange(1, 64)
+    zeta = np.sum(np.power(1.0*k[np.newaxis,:], -2.0*n[:,np.newaxis]), axis=1)
+    zeta[0:4] = [np.pi**2/6.0, np.pi**4/90.0, np.pi**6/945.0, np.pi**8/9450.0]
+    return zeta / (n * (2.0*n + 1.0) * (2.0*n + 2.0))
+
+_P_JH_COEFFICIENTS = _get_P_JH_coefficients(41)
+
+def _get_P_JH_closed_form(g, rtol):
+    # Closed form evaluation of P for a 1D array of g (see get_P_JH)
+    g_reduced = np.mod(g, 1.0)
+    g_reduced = np.minimum(g_reduced, 1.0 - g_reduced)
+    is_zero = (g_reduced == 0.0)
+    g_reduced = np.where(is_zero, 0.5, g_reduced)
+
+    x = g_reduced * g_reduced
+    leading = 0.75 - 0.5*np.log(2.0*np.pi*g_reduced)
+
+    # Number of series terms needed: the coefficients decrease monotonically, so the
+    # tail after num_terms terms is bounded by a geometric series in x. The largest x
+    # in the chunk has both the largest tail and the smallest leading term, so it
+    # sets the number of terms for the whole chunk.
+    max_terms = _P_JH_COEFFICIENTS.size - 1
+    x_finite = x[np.isfinite(x)]
+    num_terms = max_terms
+    if x_finite.size > 0:
+        x_max = np.max(x_finite)
+        leading_min = 0.75 - 0.5*np.log(2.0*np.pi*np.sqrt(x_max))
+        tail_bounds = _P_JH_COEFFICIENTS * np.power(x_max, np.arange(1, max_terms+2)) / (1.0 - x_max)
+        converged = np.nonzero(tail_bounds[:max_terms] <= rtol * leading_min)[0]
+        if converged.size > 0:
+            num_terms = converged[0]
+
+    series = np.zeros_like(x)
+    for coefficient in reversed(_P_JH_COEFFICIENTS[:num_terms]):
+        series += coefficient
+        series *= x
+
+    P = 2.0/np.pi * x * (leading + series)
+    tail = _P_JH_COEFFICIENTS[num_terms] * np.power(x, num_terms+1) / (1.0 - x)
+    error = 2.0/np.pi * x * tail + 4.0 * np.finfo(float).eps * P
+
+    P[is_zero] = 0.0
+    error[is_zero] = 0.0
+    return P, error
+
+@instrumented()
+def get_P_JH(g, n_max = None, rtol = 1.0e-15, return_error = False, chunk_size = 65536):
+    # The semianalytic part of of the Jackson-Hunt model is the infinite sum
+    #   P(g) = sum_n sin^2(n pi g) / (n pi)^3.
+    # Writing sin^2 = (1 - cos(2 n pi g))/2 turns it into a Clausen-type series,
+    # which has the closed form (for 0 < g <= 1/2)
+    #   P(g) = (2/pi) g^2 [3/4 - ln(2 pi g)/2 + sum_n zeta(2n) g^(2n) / (n (2n+1) (2n+2))].
+    # The remaining power series converges like (g^2)^n <= 4^-n, so about 20 terms
+    # reach machine precision. P is periodic in g with period 1 and symmetric about
+    # g = 1/2, so every g is mapped onto (0, 1/2] first.
+    #
+    # Passing n_max evaluates the original truncated sum with n_max-1 terms instead.
+    # That sum underestimates P by at most 1/(2 pi^3 (n_max-1)^2) (about 1.6e-10 for
+    # n_max = 10000), which is the error estimate returned for it.
+    #
+    # With return_error = True, (P, error_estimate) is returned, where the estimate
+    # is an absolute bound on the truncation error plus floating point round-off.
+    #
+    # g can be a scalar or an N-d array. Arrays are evaluated in flattened chunks of
+    # chunk_size values, so the temporary arrays stay bounded for very large inputs.
+
+    g = np.asarray(g, dtype=float)
+    g_flat = g.reshape(-1)
+    P = np.empty(g_flat.shape)
+    error = np.empty(g_flat.shape)
+
+    if n_max is not None:
+        # Each value of g needs a row of n_max-1 terms, so fewer values fit in a chunk
+        n = np.arange(1, n_max)
+        rows_per_chunk = max(1, chunk_size // n.size)
+        for start in range(0, g_flat.size, rows_per_chunk):
+            g_chunk = g_flat[start:start+rows_per_chunk, np.newaxis]
+            sin_n_pi_g = np.sin(n*np.pi*g_chunk)
+            P[start:start+rows_per_chunk] = np.sum(sin_n_pi_g*sin_n_pi_g / ((n*np.pi)*(n*np.pi)*(n*np.pi)), axis=1)
+        error[:] = 1.0 / (2.0 * np.pi**3 * (n_max-1)**2)
+    else:
+        for start in range(0, g_flat.size, chunk_size):
+            P[start:start+chunk_size], error[start:start+chunk_size] = \
+                _get_P_JH_closed_form(g_flat[start:start+chunk_size], rtol)
+
+    P = P.reshape(g.shape)
+    error = error.reshape(g.shape)
+    if g.ndim == 0:
+        P = P[()]
+        error = error[()]
+
+    if return_error:
+        return P, error
+    return P
+
+def _get_dP_JH_dg_closed_form(g):
+    # Derivative of the closed form of P for a 1D array of g (see get_dP_JH_dg)
+    g_reduced = np.mod(g, 1.0)
+    sign = np.where(g_reduced > 0.5, -1.0, 1.0)
+    g_reduced = np.minimum(g_reduced, 1.0 - g_reduced)
+    is_zero = (g_reduced == 0.0)
+    g_reduced = np.where(is_zero, 0.5, g_reduced)
+
+    x = g_reduced * g_reduced
+    leading = 0.75 - 0.5*np.log(2.0*np.pi*g_reduced)
+
+    # S(x) and x dS/dx together, by Horner's rule
+    series = np.zeros_like(x)
+    series_derivative = np.zeros_like(x)
+    n = np.arange(1, _P_JH_COEFFICIENTS.size+1)
+    for coefficient, n_coefficient in zip(reversed(_P_JH_COEFFICIENTS), reversed(n * _P_JH_COEFFICIENTS)):
+        series += coefficient
+        series *= x
+        series_derivative += n_coefficient
+        series_derivative *= x
+
+    dP_dg = sign * 2.0/np.pi * g_reduced * (2.0*(leading + series) - 0.5 + 2.0*series_derivative)
+    dP_dg[is_zero] = 0.0
+    return dP_dg
+
+@instrumented()
+def get_dP_JH_dg(g, chunk_size = 65536):
+    # Analytic derivative of P(g) (see get_P_JH), from the closed form:
+    #   dP/dg = (2/pi) g [2 (3/4 - ln(2 pi g)/2 + S) - 1/2 + 2 sum_n n c_n g^(2n)]
+    # for 0 < g <= 1/2, where S = sum_n c_n g^(2n) is the power series of the closed
+    # form, and the periodicity and symmetry of P for all other g. dP/dg is zero at
+    # integer and half-integer g.
+    g = np.asarray(g, dtype=float)
+    g_flat = g.reshape(-1)
+    dP_dg = np.empty(g_flat.shape)
+    for start in range(0, g_flat.size, chunk_size):
+        dP_dg[start:start+chunk_size] = _get_dP_JH_dg_closed_form(g_flat[start:start+chunk_size])
+
+    dP_dg = dP_dg.reshape(g.shape)
+    if g.ndim == 0:
+        dP_dg = dP_dg[()]
+    return dP_dg
 
+# --------------------------------------------------------------------------------
+# Tabulated backend for P(g)
+# Only the power series part S(g) = sum_n zeta(2n) g^(2n) / (n (2n+1) (2n+2)) of the
+# closed form is tabulated; it is smooth on [0, 1/2], so cubic Hermite interpolation
+# of (S, dS/dg) on a uniform grid has the guaranteed error bound
+#   |S - S_interp| <= h^4/384 max|d^4S/dg^4|,
+# and the logarithmic term is evaluated directly. All the series coefficients are
+# positive, so the fourth derivative takes its maximum at g = 1/2.
+#
+# The table is written once to a small .npy file in the cache directory (the
+# RAMEN_CACHE_DIR environment variable, or ~/.cache/ramen) and memory-mapped by
+# every later process.
+# --------------------------------------------------------------------------------
+_P_JH_BACKEND = 'series'
+_P_JH_TABLES = {}
+
+def set_P_JH_backend(backend):
+    # Module-level choice of how get_AC_JH evaluates P(g): 'series' (closed form,
+    # see get_P_JH) or 'table' (see get_P_JH_interpolated)
+    global _P_JH_BACKEND
+    if backend not in ('series', 'table'):
+        raise ValueError("Unknown P(g) backend '" + str(backend) + "', expected 'series' or 'table'")
+    _P_JH_BACKEND = backend
+
+def get_P_JH_backend():
+    return _P_JH_BACKEND
+
+def get_P_JH_table_error_bound(num_intervals):
+    # Guaranteed absolute bound on the interpolation error of P(g)
+    n = np.arange(1, _P_JH_COEFFICIENTS.size+1)
+    max_fourth_derivative = np.sum(_P_JH_COEFFICIENTS * (2*n)*(2*n-1)*(2*n-2)*(2*n-3) * np.power(0.5, np.maximum(2*n-4, 0)))
+    h = 0.5 / num_intervals
+    return 2.0/np.pi * 0.25 * h**4 / 384.0 * max_fourth_derivative
+
+def build_P_JH_table(num_intervals):
+    # Row k holds the coefficients a_k of the cubic Hermite interpolant of S on each
+    # interval [i h, (i+1) h], written as S = a_0 + a_1 s + a_2 s^2 + a_3 s^3 with
+    # s = g/h - i
+    g = np.linspace(0.0, 0.5, num_intervals+1)
+    x = g * g
+    S = np.zeros_like(g)
+    dS_dx = np.zeros_like(g)
+    for coefficient, n in zip(_P_JH_COEFFICIENTS[::-1], range(_P_JH_COEFFICIENTS.size, 0, -1)):
+        S = (S + coefficient) * x
+        dS_dx = dS_dx * x + n * coefficient
+    h_dS_dg = 0.5 / num_intervals * 2.0 * g * dS_dx
+
+    table = np.empty((4, num_intervals))
+    table[0] = S[:-1]
+    table[1] = h_dS_dg[:-1]
+    table[2] = 3.0*(S[1:] - S[:-1]) - 2.0*h_dS_dg[:-1] - h_dS_dg[1:]
+    table[3] = 2.0*(S[:-1] - S[1:]) + h_dS_dg[:-1] + h_dS_dg[1:]
+    return table
+
+def _get_cache_dir(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.environ.get('RAMEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ramen'))
+    return cache_dir
+
+def load_P_JH_table(num_intervals=1024, cache_dir=None):
+    # Returns the table from memory, from the on-disk cache (memory-mapped), or
+    # builds it and writes it to the cache. Writing goes through a temporary file and
+    # an atomic rename, so concurrent worker processes never see a partial table.
+    # If the cache directory cannot be written, the table is only kept in memory.
+    cache_dir = _get_cache_dir(cache_dir)
+    key = (num_intervals, cache_dir)
+    if key in _P_JH_TABLES:
+        return _P_JH_TABLES[key]
+
+    filename = os.path.join(cache_dir, 'P_JH_table_v1_' + str(num_intervals) + '.npy')
+    table = None
+    if os.path.exists(filename):
+        try:
+            table = np.load(filename, mmap_mode='r')
+            if table.shape != (4, num_intervals):
+                table = None
+        except (OSError, ValueError):
+            table = None
+
+    if table is None:
+        table = build_P_JH_table(num_intervals)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            file_descriptor, temporary_filename = tempfile.mkstemp(suffix='.npy', dir=cache_dir)
+            with os.fdopen(file_descriptor, 'wb') as f:
+                np.save(f, table)
+            os.chmod(temporary_filename, 0o644)
+            os.replace(temporary_filename, filename)
+        except OSError:
+            pass
+
+    _P_JH_TABLES[key] = table
+    return table
+
+def _get_P_JH_interpolated_chunk(g, table, num_intervals):
+    g_reduced = np.mod(g, 1.0)
+    g_reduced = np.minimum(g_reduced, 1.0 - g_reduced)
+    is_zero = (g_reduced == 0.0)
+    g_reduced[is_zero] = 0.5
+
+    t = g_reduced * (2.0 * num_intervals)
+    i = np.minimum(np.nan_to_num(t).astype(np.intp), num_intervals-1)
+    s = t - i
+    S = ((np.take(table[3], i)*s + np.take(table[2], i))*s + np.take(table[1], i))*s + np.take(table[0], i)
+
+    P = 2.0/np.pi * g_reduced * g_reduced * (0.75 - 0.5*np.log(2.0*np.pi*g_reduced) + S)
+    P[is_zero] = 0.0
+    return P
+
+@instrumented()
+def get_P_JH_interpolated(g, num_intervals=1024, return_error=False, cache_dir=None, chunk_size=65536):
+    # Same interface as get_P_JH, but with S(g) interpolated from the table. The
+    # error estimate is the guaranteed interpolation bound plus round-off.
+    table = load_P_JH_table(num_intervals, cache_dir)
+
+    g = np.asarray(g, dtype=float)
+    g_flat = g.reshape(-1)
+    P = np.empty(g_flat.shape)
+    for start in range(0, g_flat.size, chunk_size):
+        P[start:start+chunk_size] = _get_P_JH_interpolated_chunk(g_flat[start:start+chunk_size], table, num_intervals)
+
+    P = P.reshape(g.shape)
+    if g.ndim == 0:
+        P = P[()]
+
+    if return_error:
+        error = get_P_JH_table_error_bound(num_intervals) + 4.0 * np.finfo(float).eps * P
+        return P, error
+    return P
+
+def _get_dP_JH_dg_interpolated_chunk(g, table, num_intervals):
+    g_reduced = np.mod(g, 1.0)
+    sign = np.where(g_reduced > 0.5, -1.0, 1.0)
+    g_reduced = np.minimum(g_reduced, 1.0 - g_reduced)
+    is_zero = (g_reduced == 0.0)
+    g_reduced[is_zero] = 0.5
+
+    t = g_reduced * (2.0 * num_intervals)
+    i = np.minimum(np.nan_to_num(t).astype(np.intp), num_intervals-1)
+    s = t - i
+    S = ((np.take(table[3], i)*s + np.take(table[2], i))*s + np.take(table[1], i))*s + np.take(table[0], i)
+    dS_ds = (3.0*np.take(table[3], i)*s + 2.0*np.take(table[2], i))*s + np.take(table[1], i)
+
+    # g dS/dg with dS/dg = dS/ds / h, h = 1/(2 num_intervals)
+    leading = 0.75 - 0.5*np.log(2.0*np.pi*g_reduced)
+    dP_dg = sign * 2.0/np.pi * g_reduced * (2.0*(leading + S) - 0.5 + g_reduced * (2.0 * num_intervals) * dS_ds)
+    dP_dg[is_zero] = 0.0
+    return dP_dg
+
+@instrumented()
+def get_dP_JH_dg_interpolated(g, num_intervals=1024, cache_dir=None, chunk_size=65536):
+    # Derivative of the interpolated P(g) of get_P_JH_interpolated (the same
+    # expression as get_dP_JH_dg, with S and dS/dg from the cubic interpolant)
+    table = load_P_JH_table(num_intervals, cache_dir)
+
+    g = np.asarray(g, dtype=float)
+    g_flat = g.reshape(-1)
+    dP_dg = np.empty(g_flat.shape)
+    for start in range(0, g_flat.size, chunk_size):
+        dP_dg[start:start+chunk_size] = _get_dP_JH_dg_interpolated_chunk(g_flat[start:start+chunk_size], table, num_intervals)
+
+    dP_dg = dP_dg.reshape(g.shape)
+    if g.ndim == 0:
+        dP_dg = dP_dg[()]
+    return dP_dg
+
+def _get_P_JH_functions(P_backend):
+    # (P, dP/dg) functions of the backend; None is the module-level choice from
+    # set_P_JH_backend
+    if P_backend is None:
+        P_backend = _P_JH_BACKEND
+    if P_backend == 'series':
+        return get_P_JH, get_dP_JH_dg
+    if P_backend == 'table':
+        return get_P_JH_interpolated, get_dP_JH_dg_interpolated
+    raise ValueError("Unknown P(g) backend '" + str(P_backend) + "', expected 'series' or 'table'")
+
+@instrumented()
 def get_AR_JH(gamma_alphal, theta_alpha, m_lalpha, g_alpha, gamma_betal, theta_beta, m_lbeta, g_beta):
     term_alpha = 2.0*gamma_alphal * np.cos(theta_alpha)/(np.abs(m_lalpha) * g_alpha)
     term_beta = 2.0*gamma_betal * np.cos(theta_beta)/(np.abs(m_lbeta) * g_beta)
     AR = np.abs(m_lalpha) * np.abs(m_lbeta) / (np.abs(m_lalpha) + np.abs(m_lbeta) ) * (term_alpha + term_beta)
     return AR
 
-def get_AC_JH(delta_C_0, g_alpha, g_beta, m_lalpha, m_lbeta):
-    P_g_alpha = get_P_JH(g_alpha)
+@instrumented()
+def get_AC_JH(delta_C_0, g_alpha, g_beta, m_lalpha, m_lbeta, P_backend=None):
+    # P_backend overrides the module-level choice from set_P_JH_backend
+    get_P = _get_P_JH_functions(P_backend)[0]
+    P_g_alpha = get_P(g_alpha)
     AC = delta_C_0/(g_alpha * g_beta) * np.abs(m_lalpha) * np.abs(m_lbeta) / (np.abs(m_lalpha) + np.abs(m_lbeta) ) * P_g_alpha
     return AC
 
-def get_eutectic_lamellar_spacing(mat, phases, phase_fractions, solidification_velocity):
+@instrumented()
+@memoized()
+def get_eutectic_lamellar_spacing(mat, phases, phase_fractions, solidification_velocity, P_backend=None, return_derivatives=False):
     # TODO: This needs to check that the material is a binary alloy
 
-    # Get the diffusivity
-    solute_diffusivities = mat.phase_properties['liquid'].properties['solute_diffusivities']
-    key = list(solute_diffusivities.keys())[0]
-    Dl = solute_diffusivities[key].value
+    # With return_derivatives=True, (spacing, derivatives) is returned, where
+    # derivatives has the analytic derivatives of the spacing with respect to
+    # 'solidification_velocity' and 'phase_fraction', the fraction of phases[0] (with
+    # the fraction of phases[1] changing by the opposite amount).
+
+    # The phase fractions and the solidification velocity can be scalars or arrays
+    # that broadcast against each other, e.g. phase fractions of shape (N, 1) from a
+    # composition sweep and velocities of shape (1, M) give an (N, M) spacing. P(g)
+    # is only evaluated once per phase fraction, not once per output value.
+
+    # mat can be a mist MaterialInformation object or a CompiledMaterial
+    if isinstance(mat, CompiledMaterial):
+        mat.check_phases(phases[0], phases[1])
+        Dl = mat.Dl
+        delta_c_e = mat.c_e_beta - mat.c_e_alpha
+        m_lalpha, m_lbeta = mat.m_lalpha, mat.m_lbeta
+        gamma_alphal, gamma_betal = mat.gamma_alphal, mat.gamma_betal
+        theta_alpha, theta_beta = mat.theta_alpha, mat.theta_beta
+    else:
+        # Get the diffusivity
+        solute_diffusivities = mat.phase_properties['liquid'].properties['solute_diffusivities']
+        key = list(solute_diffusivities.keys())[0]
+        Dl = solute_diffusivities[key].value
 
-    # Get the solubility limits
-    c_e_alpha = mat.phase_properties[phases[0]].properties['solubility_limit'].value
-    c_e_beta = mat.phase_properties[phases[1]].properties['solubility_limit'].value
-    delta_c_e = c_e_beta - c_e_alpha
+        # Get the solubility limits
+        c_e_alpha = mat.phase_properties[phases[0]].properties['solubility_limit'].value
+        c_e_beta = mat.phase_properties[phases[1]].properties['solubility_limit'].value
+        delta_c_e = c_e_beta - c_e_alpha
 
-    # Get the liquidus slopes
-    m_lalpha = mat.phase_properties[phases[0]].properties['liquidus_slope'].value
-    m_lbeta = mat.phase_properties[phases[1]].properties['liquidus_slope'].value
+        # Get the liquidus slopes
+        m_lalpha = mat.phase_properties[phases[0]].properties['liquidus_slope'].value
+        m_lbeta = mat.phase_properties[phases[1]].properties['liquidus_slope'].value
 
-    # Get the Gibbs-Thomson coefficients
-    gamma_alphal = mat.phase_properties[phases[0]].properties['gibbs_thomson_coeff'].value
-    gamma_betal = mat.phase_properties[phases[1]].properties['gibbs_thomson_coeff'].value
+        # Get the Gibbs-Thomson coefficients
+        gamma_alphal = mat.phase_properties[phases[0]].properties['gibbs_thomson_coeff'].value
+        gamma_betal = mat.phase_properties[phases[1]].properties['gibbs_thomson_coeff'].value
 
-    # Get the eutectic contact angles
-    theta_alpha = mat.phase_properties[phases[0]].properties['eutectic_contact_angle'].value
-    theta_beta = mat.phase_properties[phases[1]].properties['eutectic_contact_angle'].value
+        # Get the eutectic contact angles
+        theta_alpha = mat.phase_properties[phases[0]].properties['eutectic_contact_angle'].value
+        theta_beta = mat.phase_properties[phases[1]].properties['eutectic_contact_angle'].value
 
-    theta_alpha = theta_alpha * 2.0*np.pi/360.0
-    theta_beta = theta_beta * 2.0*np.pi/360.0
+        theta_alpha = theta_alpha * 2.0*np.pi/360.0
+        theta_beta = theta_beta * 2.0*np.pi/360.0
 
     # Calculate the eutectic phase fractions
     g_alpha = phase_fractions[phases[0]]
     g_beta = phase_fractions[phases[1]]  
 
-    AC = get_AC_JH(delta_c_e, g_alpha, g_beta, m_lalpha, m_lbeta)
+    AC = get_AC_JH(delta_c_e, g_alpha, g_beta, m_lalpha, m_lbeta, P_backend)
     AR = get_AR_JH(gamma_alphal, theta_alpha, m_lalpha, g_alpha, gamma_betal, theta_beta, m_lbeta, g_beta)
 
     # Calculate the spacing
     spacing = np.sqrt(AR * Dl /(AC * solidification_velocity))
 
-    return spacing
+    if not return_derivatives:
+        return spacing
+
+    # spacing^2 is proportional to AR/(AC V), so d(spacing) = spacing/2 (dAR/AR - dAC/AC - dV/V).
+    # AC depends on g_alpha through 1/(g_alpha g_beta) and P(g_alpha); P and dP/dg
+    # come from the same backend as the value, so the derivative is the derivative of
+    # the spacing that is returned.
+    term_alpha = 2.0*gamma_alphal * np.cos(theta_alpha)/(np.abs(m_lalpha) * g_alpha)
+    term_beta = 2.0*gamma_betal * np.cos(theta_beta)/(np.abs(m_lbeta) * g_beta)
+    dAR_dg_alpha_over_AR = (term_beta/g_beta - term_alpha/g_alpha) / (term_alpha + term_beta)
+    get_P, get_dP_dg = _get_P_JH_functions(P_backend)
+    dAC_dg_alpha_over_AC = get_dP_dg(g_alpha)/get_P(g_alpha) - 1.0/g_alpha + 1.0/g_beta
+
+    derivatives = {}
+    derivatives['solidification_velocity'] = -0.5 * spacing / solidification_velocity
+    derivatives['phase_fraction'] = 0.5 * spacing * (dAR_dg_alpha_over_AR - dAC_dg_alpha_over_AC)
+    return spacing, derivatives
 
 # --------------------------------------------------------------------------------
 
@@ -75,10 +440,18 @@ def get_eutectic_lamellar_spacing(mat, phases, phase_fractions, solidification_v
 # Dantzig and Rappaz, Solidification, Chapter 9, EPFL Press, 2017.
 # --------------------------------------------------------------------------------
 
-def get_eutectic_phase_fractions(mat, phases, solute_composition):
+@instrumented()
+def get_eutectic_phase_fractions(mat, phases, solute_composition, return_derivatives=False):
+    # With return_derivatives=True, (phase_fractions, derivatives) is returned, where
+    # derivatives has the derivatives of the phase fractions with respect to the
+    # solute composition, with the same keys as the phase fractions
      # Get the solubility limits
-    c_e_alpha = mat.phase_properties[phases[0]].properties['solubility_limit'].value
-    c_e_beta = mat.phase_properties[phases[1]].properties['solubility_limit'].value
+    if isinstance(mat, CompiledMaterial):
+        mat.check_phases(phases[0], phases[1])
+        c_e_alpha, c_e_beta = mat.c_e_alpha, mat.c_e_beta
+    else:
+        c_e_alpha = mat.phase_properties[phases[0]].properties['solubility_limit'].value
+        c_e_beta = mat.phase_properties[phases[1]].properties['solubility_limit'].value
 
     # Calculate the eutectic phase fractions
     g_alpha = (solute_composition - c_e_beta)/(c_e_alpha - c_e_beta)
@@ -88,6 +461,11 @@ def get_eutectic_phase_fractions(mat, phases, solute_composition):
     eutectic_phase_fractions[phases[0]] = g_alpha
     eutectic_phase_fractions[phases[1]] = g_beta
 
+    if return_derivatives:
+        derivatives = {}
+        derivatives[phases[0]] = 1.0/(c_e_alpha - c_e_beta) * np.ones_like(g_alpha)
+        derivatives[phases[1]] = -derivatives[phases[0]]
+        return eutectic_phase_fractions, derivatives
 
     return eutectic_phase_fractions
 
@@ -104,20 +482,28 @@ def get_eutectic_phase_fractions(mat, phases, solute_composition):
 # https://doi.org/10.1016/j.msea.2022.142928
 # --------------------------------------------------------------------------------
 
-def get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, eutectic_spacing, phase_fractions):
+@instrumented()
+def get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, eutectic_spacing, phase_fractions, return_derivatives=False):
+    # With return_derivatives=True, (strengthening, derivatives) is returned, where
+    # derivatives has the partial derivatives with respect to 'eutectic_spacing' and
+    # 'phase_fraction', the fraction of the secondary phase
     # First, get the material properties
 
-    # Taylor factor
-    M = mat.phase_properties[matrix_phase].properties['taylor_factor'].value
+    if isinstance(mat, CompiledMaterial):
+        mat.check_phases(matrix_phase, secondary_phase)
+        M, G, b, poisson_ratio = mat.M, mat.G, mat.b, mat.poisson_ratio
+    else:
+        # Taylor factor
+        M = mat.phase_properties[matrix_phase].properties['taylor_factor'].value
 
-    # Shear modulus of the base element of the matrix
-    G = mat.phase_properties[matrix_phase].properties['shear_modulus_base_element'].value
+        # Shear modulus of the base element of the matrix
+        G = mat.phase_properties[matrix_phase].properties['shear_modulus_base_element'].value
 
-    # Burgers vector
-    b = mat.phase_properties[matrix_phase].properties['burgers_vector_base_element'].value
+        # Burgers vector
+        b = mat.phase_properties[matrix_phase].properties['burgers_vector_base_element'].value
 
-    # Poisson ratio
-    poisson_ratio = mat.phase_properties[matrix_phase].properties['poisson_ratio_base_element'].value
+        # Poisson ratio
+        poisson_ratio = mat.phase_properties[matrix_phase].properties['poisson_ratio_base_element'].value
 
     # Calculate the secondary phase fraction
     g_secondary = phase_fractions[secondary_phase]
@@ -128,6 +514,16 @@ def get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, eutecti
     # Finally calculate the strengthening
     orowan_strengthening_lamella = M * 0.4 * G * b / (np.pi * np.sqrt(1.0-poisson_ratio)) * np.log(2.0*R/b) / eutectic_spacing
 
+    if return_derivatives:
+        # R is proportional to the spacing, and ln(R) changes with g_secondary through
+        # -ln(3 pi/(4 g_secondary) - 1.64)/2
+        prefactor = M * 0.4 * G * b / (np.pi * np.sqrt(1.0-poisson_ratio))
+        derivatives = {}
+        derivatives['eutectic_spacing'] = prefactor * (1.0 - np.log(2.0*R/b)) / eutectic_spacing**2
+        derivatives['phase_fraction'] = prefactor / eutectic_spacing \
+            * (3.0*np.pi/(8.0*g_secondary**2)) / (3.0*np.pi/(4.0*g_secondary) - 1.64)
+        return orowan_strengthening_lamella, derivatives
+
     return orowan_strengthening_lamella
 
 # --------------------------------------------------------------------------------
@@ -139,30 +535,37 @@ def get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, eutecti
 # mechanisms in a heat-treated additively manufactured Al–Cu–Mn–Zr alloy. Mater. Sci. Eng. A, 840, 142928 (2022). 
 # https://doi.org/10.1016/j.msea.2022.142928
 # --------------------------------------------------------------------------------
+@instrumented()
 def get_solid_solution_strengthening(mat, matrix_phase):
     # NOTE: For now assume a binary alloy
 
     # First, get the material properties
 
-    # Taylor factor
-    M = mat.phase_properties[matrix_phase].properties['taylor_factor'].value
+    if isinstance(mat, CompiledMaterial):
+        mat.check_phases(matrix_phase)
+        M, G, b, poisson_ratio = mat.M, mat.G, mat.b, mat.poisson_ratio
+        solute_misfit = mat.solute_misfit
+        c_matrix = mat.c_e_alpha
+    else:
+        # Taylor factor
+        M = mat.phase_properties[matrix_phase].properties['taylor_factor'].value
 
-    # Shear modulus of the base element of the matrix
-    G = mat.phase_properties[matrix_phase].properties['shear_modulus_base_element'].value
+        # Shear modulus of the base element of the matrix
+        G = mat.phase_properties[matrix_phase].properties['shear_modulus_base_element'].value
 
-    # Burgers vector
-    b = mat.phase_properties[matrix_phase].properties['burgers_vector_base_element'].value
+        # Burgers vector
+        b = mat.phase_properties[matrix_phase].properties['burgers_vector_base_element'].value
 
-    # Poisson ratio
-    poisson_ratio = mat.phase_properties[matrix_phase].properties['poisson_ratio_base_element'].value
+        # Poisson ratio
+        poisson_ratio = mat.phase_properties[matrix_phase].properties['poisson_ratio_base_element'].value
 
-    # Solute misfit strain
-    solute_misfits = mat.phase_properties[matrix_phase].properties['solute_misfit_strains']
-    key = list(solute_misfits.keys())[0]
-    solute_misfit = solute_misfits[key].value
+        # Solute misfit strain
+        solute_misfits = mat.phase_properties[matrix_phase].properties['solute_misfit_strains']
+        key = list(solute_misfits.keys())[0]
+        solute_misfit = solute_misfits[key].value
 
-    # Average matrix composition (I assume this is the same as the solubility limit of the matrix phase)
-    c_matrix = mat.phase_properties[matrix_phase].properties['solubility_limit'].value
+        # Average matrix composition (I assume this is the same as the solubility limit of the matrix phase)
+        c_matrix = mat.phase_properties[matrix_phase].properties['solubility_limit'].value
     c_matrix_fraction = 0.01 * c_matrix
 
     # Now calculate the solid solution strengthening
@@ -174,6 +577,93 @@ def get_solid_solution_strengthening(mat, matrix_phase):
     return ss_strengthening
 # --------------------------------------------------------------------------------
 
+# --------------------------------------------------------------------------------
+# Multicomponent solid solution strengthening
+# The solid solution model above for every solute in the matrix phase at once: the
+# misfit strains of all of the solutes are read from the material in one pass, and the
+# contributions of the solutes are evaluated together over arrays of matrix
+# compositions, then combined with a superposition rule:
+#   'linear':          sum_i sigma_i
+#   'root_sum_square': (sum_i sigma_i^2)^(1/2)
+#   'labusch':         (sum_i sigma_i^(3/2))^(2/3), following Labusch's concentration
+#                      dependence (Gypen and Deruyttere with q = 2/3)
+# Superposition rules taken from:
+# Gypen, L. A., Deruyttere, A. Multi-component solid solution hardening. J Mater Sci
+# 12, 1028-1033 (1977). https://doi.org/10.1007/BF00540987
+# --------------------------------------------------------------------------------
+SOLID_SOLUTION_SUPERPOSITION_RULES = ['linear', 'root_sum_square', 'labusch']
+
+@instrumented()
+def get_multicomponent_solid_solution_strengthening(mat, matrix_phase, solute_compositions=None, superposition='linear', return_contributions=False):
+    # solute_compositions: dictionary of solute -> matrix composition of that solute
+    # (at. %, scalars or arrays that broadcast against each other). If it is None,
+    # the solubility limit of the matrix phase is used, as in
+    # get_solid_solution_strengthening, which is only defined for a single solute.
+    # With return_contributions=True, the contributions of the individual solutes are
+    # also returned, as a dictionary.
+    if superposition not in SOLID_SOLUTION_SUPERPOSITION_RULES:
+        raise ValueError("Unknown superposition rule '" + str(superposition) + "', expected one of "
+                         + str(SOLID_SOLUTION_SUPERPOSITION_RULES))
+
+    # First, get the material properties
+
+    if isinstance(mat, CompiledMaterial):
+        mat.check_phases(matrix_phase)
+        M, G, b, poisson_ratio = mat.M, mat.G, mat.b, mat.poisson_ratio
+        solutes, solute_misfits = mat.solutes, mat.solute_misfits
+        c_matrix = mat.c_e_alpha
+    else:
+        properties = mat.phase_properties[matrix_phase].properties
+
+        # Taylor factor
+        M = properties['taylor_factor'].value
+
+        # Shear modulus of the base element of the matrix
+        G = properties['shear_modulus_base_element'].value
+
+        # Burgers vector
+        b = properties['burgers_vector_base_element'].value
+
+        # Poisson ratio
+        poisson_ratio = properties['poisson_ratio_base_element'].value
+
+        # Solute misfit strains
+        solutes = tuple(properties['solute_misfit_strains'].keys())
+        solute_misfits = np.array([properties['solute_misfit_strains'][solute].value for solute in solutes], dtype=float)
+
+        c_matrix = properties['solubility_limit'].value if solute_compositions is None else None
+
+    if solute_compositions is None:
+        if len(solutes) != 1:
+            raise ValueError("The matrix compositions of the solutes " + str(list(solutes)) + " are needed")
+        solute_compositions = {solutes[0]: c_matrix}
+    if set(solute_compositions.keys()) != set(solutes):
+        raise ValueError("Expected the matrix compositions of the solutes " + str(list(solutes))
+                         + ", got " + str(list(solute_compositions.keys())))
+
+    # Matrix compositions as fractions, stacked along the first axis in the order of
+    # the solutes
+    c_matrix_fractions = 0.01 * np.stack(np.broadcast_arrays(*[np.asarray(solute_compositions[solute], dtype=float) for solute in solutes]))
+    solute_misfits = solute_misfits.reshape((len(solutes),) + (1,) * (c_matrix_fractions.ndim - 1))
+
+    # Now calculate the contributions of all of the solutes together
+    w = 5.0 * b
+
+    prefactor = M * (3./8.)**(2./3.) * ((1.+poisson_ratio)/(1.-poisson_ratio))**(4./3.) * (w/b)**(1./3.) * G
+    contributions = prefactor * np.abs(solute_misfits)**(4./3.) * c_matrix_fractions**(2./3.)
+
+    if superposition == 'linear':
+        ss_strengthening = np.sum(contributions, axis=0)
+    elif superposition == 'root_sum_square':
+        ss_strengthening = np.sqrt(np.sum(contributions**2, axis=0))
+    else:
+        ss_strengthening = np.sum(contributions**1.5, axis=0)**(2./3.)
+
+    if return_contributions:
+        return ss_strengthening, {solute: contributions[i] for i, solute in enumerate(solutes)}
+    return ss_strengthening
+# --------------------------------------------------------------------------------
+
 # --------------------------------------------------------------------------------
 # Grain boundary strengthening via the Hall-Petch effect
 # Model taken from: 
@@ -181,15 +671,24 @@ def get_solid_solution_strengthening(mat, matrix_phase):
 # mechanisms in a heat-treated additively manufactured Al–Cu–Mn–Zr alloy. Mater. Sci. Eng. A, 840, 142928 (2022). 
 # https://doi.org/10.1016/j.msea.2022.142928
 # --------------------------------------------------------------------------------
-def get_grain_boundary_strengthening(mat, grain_diameter):
+@instrumented()
+def get_grain_boundary_strengthening(mat, grain_diameter, return_derivatives=False):
+    # With return_derivatives=True, (strengthening, derivatives) is returned, where
+    # derivatives has the derivative with respect to 'grain_diameter'
     # First, get the material properties
 
     # Hall-Petch coefficient
-    k_HP = mat.properties['hall_petch_coefficient'].value
+    if isinstance(mat, CompiledMaterial):
+        k_HP = mat.k_HP
+    else:
+        k_HP = mat.properties['hall_petch_coefficient'].value
 
     # Now calculate the grain boundary strengthening
     gb_strengthening = k_HP / np.sqrt(grain_diameter)
 
+    if return_derivatives:
+        return gb_strengthening, {'grain_diameter': -0.5 * gb_strengthening / grain_diameter}
+
     return gb_strengthening
 # --------------------------------------------------------------------------------
 
@@ -199,12 +698,9 @@ def get_grain_boundary_strengthening(mat, grain_diameter):
 # John Coleman, ORNL (origin unknown beyond that)
 # --------------------------------------------------------------------------------
 def keyhole_porosity_classifier(depth, spot_size):
-    if depth/spot_size < 2.0:
-        # Keyholing expected
-        return False
-    else:
-        # No keyholing expected
-        return True
+    # Works elementwise on scalars or arrays:
+    # False where keyholing is expected, True where no keyholing is expected
+    return np.logical_not(depth/spot_size < 2.0)
 # --------------------------------------------------------------------------------
 
 # --------------------------------------------------------------------------------
@@ -213,12 +709,9 @@ def keyhole_porosity_classifier(depth, spot_size):
 # John Coleman, ORNL (origin unknown beyond that)
 # --------------------------------------------------------------------------------
 def lack_of_fusion_porosity_classifier(depth, layer_thickness):
-    if depth > layer_thickness:
-        # No lack-of-fusion porosity expected
-        return False
-    else:
-        # Lack-of-fusion porosity expected
-        return True
+    # Works elementwise on scalars or arrays:
+    # False where no lack-of-fusion porosity is expected, True where it is expected
+    return np.logical_not(depth > layer_thickness)
 # --------------------------------------------------------------------------------
 
 # --------------------------------------------------------------------------------
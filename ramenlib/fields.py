@@ -0,0 +1,106 @@
+import os
+import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.pipelines import predict_yield_strength
+from ramenlib.pipelines import _get_flat_input
+from ramenlib.pipelines import _get_chunk
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['MICROSTRUCTURE_FIELDS', 'evaluate_microstructure_fields']
+
+# --------------------------------------------------------------------------------
+# Microstructure and strength fields from thermal histories
+# evaluate_microstructure_fields takes arrays of the solidification velocity (and
+# optionally the thermal gradient) on the cells of a thermal simulation, e.g. 3D
+# arrays or np.memmap/np.load(mmap_mode='r') views of solver output. It evaluates
+# the lamellar spacing and the strengthening contributions cell by cell in blocks of
+# block_size cells, so the memory used for the computation is set by block_size and
+# not by the number of cells.
+#
+# With output_dir, each output field is a memory-mapped .npy file in that directory
+# (<name>.npy, readable with np.load(..., mmap_mode='r')) and the full fields are
+# never held in memory. Otherwise the fields are returned as in-memory arrays.
+#
+# Cells that did not solidify (velocity that is zero, negative or NaN) are NaN in all
+# of the output fields.
+#
+# Inputs with a single value (e.g. a uniform composition) are passed to
+# predict_yield_strength as scalars, so the composition-only terms (the phase
+# fractions and P(g)) are evaluated once per block and not once per cell.
+# --------------------------------------------------------------------------------
+MICROSTRUCTURE_FIELDS = ['lamellar_spacing', 'orowan_strengthening_lamella', 'grain_boundary_strengthening',
+                         'yield_strength', 'cooling_rate']
+
+@instrumented()
+def evaluate_microstructure_fields(mat, phases, solidification_velocity, solute_composition, grain_diameter,
+                                   thermal_gradient=None, fields=None, block_size=1048576, output_dir=None,
+                                   dtype=np.float64, P_backend=None):
+    # phases[0] is the matrix phase and phases[1] the secondary phase.
+    # solute_composition: scalar or array that broadcasts against the velocity
+    # grain_diameter: scalar, array, or func(thermal_gradient, solidification_velocity)
+    #   evaluated on each block (e.g. a grain size model in terms of G and V)
+    # fields: names of the output fields, by default all of MICROSTRUCTURE_FIELDS
+    #   ('cooling_rate' = G*V needs the thermal gradient)
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+
+    if fields is None:
+        fields = [name for name in MICROSTRUCTURE_FIELDS if name != 'cooling_rate' or thermal_gradient is not None]
+    for name in fields:
+        if name not in MICROSTRUCTURE_FIELDS:
+            raise ValueError("Unknown field '" + str(name) + "', expected one of " + str(MICROSTRUCTURE_FIELDS))
+    if (thermal_gradient is None) and (('cooling_rate' in fields) or callable(grain_diameter)):
+        raise ValueError("The cooling rate and grain diameter functions need the thermal gradient")
+
+    shape = np.shape(solidification_velocity)
+
+    results = {}
+    for name in fields:
+        if output_dir is None:
+            results[name] = np.empty(shape, dtype=dtype)
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            results[name] = np.lib.format.open_memmap(os.path.join(output_dir, name + '.npy'), mode='w+',
+                                                      dtype=dtype, shape=shape)
+
+    # Flat inputs and outputs. For contiguous arrays (including memory maps) these are
+    # views, and slices of broadcast inputs only copy one block.
+    velocity = _get_flat_input(solidification_velocity, shape)
+    solute_composition = _get_flat_input(solute_composition, shape)
+    if thermal_gradient is not None:
+        thermal_gradient = _get_flat_input(thermal_gradient, shape)
+    if not callable(grain_diameter):
+        grain_diameter = _get_flat_input(grain_diameter, shape)
+    outputs = {name: results[name].reshape(-1) for name in fields}
+
+    size = int(np.prod(shape))
+    for start in range(0, size, block_size):
+        block = slice(start, min(start+block_size, size))
+
+        V = np.asarray(_get_chunk(velocity, block), dtype=float)
+        solidified = V > 0.0
+        V = np.where(solidified, V, 1.0)
+
+        if thermal_gradient is not None:
+            G = np.asarray(_get_chunk(thermal_gradient, block), dtype=float)
+        if callable(grain_diameter):
+            d = np.asarray(grain_diameter(G, V), dtype=float)
+        else:
+            d = np.asarray(_get_chunk(grain_diameter, block), dtype=float)
+
+        block_results = predict_yield_strength(mat, phases, np.asarray(_get_chunk(solute_composition, block), dtype=float), V, d,
+                                               chunk_size=block_size, P_backend=P_backend)
+        if thermal_gradient is not None:
+            block_results['cooling_rate'] = G * V
+
+        for name in fields:
+            out = outputs[name][block]
+            out[...] = block_results[name]
+            out[np.logical_not(solidified)] = np.nan
+
+    for name in fields:
+        if isinstance(results[name], np.memmap):
+            results[name].flush()
+
+    return results
+# --------------------------------------------------------------------------------
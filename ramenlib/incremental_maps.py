@@ -0,0 +1,155 @@
+import numpy as np
+from ramenlib.process_maps import _get_barycentric_weights
+from ramenlib.instrumentation import instrumented
+from ramenlib.instrumentation import timed_section
+
+__all__ = ['IncrementalUpdate', 'IncrementalClassification']
+
+# --------------------------------------------------------------------------------
+# Incremental process map regions
+# IncrementalClassification keeps the linearly interpolated fields and the region
+# mask of a point data region up to date as simulation points are appended to the
+# point data, without rebuilding the map:
+# 1. the new points are inserted into the existing (incremental) Delaunay
+#    triangulation
+# 2. the triangles that were added are found by comparing the sets of triangles
+#    before and after the insertion. The area they cover is exactly the area whose
+#    interpolation changed: the triangles that were removed, plus any growth of the
+#    convex hull.
+# 3. only the grid cells inside the bounding boxes of the added triangles are
+#    interpolated and classified again
+# so refreshing the map after one new simulation costs about the number of grid cells
+# near the new point, not the size of the grid.
+#
+# Points are only appended: the first rows of the data have to be the points the map
+# was built (or last updated) with. If func_list gives new values at the existing
+# points, all grid cells are re-interpolated (with the cached weights) and classified.
+# --------------------------------------------------------------------------------
+def _get_simplex_keys(simplices):
+    # One key per triangle that doesn't depend on the order of its vertices or on
+    # its index in the triangulation: the sorted vertex indices as a single void
+    # value, so keys compare as rows (np.isin) for any number of points
+    simplices = np.ascontiguousarray(np.sort(simplices, axis=1).astype(np.int64))
+    return simplices.view(np.dtype((np.void, 3 * simplices.itemsize))).reshape(-1)
+
+def _get_cells_in_boxes(i0, i1, j0, j1, nx):
+    # Flat indices of the grid cells in the boxes [i0, i1) x [j0, j1)
+    heights = np.maximum(i1 - i0, 0)
+    widths = np.maximum(j1 - j0, 0)
+    counts = heights * widths
+    box = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = i0[box] + offset // widths[box]
+    columns = j0[box] + offset % widths[box]
+    return np.unique(rows * nx + columns)
+
+class IncrementalUpdate:
+    def __init__(self, num_new_points, updated_cells, flipped):
+        self.num_new_points = num_new_points
+        # Flat indices (row * len(x) + column) of the grid cells that were evaluated
+        self.updated_cells = updated_cells
+        # (rows, columns) of the grid cells whose classification changed, e.g. for
+        # mask[flipped]
+        self.flipped = flipped
+
+class IncrementalClassification:
+    def __init__(self, x, y, data, func_list, classifier_func, x_name, y_name):
+        # x, y: grid coordinates; the fields and mask have the shape (len(y), len(x))
+        # classifier_func(Z_collection): vectorized classifier, evaluated on 1D
+        #   arrays of the field values at the cells being updated
+        from scipy.spatial import Delaunay
+
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.func_list = func_list
+        self.classifier_func = classifier_func
+        self.x_name = x_name
+        self.y_name = y_name
+        shape = (len(self.y), len(self.x))
+
+        points = self._get_points(data)
+        with timed_section('IncrementalClassification.triangulation', points.shape[0]):
+            self.triangulation = Delaunay(points, incremental=True)
+        self.num_points = points.shape[0]
+
+        # Enclosing triangle vertices (-1 outside of the convex hull) and barycentric
+        # weights of every grid cell
+        self._vertices = np.full((len(self.y) * len(self.x), 3), -1, dtype=np.int64)
+        self._weights = np.zeros((len(self.y) * len(self.x), 3))
+
+        self._z_points = [np.asarray(func(data), dtype=float) for func in func_list]
+        self.Z_collection = [np.full(shape, np.nan) for func in func_list]
+        self.mask = np.zeros(shape, dtype=bool)
+        self._locate_cells(np.arange(self.mask.size))
+        self._evaluate_cells(np.arange(self.mask.size))
+
+    def _get_points(self, data):
+        return np.column_stack((np.asarray(data[self.x_name].values, dtype=float),
+                                np.asarray(data[self.y_name].values, dtype=float)))
+
+    def _locate_cells(self, cells):
+        # Enclosing triangles and weights of the cells (flat indices)
+        rows, columns = np.divmod(cells, len(self.x))
+        grid_points = np.column_stack((self.x[columns], self.y[rows]))
+        simplices, weights = _get_barycentric_weights(self.triangulation, grid_points)
+        inside = (simplices >= 0)
+        self._vertices[cells] = np.where(inside[:,np.newaxis], self.triangulation.simplices[simplices], -1)
+        self._weights[cells] = weights
+
+    def _evaluate_cells(self, cells):
+        # Interpolates and classifies the cells; returns the flat indices of the cells
+        # whose classification changed
+        vertices = self._vertices[cells]
+        outside = (vertices[:,0] < 0)
+        for Z, z_points in zip(self.Z_collection, self._z_points):
+            values = np.sum(self._weights[cells] * z_points[vertices], axis=1)
+            values[outside] = np.nan
+            Z.flat[cells] = values
+
+        classification = np.asarray(self.classifier_func([Z.flat[cells] for Z in self.Z_collection]), dtype=bool)
+        classification = np.broadcast_to(classification, cells.shape)
+        flipped = cells[classification != self.mask.flat[cells]]
+        self.mask.flat[cells] = classification
+        return flipped
+
+    @instrumented()
+    def update(self, data):
+        # Adds the points after the first self.num_points rows of data and returns an
+        # IncrementalUpdate
+        points = self._get_points(data)
+        if points.shape[0] < self.num_points:
+            raise ValueError("The point data has " + str(points.shape[0]) + " points, expected at least the "
+                             + str(self.num_points) + " points the map was built with")
+        new_points = points[self.num_points:]
+
+        z_points = [np.asarray(func(data), dtype=float) for func in self.func_list]
+        values_changed = any(not np.array_equal(z[:self.num_points], old_z, equal_nan=True)
+                             for z, old_z in zip(z_points, self._z_points))
+        self._z_points = z_points
+
+        cells = np.zeros(0, dtype=np.int64)
+        if new_points.shape[0] > 0:
+            old_simplices = self.triangulation.simplices.copy()
+            with timed_section('IncrementalClassification.add_points', new_points.shape[0]):
+                self.triangulation.add_points(new_points)
+            self.num_points = points.shape[0]
+
+            # The triangles that were not in the triangulation before
+            old_keys = _get_simplex_keys(old_simplices)
+            added = np.isin(_get_simplex_keys(self.triangulation.simplices), old_keys, invert=True)
+
+            # Grid cells in the bounding boxes of the added triangles
+            corners = self.triangulation.points[self.triangulation.simplices[added]]
+            i0 = np.searchsorted(self.y, np.min(corners[:,:,1], axis=1), 'left')
+            i1 = np.searchsorted(self.y, np.max(corners[:,:,1], axis=1), 'right')
+            j0 = np.searchsorted(self.x, np.min(corners[:,:,0], axis=1), 'left')
+            j1 = np.searchsorted(self.x, np.max(corners[:,:,0], axis=1), 'right')
+            cells = _get_cells_in_boxes(i0, i1, j0, j1, len(self.x))
+            self._locate_cells(cells)
+
+        if values_changed:
+            cells = np.arange(self.mask.size)
+        flipped = self._evaluate_cells(cells)
+
+        return IncrementalUpdate(new_points.shape[0], cells, np.divmod(flipped, len(self.x)))
+# --------------------------------------------------------------------------------
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import threading
+import functools
+
+__all__ = ['enable_instrumentation', 'disable_instrumentation', 'is_instrumentation_enabled',
+           'reset_instrumentation', 'instrumented', 'timed_section', 'get_instrumentation_report',
+           'export_instrumentation_trace']
+
+# --------------------------------------------------------------------------------
+# Opt-in instrumentation of the hot paths
+# The model functions, the interpolation, the region classification and the rendering
+# of process maps are wrapped with @instrumented (or contain timed_section blocks).
+# While instrumentation is disabled, which is the default, a wrapped call only adds
+# one flag check. While it is enabled, every call records its wall time and the
+# number of array elements it was given, under the name of the function (e.g.
+# 'ProcessMap2D.interpolate_point_data_to_grid').
+#
+# Times are inclusive: the time of get_eutectic_lamellar_spacing includes the time of
+# the get_P_JH call it makes.
+#
+# get_instrumentation_report returns the totals per name as a dictionary, and
+# export_instrumentation_trace writes the individual calls as a Chrome trace event
+# file (for chrome://tracing or Perfetto). The records are per process: worker
+# processes, e.g. those of run_process_map_jobs, have their own.
+# --------------------------------------------------------------------------------
+_enabled = False
+_max_trace_events = 0
+_records = {}
+_trace_events = []
+_lock = threading.Lock()
+
+def enable_instrumentation(max_trace_events=100000):
+    # Calls after the first max_trace_events are still counted in the report, but are
+    # not kept for the trace
+    global _enabled, _max_trace_events
+    _max_trace_events = max_trace_events
+    _enabled = True
+
+def disable_instrumentation():
+    global _enabled
+    _enabled = False
+
+def is_instrumentation_enabled():
+    return _enabled
+
+def reset_instrumentation():
+    with _lock:
+        _records.clear()
+        del _trace_events[:]
+
+def _get_num_elements(args, kwargs):
+    # Largest number of elements among the array arguments (arrays, Series, and
+    # lists or dictionaries of arrays such as Z_collection or the phase fractions)
+    num_elements = 0
+    for arg in list(args) + list(kwargs.values()):
+        if isinstance(arg, dict):
+            values = arg.values()
+        elif isinstance(arg, (list, tuple)):
+            values = arg
+        else:
+            values = [arg]
+        for value in values:
+            shape = getattr(value, 'shape', None)
+            if isinstance(shape, tuple):
+                size = 1
+                for n in shape:
+                    size = size * n
+                num_elements = max(num_elements, size)
+    return num_elements
+
+def _record(name, start, end, num_elements):
+    with _lock:
+        record = _records.get(name)
+        if record is None:
+            record = {'calls': 0, 'total_time': 0.0, 'max_time': 0.0, 'total_elements': 0, 'max_elements': 0}
+            _records[name] = record
+        duration = end - start
+        record['calls'] = record['calls'] + 1
+        record['total_time'] = record['total_time'] + duration
+        record['max_time'] = max(record['max_time'], duration)
+        record['total_elements'] = record['total_elements'] + num_elements
+        record['max_elements'] = max(record['max_elements'], num_elements)
+
+        if len(_trace_events) < _max_trace_events:
+            _trace_events.append((name, start, duration, num_elements, threading.get_ident()))
+
+def instrumented(name=None):
+    # Decorator; the record name defaults to the qualified name of the function
+    def decorator(func):
+        record_name = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(record_name, start, time.perf_counter(), _get_num_elements(args, kwargs))
+        return wrapper
+    return decorator
+
+class _TimedSection:
+    __slots__ = ('name', 'num_elements', 'start')
+
+    def __init__(self, name, num_elements):
+        self.name = name
+        self.num_elements = num_elements
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        _record(self.name, self.start, time.perf_counter(), self.num_elements)
+        return False
+
+class _DisabledSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+_disabled_section = _DisabledSection()
+
+def timed_section(name, num_elements=0):
+    # Context manager that records the time of a block of code under name
+    if not _enabled:
+        return _disabled_section
+    return _TimedSection(name, num_elements)
+
+def get_instrumentation_report():
+    # Dictionary of name -> {'calls', 'total_time', 'mean_time', 'max_time',
+    # 'total_elements', 'max_elements'}, with the times in seconds
+    report = {}
+    with _lock:
+        for name, record in _records.items():
+            report[name] = dict(record)
+            report[name]['mean_time'] = record['total_time'] / record['calls']
+    return report
+
+def export_instrumentation_trace(filename):
+    # Writes the recorded calls as complete ('X') events of the Chrome trace event
+    # format, with the times in microseconds
+    pid = os.getpid()
+    with _lock:
+        events = [{'name': name, 'ph': 'X', 'ts': start * 1.0e6, 'dur': duration * 1.0e6, 'pid': pid, 'tid': tid,
+                   'args': {'num_elements': num_elements}}
+                  for name, start, duration, num_elements, tid in _trace_events]
+
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+# --------------------------------------------------------------------------------
@@ -0,0 +1,120 @@
+import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.instrumentation import instrumented
+from ramenlib.core import get_eutectic_phase_fractions
+from ramenlib.core import get_eutectic_lamellar_spacing
+from ramenlib.core import get_orowan_strengthening_lamella
+from ramenlib.core import get_solid_solution_strengthening
+from ramenlib.core import get_grain_boundary_strengthening
+
+__all__ = ['get_lamellar_spacing_for_orowan_strengthening',
+           'get_solidification_velocity_for_spacing', 'get_solidification_velocity_for_strength',
+           'get_grain_diameter_for_strength']
+
+# --------------------------------------------------------------------------------
+# Inverse design
+# Process conditions that give a target lamellar spacing or yield strength, for arrays
+# of targets, compositions and grain diameters (or velocities) that broadcast against
+# each other. The inverses use the structure of the forward models instead of root
+# finding per element:
+# - Jackson-Hunt: spacing = spacing(V=1) / sqrt(V), so V = (spacing(V=1) / spacing)^2
+# - Hall-Petch: sigma_gb = k_HP / sqrt(d), so d = (k_HP / sigma_gb)^2
+# - Orowan: sigma_or = A ln(2R/b) / spacing with R proportional to the spacing, i.e.
+#   sigma_or = A beta ln(u) / u with u = beta spacing. With t = ln(u), the spacing
+#   for a given sigma_or is the root of
+#     h(t) = t - ln(t) + ln(q) = 0,  q = sigma_or / (A beta)
+#   on the physical branch t > 1 (spacings much larger than the Burgers vector, where
+#   the strengthening decreases with the spacing), i.e. u = -W_{-1}(-q)/q. h is
+#   increasing and convex there and its root is at most -2 ln(q), so batched Newton
+#   iterations from t = -2 ln(q) converge monotonically, all elements at once.
+#
+# The yield strength is the sum of the Orowan, solid solution and grain boundary
+# contributions, as in predict_yield_strength. Targets that can't be reached give
+# NaN: a yield strength at or below the contributions that don't depend on the
+# unknown, or an Orowan contribution above its maximum A beta / e.
+# --------------------------------------------------------------------------------
+def _get_orowan_coefficients(mat, phase_fractions, secondary_phase):
+    # sigma_or = A ln(beta spacing) / spacing
+    g_secondary = phase_fractions[secondary_phase]
+    A = mat.M * 0.4 * mat.G * mat.b / (np.pi * np.sqrt(1.0-mat.poisson_ratio))
+    beta = 2.0 / (mat.b * np.sqrt(3.0 * np.pi / (4.0 * g_secondary) - 1.64))
+    return A, beta
+
+@instrumented()
+def get_lamellar_spacing_for_orowan_strengthening(mat, phases, orowan_strengthening, phase_fractions, rtol=1.0e-14, max_iterations=50):
+    # Spacing at which get_orowan_strengthening_lamella(mat, phases[0], phases[1],
+    # spacing, phase_fractions) equals orowan_strengthening (NaN where it can't)
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    mat.check_phases(phases[0], phases[1])
+
+    A, beta = _get_orowan_coefficients(mat, phase_fractions, phases[1])
+    orowan_strengthening = np.asarray(orowan_strengthening, dtype=float)
+    q = orowan_strengthening / (A * beta)
+    shape = np.broadcast_shapes(np.shape(q), np.shape(beta))
+    reachable = np.broadcast_to((q > 0.0) & (q <= np.exp(-1.0)), shape)
+
+    # Unreachable entries are solved for q = e^-2 instead and discarded; e^-1 would
+    # put them on the double root t = 1 of h, where Newton only converges linearly.
+    # They are also left out of the convergence test.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_q = np.broadcast_to(np.log(np.where(reachable, q, np.exp(-2.0))), shape)
+    t = np.maximum(-2.0 * log_q, 1.0)
+    for iteration in range(max_iterations):
+        # Newton step for h(t) = t - ln(t) + ln(q), h'(t) = 1 - 1/t
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = (t - np.log(t) + log_q) / (1.0 - 1.0/t)
+        step = np.where(t > 1.0, step, 0.0)
+        t = t - step
+        if np.all((np.abs(step) <= rtol * t) | ~reachable):
+            break
+
+    spacing = np.exp(t) / beta
+    return np.where(reachable, spacing, np.nan)
+
+@instrumented()
+def get_solidification_velocity_for_spacing(mat, phases, solute_composition, lamellar_spacing, P_backend=None):
+    # Velocity at which get_eutectic_lamellar_spacing gives lamellar_spacing
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    phase_fractions = get_eutectic_phase_fractions(mat, phases, np.asarray(solute_composition, dtype=float))
+    unit_velocity_spacing = get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.0, P_backend)
+    return (unit_velocity_spacing / np.asarray(lamellar_spacing, dtype=float))**2
+
+@instrumented()
+def get_solidification_velocity_for_strength(mat, phases, yield_strength, solute_composition, grain_diameter, P_backend=None,
+                                             rtol=1.0e-14, max_iterations=50):
+    # Velocity at which predict_yield_strength gives yield_strength for the
+    # composition and grain diameter (NaN where it can't)
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    solute_composition = np.asarray(solute_composition, dtype=float)
+    phase_fractions = get_eutectic_phase_fractions(mat, phases, solute_composition)
+
+    orowan_strengthening = np.asarray(yield_strength, dtype=float) - get_solid_solution_strengthening(mat, phases[0]) \
+                           - get_grain_boundary_strengthening(mat, np.asarray(grain_diameter, dtype=float))
+    spacing = get_lamellar_spacing_for_orowan_strengthening(mat, phases, orowan_strengthening, phase_fractions, rtol, max_iterations)
+
+    unit_velocity_spacing = get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.0, P_backend)
+    return (unit_velocity_spacing / spacing)**2
+
+@instrumented()
+def get_grain_diameter_for_strength(mat, phases, yield_strength, solute_composition, solidification_velocity, P_backend=None):
+    # Grain diameter at which predict_yield_strength gives yield_strength for the
+    # composition and velocity (NaN where it can't)
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    solute_composition = np.asarray(solute_composition, dtype=float)
+    phase_fractions = get_eutectic_phase_fractions(mat, phases, solute_composition)
+
+    # Orowan strengthening as in predict_yield_strength
+    unit_velocity_spacing = get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.0, P_backend)
+    spacing = unit_velocity_spacing / np.sqrt(np.asarray(solidification_velocity, dtype=float))
+    orowan_strengthening = get_orowan_strengthening_lamella(mat, phases[0], phases[1], spacing, phase_fractions)
+
+    grain_boundary_strengthening = np.asarray(yield_strength, dtype=float) - orowan_strengthening \
+                                   - get_solid_solution_strengthening(mat, phases[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grain_diameter = (mat.k_HP / grain_boundary_strengthening)**2
+    return np.where(grain_boundary_strengthening > 0.0, grain_diameter, np.nan)
+# --------------------------------------------------------------------------------
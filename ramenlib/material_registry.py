@@ -0,0 +1,234 @@
+import io
+import os
+import glob
+import string
+import hashlib
+import zipfile
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import mistlib as mist
+import numpy as np
+from ramenlib.core import _get_cache_dir
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['MATERIAL_CACHE_VERSION', 'compile_material_file', 'MaterialRegistry',
+           'load_compiled_material']
+
+# --------------------------------------------------------------------------------
+# Persistent material registry
+# MaterialRegistry parses each mist material JSON file once and keeps the model
+# parameters extracted from it (a CompiledMaterial for every ordered pair of two
+# different solid phases) in a binary cache directory, so later processes and pool
+# workers only read a small .npz file instead of building the MaterialInformation
+# object:
+#   registry = MaterialRegistry(cache_dir)
+#   mat = registry.get('AlCu.json', ['alpha', 'theta'])
+#
+# A cache entry is named by the hash of the file content (and of the CompiledMaterial
+# layout), so an edited file gets a new entry. To avoid reading and hashing every
+# file on every lookup, the content hash is also remembered per file path,
+# modification time and size; the file is only hashed again when one of those
+# changes. Within a process, the materials are also kept in memory.
+#
+# The entries only hold arrays of numbers and strings and are read with
+# allow_pickle=False, so a cache file can't run code when it is loaded. Cache files
+# are written to a temporary file and renamed, so concurrent processes only ever read
+# complete entries. Without a cache_dir, the registry uses the 'materials'
+# subdirectory of the per-user ramen cache (RAMEN_CACHE_DIR or ~/.cache/ramen, as for
+# the P(g) tables). If the cache directory can't be created or written, as for the
+# P(g) tables, the materials are compiled and only kept in memory.
+# --------------------------------------------------------------------------------
+MATERIAL_CACHE_VERSION = 1
+
+def _get_content_hash(filename):
+    with open(filename, 'rb') as f:
+        content = f.read()
+    layout = repr((MATERIAL_CACHE_VERSION, CompiledMaterial.__slots__)).encode()
+    return hashlib.sha1(layout + content).hexdigest()
+
+def compile_material_file(filename):
+    # Dictionary of (matrix phase, secondary phase) -> CompiledMaterial for every
+    # ordered pair of two different solid phases of the material
+    mat = mist.core.MaterialInformation(filename)
+    phases = [phase for phase in mat.phase_properties.keys() if phase != 'liquid']
+    return {pair: CompiledMaterial(mat, pair) for pair in itertools.permutations(phases, 2)}
+
+def _write_atomically(filename, data):
+    directory = os.path.dirname(filename)
+    file_descriptor, temporary_file = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_file, filename)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+# Parameters stored as one float per phase pair; the phases and the solutes are
+# stored as string arrays
+_SCALAR_PARAMETERS = [name for name in CompiledMaterial.__slots__ if name not in ('phases', 'solutes', 'solute_misfits')]
+
+def _get_material_arrays(materials):
+    pairs = list(materials.keys())
+    arrays = {'pairs': np.array(pairs, dtype=str).reshape(len(pairs), 2),
+              'scalars': np.array([[getattr(materials[pair], name) for name in _SCALAR_PARAMETERS] for pair in pairs],
+                                  dtype=float).reshape(len(pairs), len(_SCALAR_PARAMETERS))}
+    for index, pair in enumerate(pairs):
+        arrays['solutes_' + str(index)] = np.array(materials[pair].solutes, dtype=str)
+        arrays['solute_misfits_' + str(index)] = np.asarray(materials[pair].solute_misfits, dtype=float)
+    return arrays
+
+def _get_materials_from_arrays(arrays):
+    materials = {}
+    for index, pair in enumerate(arrays['pairs']):
+        material = CompiledMaterial.__new__(CompiledMaterial)
+        material.phases = (str(pair[0]), str(pair[1]))
+        for name, value in zip(_SCALAR_PARAMETERS, arrays['scalars'][index]):
+            setattr(material, name, float(value))
+        material.solutes = tuple(str(solute) for solute in arrays['solutes_' + str(index)])
+        material.solute_misfits = np.array(arrays['solute_misfits_' + str(index)], dtype=float)
+        materials[material.phases] = material
+    return materials
+
+class MaterialRegistry:
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(_get_cache_dir(), 'materials')
+        self.cache_dir = cache_dir
+        try:
+            os.makedirs(os.path.join(cache_dir, 'files'), exist_ok=True)
+            os.makedirs(os.path.join(cache_dir, 'materials'), exist_ok=True)
+            self.persistent = True
+        except OSError:
+            self.persistent = False
+
+        # (path, mtime, size) -> materials, for the files loaded by this process
+        self._materials = {}
+
+    def _get_file_key(self, filename):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def _get_index_file(self, file_key):
+        name = hashlib.sha1(repr(file_key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, 'files', name)
+
+    def _get_content_hash(self, filename, file_key):
+        # The content hash from the index, or by reading the file
+        index_file = self._get_index_file(file_key)
+        try:
+            with open(index_file, 'r') as f:
+                content_hash = f.read()
+            if len(content_hash) == 40 and all(c in string.hexdigits for c in content_hash):
+                return content_hash
+        except OSError:
+            pass
+        content_hash = _get_content_hash(filename)
+        self._write(index_file, content_hash.encode())
+        return content_hash
+
+    def _write(self, filename, data):
+        # Cache files are only an optimization, so failed writes are ignored
+        if not self.persistent:
+            return
+        try:
+            _write_atomically(filename, data)
+        except OSError:
+            pass
+
+    def _get_entry_file(self, content_hash):
+        return os.path.join(self.cache_dir, 'materials', content_hash + '.npz')
+
+    def _load_entry(self, content_hash):
+        if not self.persistent:
+            return None
+        try:
+            with np.load(self._get_entry_file(content_hash), allow_pickle=False) as arrays:
+                return _get_materials_from_arrays(arrays)
+        except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile):
+            return None
+
+    def _store_entry(self, content_hash, materials):
+        buffer = io.BytesIO()
+        np.savez(buffer, **_get_material_arrays(materials))
+        self._write(self._get_entry_file(content_hash), buffer.getvalue())
+
+    @instrumented()
+    def get_all(self, filename):
+        # Dictionary of (matrix phase, secondary phase) -> CompiledMaterial
+        file_key = self._get_file_key(filename)
+        if file_key not in self._materials:
+            content_hash = self._get_content_hash(filename, file_key)
+            materials = self._load_entry(content_hash)
+            if materials is None:
+                materials = compile_material_file(filename)
+                self._store_entry(content_hash, materials)
+            self._materials[file_key] = materials
+        return self._materials[file_key]
+
+    def get(self, filename, phases):
+        # CompiledMaterial of the material file for phases[0] (matrix) and phases[1]
+        materials = self.get_all(filename)
+        pair = (phases[0], phases[1])
+        if pair not in materials:
+            raise ValueError("'" + str(filename) + "' has no phases " + str(list(pair)))
+        return materials[pair]
+
+    @instrumented()
+    def load_directory(self, directory, pattern='*.json', num_workers=None):
+        # Loads every material file in the directory that matches pattern and returns
+        # a dictionary of filename -> get_all(filename). The files that are not cached
+        # yet are parsed by num_workers processes (num_workers=None parses them in
+        # this process).
+        filenames = sorted(glob.glob(os.path.join(directory, pattern)))
+        results = {}
+        missing = []
+        for filename in filenames:
+            file_key = self._get_file_key(filename)
+            if file_key in self._materials:
+                results[filename] = self._materials[file_key]
+                continue
+            content_hash = self._get_content_hash(filename, file_key)
+            materials = self._load_entry(content_hash)
+            if materials is None:
+                missing.append((filename, content_hash))
+            else:
+                self._materials[file_key] = materials
+                results[filename] = materials
+
+        missing_filenames = [filename for filename, content_hash in missing]
+        if num_workers is None:
+            compiled = map(compile_material_file, missing_filenames)
+        else:
+            executor = ProcessPoolExecutor(max_workers=num_workers)
+            compiled = executor.map(compile_material_file, missing_filenames)
+        try:
+            for (filename, content_hash), materials in zip(missing, compiled):
+                self._store_entry(content_hash, materials)
+                self._materials[self._get_file_key(filename)] = materials
+                results[filename] = materials
+        finally:
+            if num_workers is not None:
+                executor.shutdown()
+
+        return {filename: results[filename] for filename in filenames}
+
+    def clear(self):
+        # Removes the cache files and forgets the materials loaded by this process
+        if self.persistent:
+            for subdirectory in ['files', 'materials']:
+                for filename in os.listdir(os.path.join(self.cache_dir, subdirectory)):
+                    os.remove(os.path.join(self.cache_dir, subdirectory, filename))
+        self._materials = {}
+
+_material_registries = {}
+
+def load_compiled_material(filename, phases, cache_dir=None):
+    # CompiledMaterial from the (per-process) registry for cache_dir
+    if cache_dir not in _material_registries:
+        _material_registries[cache_dir] = MaterialRegistry(cache_dir)
+    return _material_registries[cache_dir].get(filename, phases)
+# --------------------------------------------------------------------------------
@@ -0,0 +1,188 @@
+import struct
+import hashlib
+import operator
+import functools
+from collections import OrderedDict
+import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+
+__all__ = ['ModelCache', 'enable_model_cache', 'disable_model_cache', 'get_model_cache', 'memoized']
+
+# --------------------------------------------------------------------------------
+# Opt-in memoization of model evaluations
+# After enable_model_cache(), the model functions wrapped with @memoized (the
+# Jackson-Hunt lamellar spacing in ramenlib.core, whose P(g) evaluation dominates the
+# cost of the chain) look up their results in a least-recently-used cache of at most
+# max_entries results before computing them. While the cache is disabled, which is
+# the default, a wrapped call only adds one flag check. max_entries bounds the number
+# of results, not their size: a cached call on an array of n elements holds its
+# result arrays (several times 8n bytes with derivatives).
+#
+# A lookup hashes the arguments, which costs more than evaluating the closed-form
+# models (phase fractions, Orowan, solid solution and grain boundary strengthening),
+# so those are not memoized. Code that evaluates the spacing on values that are
+# rarely repeated, such as ramenlib.pipelines, calls func.uncached, the function
+# without the cache (and without any decorators above @memoized).
+#
+# The cache key is the function name, the property values of the material and the
+# values of the other arguments (arrays by dtype, shape and a hash of their data).
+# For a CompiledMaterial, the scalar parameters are packed into the key as raw
+# doubles, which is much cheaper than walking the properties of a mist object.
+# The material key is rebuilt on every call, so changing a property value of a mist
+# object gives new keys, and results for the old values are no longer used.
+#
+# Cached array results are returned as read-only arrays, which are shared between
+# the calls that hit the same entry; copy them before modifying them in place.
+# --------------------------------------------------------------------------------
+class ModelCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # Returns (True, result) for a hit, (False, None) for a miss
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return True, self.entries[key]
+        self.misses = self.misses + 1
+        return False, None
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'max_entries': self.max_entries}
+
+_model_cache = None
+
+def enable_model_cache(max_entries=1024):
+    # Returns the (new) cache, e.g. for get_stats(). max_entries is a number of
+    # results, not of bytes.
+    global _model_cache
+    _model_cache = ModelCache(max_entries)
+    return _model_cache
+
+def disable_model_cache():
+    global _model_cache
+    _model_cache = None
+
+def get_model_cache():
+    # The active ModelCache, or None if memoization is disabled
+    return _model_cache
+
+def _get_value_key(value):
+    # Hashable key for the content of an argument. Arrays with more than a few
+    # elements are represented by a hash of their data. The common cases (floats,
+    # strings, integers) are checked first, since keys are built on every call.
+    if isinstance(value, float):
+        # Floats (including NumPy float64 scalars) by their exact hexadecimal form,
+        # so that NaN values give equal keys and 0.0 and -0.0 different ones
+        return ('f', value.hex())
+    if isinstance(value, (str, int)) or value is None:
+        return value
+    if isinstance(value, (np.ndarray, np.generic)):
+        data = np.ascontiguousarray(value).tobytes()
+        if len(data) > 256:
+            data = hashlib.sha1(data).digest()
+        return ('a', value.dtype.str, np.shape(value), data)
+    if isinstance(value, dict):
+        return ('d',) + tuple((key, _get_value_key(value[key])) for key in sorted(value.keys(), key=repr))
+    if isinstance(value, (list, tuple)):
+        return ('l',) + tuple(_get_value_key(item) for item in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ('r', repr(value))
+
+def _get_property_values(properties, names, values):
+    for name, prop in properties.items():
+        if isinstance(prop, dict):
+            # Per-solute properties
+            _get_property_values(prop, names, values)
+        else:
+            names.append(name)
+            values.append(prop.value)
+
+# The scalar parameters of a CompiledMaterial, packed into the key as raw doubles
+_COMPILED_SCALARS = [name for name in CompiledMaterial.__slots__ if name not in ('phases', 'solutes', 'solute_misfits')]
+_get_compiled_scalars = operator.attrgetter(*_COMPILED_SCALARS)
+_compiled_scalars_struct = struct.Struct('<' + str(len(_COMPILED_SCALARS)) + 'd')
+
+def _get_material_key(mat):
+    # Key for the property values of the material
+    if isinstance(mat, CompiledMaterial):
+        try:
+            scalars = _compiled_scalars_struct.pack(*_get_compiled_scalars(mat))
+        except struct.error:
+            # Parameters replaced by arrays (CompiledMaterial.with_values)
+            return ('c',) + tuple(_get_value_key(getattr(mat, name)) for name in CompiledMaterial.__slots__)
+        return ('c', mat.phases, mat.solutes, _get_value_key(mat.solute_misfits), scalars)
+
+    names = []
+    values = []
+    _get_property_values(mat.properties, names, values)
+    for phase, phase_properties in mat.phase_properties.items():
+        names.append(phase)
+        values.append(0.0)
+        _get_property_values(phase_properties.properties, names, values)
+    try:
+        values = np.array(values, dtype=float).tobytes()
+    except (TypeError, ValueError):
+        values = repr(values)
+    return ('m', tuple(names), values)
+
+def _make_read_only(result):
+    if isinstance(result, np.ndarray):
+        result.setflags(write=False)
+    elif isinstance(result, dict):
+        for value in result.values():
+            _make_read_only(value)
+    elif isinstance(result, tuple):
+        for value in result:
+            _make_read_only(value)
+    return result
+
+def _copy_containers(result):
+    # Dictionaries in the results are copied, so callers can't change cached entries
+    if isinstance(result, dict):
+        return dict(result)
+    if isinstance(result, tuple):
+        return tuple(_copy_containers(value) for value in result)
+    return result
+
+def memoized():
+    # Decorator for model functions whose first argument is the material
+    def decorator(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(mat, *args, **kwargs):
+            cache = _model_cache
+            if cache is None:
+                return func(mat, *args, **kwargs)
+            key = (name, _get_material_key(mat), _get_value_key(args), _get_value_key(kwargs))
+            hit, result = cache.get(key)
+            if not hit:
+                result = _make_read_only(func(mat, *args, **kwargs))
+                cache.put(key, result)
+            return _copy_containers(result)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+# --------------------------------------------------------------------------------
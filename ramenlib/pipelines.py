@@ -0,0 +1,162 @@
+import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.instrumentation import instrumented
+from ramenlib.core import get_eutectic_phase_fractions
+from ramenlib.core import get_eutectic_lamellar_spacing
+from ramenlib.core import get_orowan_strengthening_lamella
+from ramenlib.core import get_solid_solution_strengthening
+from ramenlib.core import get_grain_boundary_strengthening
+
+__all__ = ['predict_yield_strength']
+
+_get_eutectic_lamellar_spacing = instrumented()(get_eutectic_lamellar_spacing.uncached)
+
+# --------------------------------------------------------------------------------
+# Yield strength pipeline
+# Evaluates the chain used in examples/AlCu_eutectic.py
+#   phase fractions -> lamellar spacing -> Orowan + solid solution + grain boundary
+# for arrays of solute composition, solidification velocity and grain diameter that
+# broadcast against each other.
+#
+# Everything that only depends on the composition (the phase fractions and the
+# Jackson-Hunt spacing at unit velocity, including P(g)) is evaluated once per
+# composition value, since spacing = spacing(V=1) / sqrt(V). The per-cell terms are
+# then evaluated in flattened chunks of chunk_size cells and written straight into
+# preallocated, contiguous output arrays of the broadcast shape. Inputs that already
+# have the full size are sliced as flat views, and inputs with a single value are
+# passed to the models as scalars, so only inputs that really are broadcast (e.g. a
+# row against a column) go through a broadcast view.
+#
+# The lamellar spacing is evaluated without the model cache of ramenlib.memoization
+# (its .uncached function, still instrumented): hashing and storing the inputs of
+# every call would cost more than it saves and hold on to their results.
+#
+# With return_derivatives=True, results['derivatives'] also has the analytic
+# derivatives of the outputs with respect to the inputs, by the chain rule through
+# the models (including dP/dg):
+#   'lamellar_spacing': 'solute_composition', 'solidification_velocity'
+#   'orowan_strengthening_lamella': 'solute_composition', 'solidification_velocity'
+#   'grain_boundary_strengthening': 'grain_diameter'
+#   'yield_strength': 'solute_composition', 'solidification_velocity', 'grain_diameter'
+# --------------------------------------------------------------------------------
+def _get_flat_input(values, shape):
+    # Something that can be sliced with the chunks of the flattened broadcast shape:
+    # a float for a single value, a flat view for a contiguous array of the full size
+    # (e.g. a memory map, which is only read one chunk at a time), and a flat
+    # iterator over the broadcast array otherwise
+    values = np.asarray(values)
+    if values.size == 1:
+        return float(values.reshape(-1)[0])
+    if values.size == int(np.prod(shape)) and values.flags['C_CONTIGUOUS']:
+        return values.reshape(-1)
+    return np.broadcast_to(values, shape).flat
+
+def _get_chunk(flat_input, chunk):
+    if isinstance(flat_input, float):
+        return flat_input
+    return flat_input[chunk]
+
+@instrumented()
+def predict_yield_strength(mat, phases, solute_composition, solidification_velocity, grain_diameter, chunk_size=65536, P_backend=None, return_derivatives=False):
+    # phases[0] is the matrix phase and phases[1] the secondary phase. mat can be a
+    # mist MaterialInformation object or a CompiledMaterial for these phases.
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    matrix_phase = phases[0]
+    secondary_phase = phases[1]
+
+    solute_composition = np.asarray(solute_composition, dtype=float)
+    solidification_velocity = np.asarray(solidification_velocity, dtype=float)
+    grain_diameter = np.asarray(grain_diameter, dtype=float)
+
+    # Composition-dependent intermediates
+    if return_derivatives:
+        phase_fractions, phase_fraction_derivatives = get_eutectic_phase_fractions(mat, phases, solute_composition, True)
+        unit_velocity_spacing, spacing_derivatives = _get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.0, P_backend, True)
+        unit_velocity_spacing_derivative = spacing_derivatives['phase_fraction'] * phase_fraction_derivatives[matrix_phase]
+    else:
+        phase_fractions = get_eutectic_phase_fractions(mat, phases, solute_composition)
+        unit_velocity_spacing = _get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.0, P_backend)
+
+    # Material-only contribution
+    solid_solution_strengthening = get_solid_solution_strengthening(mat, matrix_phase)
+
+    shape = np.broadcast_shapes(solute_composition.shape, solidification_velocity.shape, grain_diameter.shape)
+    results = {}
+    # The phase fractions are outputs too; arrays that already have the full shape are
+    # used as they are, the others are broadcast into new contiguous arrays once
+    results['eutectic_phase_fractions'] = {}
+    for phase in [matrix_phase, secondary_phase]:
+        if np.shape(phase_fractions[phase]) == shape:
+            results['eutectic_phase_fractions'][phase] = np.ascontiguousarray(phase_fractions[phase])
+        else:
+            results['eutectic_phase_fractions'][phase] = np.array(np.broadcast_to(phase_fractions[phase], shape))
+    for name in ['lamellar_spacing', 'orowan_strengthening_lamella', 'solid_solution_strengthening',
+                 'grain_boundary_strengthening', 'yield_strength']:
+        results[name] = np.empty(shape)
+    if return_derivatives:
+        derivative_names = {'lamellar_spacing': ['solute_composition', 'solidification_velocity'],
+                            'orowan_strengthening_lamella': ['solute_composition', 'solidification_velocity'],
+                            'grain_boundary_strengthening': ['grain_diameter'],
+                            'yield_strength': ['solute_composition', 'solidification_velocity', 'grain_diameter']}
+        results['derivatives'] = {name: {input_name: np.empty(shape) for input_name in input_names}
+                                  for name, input_names in derivative_names.items()}
+        derivatives_out = {name: {input_name: array.reshape(-1) for input_name, array in arrays.items()}
+                           for name, arrays in results['derivatives'].items()}
+        unit_velocity_spacing_derivative = _get_flat_input(unit_velocity_spacing_derivative, shape)
+        dg_secondary_dc = _get_flat_input(phase_fraction_derivatives[secondary_phase], shape)
+
+    # Flat views of the outputs (they are contiguous, so no copies are made)
+    g_matrix_out = results['eutectic_phase_fractions'][matrix_phase].reshape(-1)
+    g_secondary_out = results['eutectic_phase_fractions'][secondary_phase].reshape(-1)
+    spacing_out = results['lamellar_spacing'].reshape(-1)
+    orowan_out = results['orowan_strengthening_lamella'].reshape(-1)
+    solid_solution_out = results['solid_solution_strengthening'].reshape(-1)
+    grain_boundary_out = results['grain_boundary_strengthening'].reshape(-1)
+    total_out = results['yield_strength'].reshape(-1)
+
+    # Flat inputs; slicing these only copies a chunk if the input is broadcast
+    unit_velocity_spacing = _get_flat_input(unit_velocity_spacing, shape)
+    solidification_velocity = _get_flat_input(solidification_velocity, shape)
+    grain_diameter = _get_flat_input(grain_diameter, shape)
+
+    size = total_out.size
+    for start in range(0, size, chunk_size):
+        chunk = slice(start, min(start+chunk_size, size))
+
+        chunk_phase_fractions = {matrix_phase: g_matrix_out[chunk], secondary_phase: g_secondary_out[chunk]}
+
+        spacing = spacing_out[chunk]
+        np.sqrt(_get_chunk(solidification_velocity, chunk), out=spacing)
+        np.divide(_get_chunk(unit_velocity_spacing, chunk), spacing, out=spacing)
+
+        if not return_derivatives:
+            orowan_out[chunk] = get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, spacing, chunk_phase_fractions)
+            grain_boundary_out[chunk] = get_grain_boundary_strengthening(mat, _get_chunk(grain_diameter, chunk))
+        else:
+            orowan_out[chunk], orowan_derivatives = get_orowan_strengthening_lamella(mat, matrix_phase, secondary_phase, spacing,
+                                                                                     chunk_phase_fractions, True)
+            grain_boundary_out[chunk], grain_boundary_derivatives = get_grain_boundary_strengthening(mat, _get_chunk(grain_diameter, chunk), True)
+
+            # spacing = spacing(V=1) / sqrt(V)
+            dspacing_dc = _get_chunk(unit_velocity_spacing_derivative, chunk) / np.sqrt(_get_chunk(solidification_velocity, chunk))
+            dspacing_dV = -0.5 * spacing / _get_chunk(solidification_velocity, chunk)
+            dorowan_dc = orowan_derivatives['eutectic_spacing'] * dspacing_dc + orowan_derivatives['phase_fraction'] * _get_chunk(dg_secondary_dc, chunk)
+            dorowan_dV = orowan_derivatives['eutectic_spacing'] * dspacing_dV
+
+            derivatives_out['lamellar_spacing']['solute_composition'][chunk] = dspacing_dc
+            derivatives_out['lamellar_spacing']['solidification_velocity'][chunk] = dspacing_dV
+            derivatives_out['orowan_strengthening_lamella']['solute_composition'][chunk] = dorowan_dc
+            derivatives_out['orowan_strengthening_lamella']['solidification_velocity'][chunk] = dorowan_dV
+            derivatives_out['grain_boundary_strengthening']['grain_diameter'][chunk] = grain_boundary_derivatives['grain_diameter']
+            derivatives_out['yield_strength']['solute_composition'][chunk] = dorowan_dc
+            derivatives_out['yield_strength']['solidification_velocity'][chunk] = dorowan_dV
+            derivatives_out['yield_strength']['grain_diameter'][chunk] = grain_boundary_derivatives['grain_diameter']
+        solid_solution_out[chunk] = solid_solution_strengthening
+
+        total = total_out[chunk]
+        np.add(orowan_out[chunk], grain_boundary_out[chunk], out=total)
+        total += solid_solution_strengthening
+
+    return results
+# --------------------------------------------------------------------------------
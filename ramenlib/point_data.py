@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['PointData', 'read_point_data']
+
+# --------------------------------------------------------------------------------
+# Streaming ingestion of point data
+# read_point_data reads only the requested columns of a (large) process-data CSV,
+# chunk by chunk, into compact 1D arrays of the requested dtype. Peak memory follows
+# the columns that are used rather than the size of the file.
+#
+# With a cache_dir, the columns are also written to a columnar binary cache (one raw
+# array file per column) while the CSV is streamed, and later calls memory-map the
+# cached columns instead of parsing the CSV again. The cache entry is keyed on the
+# file path, modification time, size, columns and dtype, so a changed CSV is read
+# again.
+#
+# The returned PointData can be used in place of a pandas DataFrame by the
+# ProcessMap2D methods and by quantity of interest functions: data[name] is a pandas
+# Series that wraps the column array without copying it.
+# --------------------------------------------------------------------------------
+class PointData:
+    def __init__(self, columns):
+        # columns: dictionary of column name -> 1D array, all of the same length
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return pd.Series(self.columns[name], name=name, copy=False)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        for values in self.columns.values():
+            return values.shape[0]
+        return 0
+
+    def keys(self):
+        return self.columns.keys()
+
+def _get_point_data_cache_key(filename, columns, dtype):
+    stat = os.stat(filename)
+    key = json.dumps([os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, list(columns), np.dtype(dtype).str])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def _load_cached_point_data(cache_entry):
+    with open(os.path.join(cache_entry, 'columns.json'), 'r') as f:
+        metadata = json.load(f)
+    columns = {}
+    for index, name in enumerate(metadata['columns']):
+        if metadata['num_rows'] == 0:
+            columns[name] = np.zeros(0, dtype=metadata['dtype'])
+        else:
+            columns[name] = np.memmap(os.path.join(cache_entry, str(index) + '.bin'), dtype=metadata['dtype'],
+                                      mode='r', shape=(metadata['num_rows'],))
+    return PointData(columns)
+
+@instrumented()
+def read_point_data(filename, columns, dtype=np.float64, chunksize=1000000, cache_dir=None):
+    columns = list(columns)
+
+    cache_entry = None
+    if cache_dir is not None:
+        cache_entry = os.path.join(cache_dir, 'point_data_' + _get_point_data_cache_key(filename, columns, dtype))
+        if os.path.exists(os.path.join(cache_entry, 'columns.json')):
+            return _load_cached_point_data(cache_entry)
+
+    reader = pd.read_csv(filename, usecols=columns, dtype={name: dtype for name in columns}, chunksize=chunksize)
+
+    if cache_entry is None:
+        chunks = {name: [] for name in columns}
+        for chunk in reader:
+            for name in columns:
+                chunks[name].append(chunk[name].to_numpy(dtype=dtype))
+        return PointData({name: np.concatenate(chunks[name]) if len(chunks[name]) > 0 else np.zeros(0, dtype=dtype)
+                          for name in columns})
+
+    # Stream the chunks into the cache files, then memory-map them. The entry is
+    # written to a temporary directory and renamed, so other processes only ever see
+    # complete entries.
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_entry = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        files = [open(os.path.join(temporary_entry, str(index) + '.bin'), 'wb') for index in range(len(columns))]
+        num_rows = 0
+        try:
+            for chunk in reader:
+                for name, f in zip(columns, files):
+                    f.write(np.ascontiguousarray(chunk[name].to_numpy(dtype=dtype)).tobytes())
+                num_rows = num_rows + len(chunk)
+        finally:
+            for f in files:
+                f.close()
+
+        with open(os.path.join(temporary_entry, 'columns.json'), 'w') as f:
+            json.dump({'columns': columns, 'dtype': np.dtype(dtype).str, 'num_rows': num_rows}, f)
+
+        try:
+            os.replace(temporary_entry, cache_entry)
+        except OSError:
+            # Another process wrote the same entry first
+            pass
+    finally:
+        if os.path.exists(temporary_entry):
+            shutil.rmtree(temporary_entry)
+
+    return _load_cached_point_data(cache_entry)
+# --------------------------------------------------------------------------------
@@ -0,0 +1,189 @@
+import json
+import numpy as np
+
+__all__ = ['ARTIFACT_MAGIC', 'ARTIFACT_VERSION', 'save_process_map_artifact', 'ProcessMapArtifact',
+           'load_process_map_artifact']
+
+# --------------------------------------------------------------------------------
+# Process map artifacts
+# save_process_map_artifact writes the grid, the gridded data (as float32) and the
+# region masks (bit-packed, one bit per grid point) of a ProcessMap2D to one binary
+# file. ProcessMapArtifact memory-maps such a file and answers vectorized point
+# queries, e.g. from build planning tools:
+#   artifact = ProcessMapArtifact('map.ramen')
+#   keyhole = artifact.query_region('Keyhole', velocity, power)
+#   spacing = artifact.query_field('Lamellar spacing', velocity, power)
+# Regions are looked up at the nearest grid point and fields are interpolated
+# bilinearly (or at the nearest grid point), so every query is a few array lookups
+# per point and nothing is unpacked or read that isn't queried.
+#
+# This module only needs numpy, not matplotlib, scipy, pandas or mist, and doesn't
+# import anything else from ramenlib, so it can also be copied and used on its own.
+#
+# File layout: the 8 byte magic b'RAMENMAP', the format version and the length of
+# the header as little-endian uint32, the JSON header, and the data blocks, each
+# starting at a multiple of 64 bytes. The header has the grid (num_grid_points,
+# grid_bounds_x, grid_bounds_y), the axis labels, and for every field and region its
+# name and the offset of its block. Fields are little-endian float32 arrays of shape
+# (len(y), len(x)); region masks are np.packbits of the flattened mask with
+# bitorder='little'.
+# --------------------------------------------------------------------------------
+ARTIFACT_MAGIC = b'RAMENMAP'
+ARTIFACT_VERSION = 1
+_ALIGNMENT = 64
+
+def _get_padding(offset):
+    return (-offset) % _ALIGNMENT
+
+def _get_layer_names(layers, prefix):
+    # Unnamed layers are called <prefix>_<index>
+    names = [name if name else prefix + '_' + str(index) for index, (name, values) in enumerate(layers)]
+    if len(set(names)) != len(names):
+        raise ValueError("Layer names have to be unique in an artifact, got " + str(names))
+    return names
+
+def save_process_map_artifact(pmap, filename):
+    # Writes every gridded data plot and region of the ProcessMap2D pmap. The fields
+    # are named by their labels and the regions by their region names.
+    shape = (pmap.num_grid_points[1], pmap.num_grid_points[0])
+    fields = pmap.get_gridded_data()
+    regions = pmap.get_region_masks()
+
+    header = {'num_grid_points': [int(n) for n in pmap.num_grid_points],
+              'grid_bounds_x': [float(value) for value in pmap.grid_bounds_x],
+              'grid_bounds_y': [float(value) for value in pmap.grid_bounds_y],
+              'x_label': pmap.x_label, 'y_label': pmap.y_label,
+              'fields': [], 'regions': []}
+
+    blocks = []
+    for name, (label, Z) in zip(_get_layer_names(fields, 'field'), fields):
+        blocks.append(('fields', name, np.broadcast_to(np.asarray(Z, dtype='<f4'), shape)))
+    for name, (region_name, mask) in zip(_get_layer_names(regions, 'region'), regions):
+        blocks.append(('regions', name, np.packbits(np.broadcast_to(np.asarray(mask, dtype=bool), shape).reshape(-1),
+                                                   bitorder='little')))
+
+    # The offsets depend on the header length, which depends on the offsets; the
+    # header is padded to a fixed length that holds any offset up to 20 digits
+    for kind, name, data in blocks:
+        header[kind].append({'name': name, 'offset': 10**19, 'num_bytes': int(data.nbytes)})
+    header_length = len(json.dumps(header).encode())
+    offset = 16 + header_length + _get_padding(16 + header_length)
+    block_offsets = []
+    entries = header['fields'] + header['regions']
+    for entry, (kind, name, data) in zip(entries, blocks):
+        entry['offset'] = offset
+        block_offsets.append(offset)
+        offset = offset + data.nbytes + _get_padding(data.nbytes)
+    header_bytes = json.dumps(header).encode()
+    header_bytes = header_bytes + b' ' * (header_length - len(header_bytes))
+
+    with open(filename, 'wb') as f:
+        f.write(ARTIFACT_MAGIC)
+        f.write(np.array([ARTIFACT_VERSION, header_length], dtype='<u4').tobytes())
+        f.write(header_bytes)
+        for block_offset, (kind, name, data) in zip(block_offsets, blocks):
+            f.write(b'\0' * (block_offset - f.tell()))
+            f.write(np.ascontiguousarray(data).tobytes())
+
+class ProcessMapArtifact:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic = f.read(8)
+            if magic != ARTIFACT_MAGIC:
+                raise ValueError("'" + str(filename) + "' is not a process map artifact")
+            version, header_length = np.frombuffer(f.read(8), dtype='<u4')
+            if version != ARTIFACT_VERSION:
+                raise ValueError("Unsupported process map artifact version " + str(version))
+            self.header = json.loads(f.read(int(header_length)).decode())
+
+        self._data = np.memmap(filename, dtype=np.uint8, mode='r')
+        self.num_grid_points = self.header['num_grid_points']
+        self.grid_bounds_x = self.header['grid_bounds_x']
+        self.grid_bounds_y = self.header['grid_bounds_y']
+        self.x_label = self.header['x_label']
+        self.y_label = self.header['y_label']
+        self.shape = (self.num_grid_points[1], self.num_grid_points[0])
+        self.x = np.linspace(self.grid_bounds_x[0], self.grid_bounds_x[1], self.num_grid_points[0])
+        self.y = np.linspace(self.grid_bounds_y[0], self.grid_bounds_y[1], self.num_grid_points[1])
+
+        self._fields = {entry['name']: entry for entry in self.header['fields']}
+        self._regions = {entry['name']: entry for entry in self.header['regions']}
+        self.field_names = list(self._fields.keys())
+        self.region_names = list(self._regions.keys())
+
+    def _get_block(self, entries, name):
+        if name not in entries:
+            raise ValueError("Unknown field or region '" + str(name) + "', expected one of "
+                             + str(self.field_names + self.region_names))
+        entry = entries[name]
+        return self._data[entry['offset']:entry['offset']+entry['num_bytes']]
+
+    def get_field(self, name):
+        # Read-only float32 view of the whole field, shape (len(y), len(x))
+        return self._get_block(self._fields, name).view('<f4').reshape(self.shape)
+
+    def get_region_mask(self, name):
+        # The whole mask, unpacked, shape (len(y), len(x))
+        packed = self._get_block(self._regions, name)
+        return np.unpackbits(packed, count=self.shape[0]*self.shape[1], bitorder='little').astype(bool).reshape(self.shape)
+
+    def _get_grid_coordinates(self, x, y):
+        # Fractional grid indices of the points and whether they are on the map
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        dx = (self.grid_bounds_x[1] - self.grid_bounds_x[0]) / max(self.num_grid_points[0] - 1, 1)
+        dy = (self.grid_bounds_y[1] - self.grid_bounds_y[0]) / max(self.num_grid_points[1] - 1, 1)
+        fx = (x - self.grid_bounds_x[0]) / dx
+        fy = (y - self.grid_bounds_y[0]) / dy
+        inside = (fx >= -1.0e-9) & (fx <= self.num_grid_points[0] - 1 + 1.0e-9) \
+                 & (fy >= -1.0e-9) & (fy <= self.num_grid_points[1] - 1 + 1.0e-9)
+        return fx, fy, inside
+
+    def _get_nearest_indices(self, fx, fy):
+        j = np.clip(np.rint(np.nan_to_num(fx)), 0, self.num_grid_points[0] - 1).astype(np.int64)
+        i = np.clip(np.rint(np.nan_to_num(fy)), 0, self.num_grid_points[1] - 1).astype(np.int64)
+        return i, j
+
+    def contains(self, x, y):
+        # True for the points within the grid bounds
+        return self._get_grid_coordinates(x, y)[2]
+
+    def query_region(self, name, x, y):
+        # Mask value at the grid point nearest to each (x, y) point; False off the map
+        packed = self._get_block(self._regions, name)
+        fx, fy, inside = self._get_grid_coordinates(x, y)
+        i, j = self._get_nearest_indices(fx, fy)
+        index = i * self.num_grid_points[0] + j
+        return ((packed[index >> 3] >> (index & 7)) & 1).astype(bool) & inside
+
+    def query_field(self, name, x, y, method='bilinear'):
+        # Field values at the (x, y) points, by bilinear interpolation between the four
+        # surrounding grid points or at the nearest grid point ('nearest'); NaN off the
+        # map
+        Z = self.get_field(name)
+        fx, fy, inside = self._get_grid_coordinates(x, y)
+        if method == 'nearest':
+            i, j = self._get_nearest_indices(fx, fy)
+            values = Z[i, j].astype(float)
+        elif method == 'bilinear':
+            j0 = np.clip(np.floor(np.nan_to_num(fx)), 0, max(self.num_grid_points[0] - 2, 0)).astype(np.int64)
+            i0 = np.clip(np.floor(np.nan_to_num(fy)), 0, max(self.num_grid_points[1] - 2, 0)).astype(np.int64)
+            j1 = np.minimum(j0 + 1, self.num_grid_points[0] - 1)
+            i1 = np.minimum(i0 + 1, self.num_grid_points[1] - 1)
+            tx = np.clip(fx - j0, 0.0, 1.0)
+            ty = np.clip(fy - i0, 0.0, 1.0)
+            values = (1.0 - ty) * ((1.0 - tx) * Z[i0, j0] + tx * Z[i0, j1]) + ty * ((1.0 - tx) * Z[i1, j0] + tx * Z[i1, j1])
+        else:
+            raise ValueError("Unknown method '" + str(method) + "', expected 'bilinear' or 'nearest'")
+        return np.where(inside, values, np.nan)
+
+    def query(self, x, y):
+        # Dictionary of every region and field name -> values at the (x, y) points
+        results = {name: self.query_region(name, x, y) for name in self.region_names}
+        results.update({name: self.query_field(name, x, y) for name in self.field_names})
+        return results
+
+def load_process_map_artifact(filename):
+    return ProcessMapArtifact(filename)
+# --------------------------------------------------------------------------------
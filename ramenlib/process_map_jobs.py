@@ -0,0 +1,113 @@
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import mistlib as mist
+from ramenlib.process_maps import ProcessMap2D
+from ramenlib.process_maps import _use_agg_backend
+
+__all__ = ['ProcessMapJob', 'build_process_map', 'run_process_map_jobs']
+
+# --------------------------------------------------------------------------------
+# Batch generation of process maps
+# A ProcessMapJob describes one map: the material JSON file, the process-data CSV,
+# the grid and what to put on the map. run_process_map_jobs builds the maps in a
+# pool of worker processes and returns one result dictionary per job, in the order
+# of the jobs.
+#
+# All of the functions in a job are sent to the worker processes, so they have to be
+# defined at module level (no lambdas):
+# - gridded_data: list of (func, label), where func(mat, pmap) returns an array on the
+#   pmap grid, e.g. the lamellar spacing at pmap.X
+# - point_data_plots: list of (func, label), where func(data) returns the values at the
+#   data points, as for ProcessMap2D.add_point_data_plot
+# - regions: list of dictionaries with the keys 'fields' (list of func(data)),
+#   'classifier' (as for ProcessMap2D.add_point_data_region) and optionally 'name'
+#   and 'color'
+# --------------------------------------------------------------------------------
+class ProcessMapJob:
+    def __init__(self, material_file, process_data_file, x_name, y_name, num_grid_points,
+                 grid_bounds_x=None, grid_bounds_y=None, gridded_data=(), point_data_plots=(), regions=(),
+                 interpolator='linear', output_file=None, x_label=None, y_label=None, fig_title=None):
+        # If the grid bounds are not given, they are the range of the process data
+        self.material_file = material_file
+        self.process_data_file = process_data_file
+        self.x_name = x_name
+        self.y_name = y_name
+        self.num_grid_points = num_grid_points
+        self.grid_bounds_x = grid_bounds_x
+        self.grid_bounds_y = grid_bounds_y
+        self.gridded_data = gridded_data
+        self.point_data_plots = point_data_plots
+        self.regions = regions
+        self.interpolator = interpolator
+        self.output_file = output_file
+        self.x_label = x_label
+        self.y_label = y_label
+        self.fig_title = fig_title
+
+# Materials already loaded by this (worker) process, keyed on the file name
+_loaded_materials = {}
+
+def _load_material(material_file):
+    if material_file not in _loaded_materials:
+        _loaded_materials[material_file] = mist.core.MaterialInformation(material_file)
+    return _loaded_materials[material_file]
+
+def build_process_map(job):
+    # Builds the (lazy) ProcessMap2D for one job
+    import pandas as pd
+    data = pd.read_csv(job.process_data_file)
+
+    grid_bounds_x = job.grid_bounds_x
+    if grid_bounds_x is None:
+        grid_bounds_x = (min(data[job.x_name]), max(data[job.x_name]))
+    grid_bounds_y = job.grid_bounds_y
+    if grid_bounds_y is None:
+        grid_bounds_y = (min(data[job.y_name]), max(data[job.y_name]))
+
+    pmap = ProcessMap2D(num_grid_points=job.num_grid_points, grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y,
+                        x_label=job.x_label, y_label=job.y_label, fig_title=job.fig_title, lazy=True)
+
+    if len(job.gridded_data) > 0:
+        mat = _load_material(job.material_file)
+        for func, label in job.gridded_data:
+            pmap.add_gridded_data_plot(func(mat, pmap), label=label)
+
+    for func, label in job.point_data_plots:
+        pmap.add_point_data_plot(data, func, job.x_name, job.y_name, interpolator=job.interpolator, label=label)
+
+    for region in job.regions:
+        pmap.add_point_data_region(data, region['fields'], region['classifier'], job.x_name, job.y_name,
+                                   interpolator=job.interpolator, region_name=region.get('name'), color=region.get('color'))
+
+    return pmap
+
+def _run_process_map_job(job_and_options):
+    job, return_arrays = job_and_options
+    result = {'output_file': job.output_file, 'error': None}
+    try:
+        pmap = build_process_map(job)
+        if job.output_file is not None:
+            pmap.finalize(show=False)
+            pmap.save_figure(job.output_file)
+        if return_arrays:
+            result['x'] = pmap.x
+            result['y'] = pmap.y
+            result['gridded_data'] = pmap.get_gridded_data()
+            result['region_masks'] = [(name, mask.copy()) for name, mask in pmap.get_region_masks()]
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+def run_process_map_jobs(jobs, num_workers=None, return_arrays=True):
+    # Each result has the keys 'output_file' and 'error' (None, or the traceback of
+    # the exception that stopped the job), and with return_arrays=True also 'x', 'y',
+    # 'gridded_data' and 'region_masks' (see ProcessMap2D.get_gridded_data and
+    # get_region_masks). A failing job does not stop the others. With num_workers=1
+    # the jobs run in the calling process.
+    jobs_and_options = [(job, return_arrays) for job in jobs]
+    if num_workers == 1:
+        return [_run_process_map_job(job_and_options) for job_and_options in jobs_and_options]
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_use_agg_backend) as executor:
+        return list(executor.map(_run_process_map_job, jobs_and_options))
+# --------------------------------------------------------------------------------
@@ -1,21 +1,76 @@
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-from scipy.interpolate import LinearNDInterpolator
-from scipy.interpolate import CloughTocher2DInterpolator
-import matplotlib.patches as mpatches
-import matplotlib.lines as mlines
-from matplotlib.colors import ListedColormap
+from ramenlib.adaptive_maps import classify_adaptive
+from ramenlib.process_windows import find_threshold_crossings
+from ramenlib.instrumentation import instrumented
+from ramenlib.instrumentation import timed_section
+
+__all__ = ['ProcessMap2D', 'render_process_maps']
+
+def _get_num_required_positional(func):
+    # Number of positional parameters without defaults, or None if func takes *args
+    # or has no signature
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    num_required = 0
+    for parameter in parameters:
+        if parameter.kind == inspect.Parameter.VAR_POSITIONAL:
+            return None
+        if parameter.kind in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD) \
+                and parameter.default is inspect.Parameter.empty:
+            num_required = num_required + 1
+    return num_required
+
+def _takes_grid_indices(classifier_func):
+    # True for the original per-cell classifiers, classifier_func(Z, i, j).
+    # Parameters with defaults (e.g. classifier_func(Z, spot_size=55)) don't count.
+    num_required = _get_num_required_positional(classifier_func)
+    return num_required is None or num_required >= 3
+
+def _get_barycentric_weights(triangulation, points):
+    # Enclosing simplex and barycentric weights of each point, as used by linear
+    # interpolation on the triangulation. The simplex index is -1 outside the hull.
+    simplices = triangulation.find_simplex(points)
+    transforms = triangulation.transform[simplices]
+    partial_weights = np.einsum('ijk,ik->ij', transforms[:,:2,:], points - transforms[:,2,:])
+    weights = np.column_stack((partial_weights, 1.0 - np.sum(partial_weights, axis=1)))
+    return simplices, weights
+
+def _get_interpolation_matrix(triangulation, points):
+    # Sparse (num_points x num_data_points) matrix mapping values at the data points
+    # to linearly interpolated values at the points, and a mask of the points that
+    # are outside the convex hull of the data
+    from scipy.sparse import csr_matrix
+    simplices, weights = _get_barycentric_weights(triangulation, points)
+    inside = (simplices >= 0)
+    rows = np.repeat(np.nonzero(inside)[0], 3)
+    columns = triangulation.simplices[simplices[inside]].reshape(-1)
+    matrix = csr_matrix((weights[inside].reshape(-1), (rows, columns)), shape=(points.shape[0], triangulation.npoints))
+    return matrix, np.logical_not(inside)
 
 class ProcessMap2D:
-    def __init__(self, num_grid_points, grid_bounds_x, grid_bounds_y, x_label=None, y_label=None, fig_title=None):
+    def __init__(self, num_grid_points, grid_bounds_x, grid_bounds_y, x_label=None, y_label=None, fig_title=None, lazy=False):
+        # With lazy=True, the map is compute-only until it is rendered: the add_*
+        # methods only store their gridded fields and region masks in self.layers, and
+        # the figure is created and drawn on the first call to finalize or
+        # save_figure. Otherwise every layer is drawn as soon as it is added.
         self.num_grid_points = num_grid_points
         self.grid_bounds_x = grid_bounds_x
         self.grid_bounds_y = grid_bounds_y
         self.x_label = x_label
         self.y_label = y_label
         self.fig_title = fig_title
-        self.fig, self.ax = plt.subplots()
+        self.fig = None
+        self.ax = None
+        self.layers = []
+        self.legend_handles = []
+        if not lazy:
+            import matplotlib.pyplot as plt
+            self.fig, self.ax = plt.subplots()
 
         self.x = np.linspace(grid_bounds_x[0], grid_bounds_x[1], num_grid_points[0])
         self.y = np.linspace(grid_bounds_y[0], grid_bounds_y[1], num_grid_points[1])
@@ -25,83 +80,292 @@ class ProcessMap2D:
         self.region_colors = ["#bb3f3f", "#49759c"]
 
         self.num_regions = 0
-        self.legend_handles = []
 
+        # Triangulations of point data sets and the matching interpolation weights to
+        # the grid, keyed on the column names and the point coordinates
+        self._interpolation_cache = {}
+
+
+    def _get_cached_triangulation(self, data, x_name, y_name):
+        # Returns the cache entry for the point set, a dictionary with the
+        # triangulation and, once interpolate_point_data_to_grid has needed them,
+        # the interpolation weights to the grid
+        points = np.column_stack((np.asarray(data[x_name].values, dtype=float), np.asarray(data[y_name].values, dtype=float)))
+        key = (x_name, y_name, points.shape, hashlib.sha1(points.tobytes()).hexdigest())
+
+        if key not in self._interpolation_cache:
+            from scipy.spatial import Delaunay
+            with timed_section('ProcessMap2D.triangulation', points.shape[0]):
+                self._interpolation_cache[key] = {'triangulation': Delaunay(points)}
 
+        return self._interpolation_cache[key]
+
+
+    @instrumented()
     def interpolate_point_data_to_grid(self, data, func, x_name, y_name, interpolator='linear'):
-        x_points = data[x_name].values
-        y_points = data[y_name].values
+        # The Delaunay triangulation of the (x_name, y_name) points is only built
+        # once per point set. Linear interpolation then reduces to a sparse
+        # matrix-vector product with cached barycentric weights; cubic interpolation
+        # reuses the triangulation.
+        cache_entry = self._get_cached_triangulation(data, x_name, y_name)
+        triangulation = cache_entry['triangulation']
 
-        z_points = func(data)
+        z_points = np.asarray(func(data), dtype=float)
 
-        interp = None
         if (interpolator == 'linear'):
-            interp =  LinearNDInterpolator(list(zip(x_points, y_points)), z_points)
+            if 'matrix' not in cache_entry:
+                grid_points = np.column_stack((self.X.reshape(-1), self.Y.reshape(-1)))
+                with timed_section('ProcessMap2D.interpolation_weights', grid_points.shape[0]):
+                    cache_entry['matrix'], cache_entry['outside'] = _get_interpolation_matrix(triangulation, grid_points)
+            Z = cache_entry['matrix'] @ z_points
+            Z[cache_entry['outside']] = np.nan
+            Z = Z.reshape(self.X.shape)
         elif (interpolator == 'cubic'):
-            interp =  CloughTocher2DInterpolator(list(zip(x_points, y_points)), z_points)
+            from scipy.interpolate import CloughTocher2DInterpolator
+            with timed_section('ProcessMap2D.cubic_interpolant', z_points.shape[0]):
+                interp = CloughTocher2DInterpolator(triangulation, z_points)
+            Z = interp(self.X, self.Y)
+        else:
+            raise ValueError("Unknown interpolator '" + str(interpolator) + "', expected 'linear' or 'cubic'")
 
-        Z = interp(self.X, self.Y)
         return Z
 
 
-    def add_gridded_data_plot(self, Z, label=None):
-        gdp = self.ax.contourf(self.X, self.Y, Z, cmap='Greys', levels=20)
+    def __getstate__(self):
+        # Figures and triangulations are not sent to other processes; the figure is
+        # redrawn from the layers when needed
+        state = self.__dict__.copy()
+        state['fig'] = None
+        state['ax'] = None
+        state['legend_handles'] = []
+        state['_interpolation_cache'] = {}
+        return state
+
+
+    def _add_layer(self, layer):
+        self.layers.append(layer)
+        if self.ax is not None:
+            self._draw_layer(layer)
+
+
+    def _draw_layer(self, layer):
+        with timed_section('ProcessMap2D.draw_' + layer['kind']):
+            self._draw_layer_artists(layer)
+
+
+    def _draw_layer_artists(self, layer):
+        import matplotlib.patches as mpatches
+        import matplotlib.lines as mlines
+        from matplotlib.colors import ListedColormap
 
-        plt.colorbar(gdp, label=label)
+        if layer['kind'] == 'gridded_data':
+            gdp = self.ax.contourf(self.X, self.Y, layer['Z'], cmap='Greys', levels=20)
+            self.fig.colorbar(gdp, ax=self.ax, label=layer['label'])
+
+        elif layer['kind'] == 'point_data_locations':
+            self.ax.plot(layer['x'], layer['y'], "ok", label="input points", markerfacecolor='none')
+
+            legend_entry = mlines.Line2D([], [], color='k', marker='o', linewidth=0., markerfacecolor='w', label="Data locations")
+            self.legend_handles.append(legend_entry)
+
+        elif layer['kind'] == 'region':
+            # I'm not quite sure why I have to flip this
+            classification = np.logical_not(layer['mask']).astype(float)
+
+            cmap = ListedColormap(['w', layer['color']])
+            self.ax.contourf(self.X, self.Y, classification, cmap=cmap, levels=[-0.5,0.5], alpha=layer['alpha'])
+
+            if (layer['name']):
+                legend_entry = mpatches.Patch(color=layer['color'], label=layer['name'], alpha=layer['alpha'])
+                self.legend_handles.append(legend_entry)
+
+
+    @instrumented()
+    def _create_figure(self, use_pyplot=True):
+        # Figures that are only saved are created without pyplot, so they need no
+        # display backend and are not tracked by pyplot's global figure manager
+        if use_pyplot:
+            import matplotlib.pyplot as plt
+            self.fig, self.ax = plt.subplots()
+        else:
+            from matplotlib.figure import Figure
+            self.fig = Figure()
+            self.ax = self.fig.subplots()
+
+        self.legend_handles = []
+        for layer in self.layers:
+            self._draw_layer(layer)
+
+
+    def get_gridded_data(self):
+        # List of (label, Z) for every gridded data plot, in the order they were added
+        return [(layer['label'], layer['Z']) for layer in self.layers if layer['kind'] == 'gridded_data']
+
+
+    def get_region_masks(self):
+        # List of (region_name, mask) for every region, in the order they were added.
+        # The mask is True where the region is drawn.
+        return [(layer['name'], layer['mask']) for layer in self.layers if layer['kind'] == 'region']
+
+
+    def add_gridded_data_plot(self, Z, label=None):
+        self._add_layer({'kind': 'gridded_data', 'Z': Z, 'label': label})
 
 
     def add_point_data_plot(self, data, func, x_name, y_name, interpolator='linear', label=None):
         Z = self.interpolate_point_data_to_grid(data, func, x_name, y_name, interpolator)
 
-        self.add_gridded_data_plot(Z)
+        self.add_gridded_data_plot(Z, label)
 
 
     def add_point_data_locations(self, data, x_name, y_name):
         x_points = data[x_name].values
         y_points = data[y_name].values
-        self.ax.plot(x_points,y_points, "ok", label="input points", markerfacecolor='none')
+        self._add_layer({'kind': 'point_data_locations', 'x': x_points, 'y': y_points})
 
-        legend_entry = mlines.Line2D([], [], color='k', marker='o', linewidth=0., markerfacecolor='w', label="Data locations")
-        self.legend_handles.append(legend_entry)
 
-
-    def add_point_data_region(self, data, func_list, classifier_func, x_name, y_name, interpolator='linear', region_name=None, color=None, alpha=1):
+    def add_point_data_region(self, data, func_list, classifier_func, x_name, y_name, interpolator='linear', region_name=None, color=None, alpha=1, vectorized=None):
         Z_collection = []
         for func in func_list:
             Z = self.interpolate_point_data_to_grid(data, func, x_name, y_name, interpolator)
             Z_collection.append(Z)
 
         # Number of regions is incremented in `add_gridded_region`
-        self.add_gridded_region(Z_collection, classifier_func, region_name, color, alpha)
+        self.add_gridded_region(Z_collection, classifier_func, region_name, color, alpha, vectorized)
+
 
+    @instrumented()
+    def classify_grid(self, Z_collection, classifier_func, vectorized=None):
+        # Returns the boolean output of classifier_func on every grid point, with the
+        # same shape as self.X.
+        #
+        # A vectorized classifier is called once as classifier_func(Z_collection) and
+        # returns a boolean array. A per-cell classifier is called once per grid
+        # point as classifier_func(Z_collection, i, j). If vectorized is None, the
+        # mode is picked from the signature: classifiers that take (Z, i, j) are
+        # per-cell, classifiers that take a single argument are vectorized.
+        if vectorized is None:
+            vectorized = not _takes_grid_indices(classifier_func)
 
-    def add_gridded_region(self, Z_collection, classifier_func, region_name=None, color=None, alpha=1):
-        classification = np.zeros(self.num_grid_points)
+        if vectorized:
+            return np.broadcast_to(np.asarray(classifier_func(Z_collection), dtype=bool), self.X.shape)
 
+        classification = np.zeros(self.X.shape, dtype=bool)
+        for i in range(0,self.X.shape[0]):
+            for j in range(0,self.X.shape[1]):
+                classification[i,j] = classifier_func(Z_collection, i, j)
+        return classification
+
+
+    def add_gridded_region(self, Z_collection, classifier_func, region_name=None, color=None, alpha=1, vectorized=None):
         region_color = None
         if (color):
             region_color = color
         else:
             region_color = self.region_colors[self.num_regions]
 
-        for i in range(0,self.num_grid_points[0]):
-            for j in range(0,self.num_grid_points[1]):
-                # I'm not quite sure why I have to flip this
-                classification[i,j] = not classifier_func(Z_collection, i, j)
-
-        cmap = ListedColormap(['w', region_color])
-        self.ax.contourf(self.X, self.Y, classification, cmap=cmap, levels=[-0.5,0.5], alpha=alpha)
+        mask = self.classify_grid(Z_collection, classifier_func, vectorized)
 
         print('alpha is', alpha)
 
-        if (region_name):
-            legend_entry = mpatches.Patch(color=region_color, label=region_name, alpha=alpha)
-            self.legend_handles.append(legend_entry)
+        self._add_layer({'kind': 'region', 'mask': mask, 'name': region_name, 'color': region_color, 'alpha': alpha})
 
         self.num_regions = self.num_regions + 1
 
 
-    def finalize(self, fixed_show_time=None):
+    @instrumented()
+    def get_point_data_interpolator(self, data, func, x_name, y_name, interpolator='linear'):
+        # Interpolant of func(data) that can be evaluated at any (x, y) points, built
+        # on the cached triangulation of the point data
+        triangulation = self._get_cached_triangulation(data, x_name, y_name)['triangulation']
+        z_points = np.asarray(func(data), dtype=float)
+
+        if (interpolator == 'linear'):
+            from scipy.interpolate import LinearNDInterpolator
+            return LinearNDInterpolator(triangulation, z_points)
+        elif (interpolator == 'cubic'):
+            from scipy.interpolate import CloughTocher2DInterpolator
+            return CloughTocher2DInterpolator(triangulation, z_points)
+        raise ValueError("Unknown interpolator '" + str(interpolator) + "', expected 'linear' or 'cubic'")
+
+
+    def add_adaptive_point_data_region(self, data, func_list, classifier_func, x_name, y_name, interpolator='linear', coarse_stride=16, field_tol=None, region_name=None, color=None, alpha=1):
+        # Same as add_point_data_region, but the fields and the classifier are only
+        # evaluated where needed to resolve the region boundaries (see
+        # ramenlib.adaptive_maps.classify_adaptive). The classifier has to be
+        # vectorized. Returns the AdaptiveClassification, e.g. for its boundary
+        # polylines.
+        if _takes_grid_indices(classifier_func):
+            raise ValueError("Adaptive regions need a vectorized classifier, classifier_func(Z_collection)")
+
+        interpolants = [self.get_point_data_interpolator(data, func, x_name, y_name, interpolator) for func in func_list]
+
+        def field_func(x_points, y_points):
+            return [interpolant(x_points, y_points) for interpolant in interpolants]
+
+        adaptive_classification = classify_adaptive(self.x, self.y, field_func, classifier_func, coarse_stride, field_tol)
+        self.add_gridded_region([], lambda Z: adaptive_classification.mask, region_name, color, alpha)
+        return adaptive_classification
+
+
+    def add_incremental_point_data_region(self, data, func_list, classifier_func, x_name, y_name, region_name=None, color=None, alpha=1):
+        # Same as add_point_data_region with linear interpolation, but returns an
+        # IncrementalClassification (see ramenlib.incremental_maps) whose update(data)
+        # takes the point data with new points appended and re-classifies only the
+        # grid cells near them. The region layer shares the classification's mask, so
+        # the map is drawn with the latest update; for maps that are not lazy, the
+        # layers already drawn are not redrawn. The classifier has to be vectorized.
+        from ramenlib.incremental_maps import IncrementalClassification
+        if _takes_grid_indices(classifier_func):
+            raise ValueError("Incremental regions need a vectorized classifier, classifier_func(Z_collection)")
+
+        incremental_classification = IncrementalClassification(self.x, self.y, data, func_list, classifier_func, x_name, y_name)
+        self.add_gridded_region([], lambda Z: incremental_classification.mask, region_name, color, alpha)
+        self.layers[-1]['mask'] = incremental_classification.mask
+        return incremental_classification
+
+
+    def get_point_data_boundary(self, data, func_list, classifier_func, x_name, y_name, interpolator='linear', x=None, num_brackets=32, tol=None):
+        # Where the classification of add_point_data_region changes, found by root
+        # finding in y for each x (see ramenlib.process_windows). x defaults to the
+        # grid x values. The classifier has to be vectorized. Returns the
+        # ThresholdCrossings.
+        if _takes_grid_indices(classifier_func):
+            raise ValueError("Boundaries need a vectorized classifier, classifier_func(Z_collection)")
+
+        interpolants = [self.get_point_data_interpolator(data, func, x_name, y_name, interpolator) for func in func_list]
+
+        def classification(x_points, y_points):
+            return classifier_func([interpolant(x_points, y_points) for interpolant in interpolants])
+
+        if x is None:
+            x = self.x
+        return find_threshold_crossings(classification, x, self.grid_bounds_y, None, num_brackets, tol)
+
+
+    def get_point_data_threshold(self, data, func, threshold, x_name, y_name, interpolator='linear', x=None, num_brackets=32, tol=None):
+        # Where the interpolated func(data) crosses threshold, for each x
+        interpolant = self.get_point_data_interpolator(data, func, x_name, y_name, interpolator)
+        if x is None:
+            x = self.x
+        return find_threshold_crossings(interpolant, x, self.grid_bounds_y, threshold, num_brackets, tol)
+
+
+    @instrumented()
+    def save_artifact(self, filename):
+        # Binary file with the grid, the gridded data and the region masks, for point
+        # queries with ramenlib.process_map_artifacts.ProcessMapArtifact
+        from ramenlib.process_map_artifacts import save_process_map_artifact
+        save_process_map_artifact(self, filename)
+
+
+    @instrumented()
+    def finalize(self, fixed_show_time=None, show=True):
+        # With show=False the figure is only decorated, e.g. before save_figure in a
+        # batch job
+        if self.fig is None:
+            self._create_figure(use_pyplot=show)
+
         self.ax.set_title(self.fig_title)
         self.ax.set_xlabel(self.x_label)
         self.ax.set_ylabel(self.y_label)
@@ -109,6 +373,9 @@ class ProcessMap2D:
 
         if (len(self.legend_handles) > 0):
             self.ax.legend(handles=self.legend_handles, loc="best")
+        if not show:
+            return
+        import matplotlib.pyplot as plt
         if (fixed_show_time == None):
             plt.show()
         else:
@@ -116,8 +383,34 @@ class ProcessMap2D:
             plt.pause(fixed_show_time)
             plt.close()
 
+    @instrumented()
     def save_figure(self, filename):
+        if self.fig is None:
+            self._create_figure(use_pyplot=False)
         self.fig.savefig(filename, dpi=300)
 
 
-
+# --------------------------------------------------------------------------------
+# Batch rendering of process maps
+# Renders and saves many (typically lazy) ProcessMap2D objects from a pool of worker
+# processes on the Agg backend. Each map is decorated as by finalize and saved to the
+# matching filename; the filenames are returned in the input order.
+# --------------------------------------------------------------------------------
+def _use_agg_backend():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _render_process_map(pmap_and_filename):
+    pmap, filename = pmap_and_filename
+    pmap.finalize(show=False)
+    pmap.save_figure(filename)
+    return filename
+
+@instrumented()
+def render_process_maps(pmaps, filenames, num_workers=None):
+    if len(pmaps) != len(filenames):
+        raise ValueError("Expected one filename per process map, got " + str(len(filenames)) + " for " + str(len(pmaps)))
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_use_agg_backend) as executor:
+        return list(executor.map(_render_process_map, zip(pmaps, filenames)))
+# --------------------------------------------------------------------------------
@@ -0,0 +1,210 @@
+import hashlib
+import numpy as np
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['PROJECTION_REDUCTIONS', 'ProcessMapND']
+
+# --------------------------------------------------------------------------------
+# N-dimensional process maps
+# ProcessMapND holds fields and region masks over any number of named process axes
+# (e.g. power, velocity, spot size, layer thickness, hatch spacing). The grid is
+# never materialized: the axes are given to the field and classifier functions as an
+# open grid (one array per axis, with length 1 along the other axes), and the results
+# are stored with the broadcast shape of whatever they depend on. A depth field
+# interpolated from power/velocity point data is stored with shape (n_power,
+# n_velocity, 1, 1), and a keyhole mask that also depends on the spot size with shape
+# (n_power, n_velocity, n_spot_size, 1).
+#
+# 2D slices (the other axes fixed) and projections (reduced over the other axes) are
+# returned in the orientation of ProcessMap2D, shape (len(y), len(x)), and
+# to_process_map_2d builds a ProcessMap2D from them for plotting.
+# --------------------------------------------------------------------------------
+PROJECTION_REDUCTIONS = ['any', 'all', 'min', 'max', 'mean']
+
+class ProcessMapND:
+    def __init__(self, axes):
+        # axes: list of (name, values) with 1D arrays of the axis values
+        self.axis_names = [name for name, values in axes]
+        self.axis_values = [np.asarray(values, dtype=float) for name, values in axes]
+        if len(set(self.axis_names)) != len(self.axis_names):
+            raise ValueError("Axis names have to be unique, got " + str(self.axis_names))
+        self.shape = tuple(values.size for values in self.axis_values)
+
+        # Name -> array that broadcasts against self.shape
+        self.fields = {}
+        self.regions = {}
+
+        # Triangulations of point data sets, keyed on the column names and the points
+        self._triangulations = {}
+
+    def _get_axis_index(self, name):
+        if name not in self.axis_names:
+            raise ValueError("Unknown axis '" + str(name) + "', expected one of " + str(self.axis_names))
+        return self.axis_names.index(name)
+
+    def get_open_grid(self):
+        # Dictionary of axis name -> axis values shaped to broadcast against the others
+        grid = {}
+        for index, (name, values) in enumerate(zip(self.axis_names, self.axis_values)):
+            shape = [1] * len(self.shape)
+            shape[index] = values.size
+            grid[name] = values.reshape(shape)
+        return grid
+
+    def _get_compact(self, values):
+        # Drops leading dimensions that were added by broadcasting, so that the stored
+        # array has one (possibly length 1) dimension per axis
+        values = np.asarray(values)
+        np.broadcast_shapes(values.shape, self.shape)
+        return values.reshape((1,) * (len(self.shape) - values.ndim) + values.shape)
+
+    @instrumented()
+    def add_field(self, name, func):
+        # func(grid): the field on the open grid (see get_open_grid)
+        self.fields[name] = self._get_compact(func(self.get_open_grid()))
+
+    @instrumented()
+    def add_point_data_field(self, name, data, func, axis_columns, interpolator='linear'):
+        # Interpolates func(data) from scattered point data onto two of the axes.
+        # axis_columns: dictionary with two entries, axis name -> column of data. The
+        # points are triangulated in the order of axis_columns, as (x, y) points are
+        # by ProcessMap2D, which matters for points on a regular grid.
+        from scipy.spatial import Delaunay
+        from scipy.interpolate import LinearNDInterpolator
+        from scipy.interpolate import CloughTocher2DInterpolator
+
+        if len(axis_columns) != 2:
+            raise ValueError("Point data fields are interpolated on two axes, got " + str(list(axis_columns.keys())))
+        axes = list(axis_columns.keys())
+        columns = [axis_columns[axis] for axis in axes]
+
+        points = np.column_stack([np.asarray(data[column].values, dtype=float) for column in columns])
+        key = (tuple(columns), points.shape, hashlib.sha1(points.tobytes()).hexdigest())
+        if key not in self._triangulations:
+            self._triangulations[key] = Delaunay(points)
+        triangulation = self._triangulations[key]
+
+        z_points = np.asarray(func(data), dtype=float)
+        if (interpolator == 'linear'):
+            interp = LinearNDInterpolator(triangulation, z_points)
+        elif (interpolator == 'cubic'):
+            interp = CloughTocher2DInterpolator(triangulation, z_points)
+        else:
+            raise ValueError("Unknown interpolator '" + str(interpolator) + "', expected 'linear' or 'cubic'")
+
+        A, B = np.meshgrid(self.axis_values[self._get_axis_index(axes[0])], self.axis_values[self._get_axis_index(axes[1])], indexing='ij')
+        Z = interp(A, B)
+        if self._get_axis_index(axes[0]) > self._get_axis_index(axes[1]):
+            Z = Z.T
+
+        shape = [1] * len(self.shape)
+        for axis in axes:
+            shape[self._get_axis_index(axis)] = self.shape[self._get_axis_index(axis)]
+        self.fields[name] = Z.reshape(shape)
+
+    @instrumented()
+    def add_region(self, name, field_names, classifier_func, uses_grid=None):
+        # classifier_func(Z_collection) or classifier_func(Z_collection, grid), where
+        # Z_collection is the list of the named fields and grid the open grid, e.g.
+        #   lambda Z, grid: keyhole_porosity_classifier(Z[0], grid['spot_size'])
+        # returns a boolean array that broadcasts against the map. If uses_grid is
+        # None, the grid is passed to classifiers with two required positional
+        # parameters; parameters with defaults (lambda Z, spot_size=55: ...) don't
+        # count.
+        from ramenlib.process_maps import _get_num_required_positional
+        Z_collection = [self.fields[field_name] for field_name in field_names]
+        if uses_grid is None:
+            uses_grid = (_get_num_required_positional(classifier_func) or 0) >= 2
+        if uses_grid:
+            mask = classifier_func(Z_collection, self.get_open_grid())
+        else:
+            mask = classifier_func(Z_collection)
+        self.regions[name] = self._get_compact(np.asarray(mask, dtype=bool))
+
+    def _get_array(self, name):
+        if name in self.regions:
+            return self.regions[name]
+        if name in self.fields:
+            return self.fields[name]
+        raise ValueError("Unknown field or region '" + str(name) + "'")
+
+    def _get_index(self, axis, value):
+        # Index of the axis value closest to value
+        return int(np.argmin(np.abs(self.axis_values[self._get_axis_index(axis)] - value)))
+
+    def _to_xy(self, array, x_axis, y_axis):
+        # (x, y) array -> (len(y), len(x)) array, broadcast to the full plane
+        array = np.broadcast_to(array, (self.shape[self._get_axis_index(x_axis)], self.shape[self._get_axis_index(y_axis)]))
+        return array.T
+
+    def get_slice(self, name, x_axis, y_axis, fixed_values):
+        # The field or region on the (x_axis, y_axis) plane, with every other axis
+        # fixed at the axis value closest to fixed_values[axis]
+        x_index = self._get_axis_index(x_axis)
+        y_index = self._get_axis_index(y_axis)
+        array = self._get_array(name)
+
+        index = []
+        for axis_index, axis in enumerate(self.axis_names):
+            if axis_index in (x_index, y_index):
+                index.append(slice(None))
+            elif axis not in fixed_values:
+                raise ValueError("No value given for the axis '" + axis + "'")
+            elif array.shape[axis_index] == 1:
+                index.append(0)
+            else:
+                index.append(self._get_index(axis, fixed_values[axis]))
+        array = array[tuple(index)]
+        if x_index > y_index:
+            array = array.T
+        return self._to_xy(array, x_axis, y_axis)
+
+    def get_projection(self, name, x_axis, y_axis, reduction='any'):
+        # The field or region reduced over every other axis: 'any' or 'all' for
+        # regions (e.g. where a defect occurs for any spot size), 'min', 'max' or
+        # 'mean' for fields
+        if reduction not in PROJECTION_REDUCTIONS:
+            raise ValueError("Unknown reduction '" + str(reduction) + "', expected one of " + str(PROJECTION_REDUCTIONS))
+        x_index = self._get_axis_index(x_axis)
+        y_index = self._get_axis_index(y_axis)
+        array = self._get_array(name)
+
+        # Axes the array is constant along don't change any of the reductions
+        other_axes = tuple(axis_index for axis_index in range(len(self.shape)) if axis_index not in (x_index, y_index))
+        array = getattr(np, reduction)(array, axis=other_axes)
+        if x_index > y_index:
+            array = array.T
+        return self._to_xy(array, x_axis, y_axis)
+
+    def to_process_map_2d(self, x_axis, y_axis, fixed_values=None, reduction='any', fields=(), regions=(),
+                          x_label=None, y_label=None, fig_title=None, lazy=True):
+        # ProcessMap2D of the given fields and regions on the (x_axis, y_axis) plane,
+        # as slices at fixed_values or, if fixed_values is None, as projections with
+        # reduction. fields: list of (field name, label); regions: list of region
+        # names, or of (region name, color). The x and y axes have to be uniform, as
+        # ProcessMap2D grids are.
+        from ramenlib.process_maps import ProcessMap2D
+
+        x_values = self.axis_values[self._get_axis_index(x_axis)]
+        y_values = self.axis_values[self._get_axis_index(y_axis)]
+        for values in [x_values, y_values]:
+            if not np.allclose(values, np.linspace(values[0], values[-1], values.size)):
+                raise ValueError("ProcessMap2D needs uniformly spaced x and y axes")
+
+        pmap = ProcessMap2D(num_grid_points=[x_values.size, y_values.size], grid_bounds_x=(x_values[0], x_values[-1]),
+                            grid_bounds_y=(y_values[0], y_values[-1]), x_label=x_label, y_label=y_label,
+                            fig_title=fig_title, lazy=lazy)
+
+        def get_plane(name, field_reduction):
+            if fixed_values is not None:
+                return self.get_slice(name, x_axis, y_axis, fixed_values)
+            return self.get_projection(name, x_axis, y_axis, field_reduction)
+
+        for name, label in fields:
+            pmap.add_gridded_data_plot(get_plane(name, 'mean' if reduction in ('any', 'all') else reduction), label)
+        for region in regions:
+            name, color = region if isinstance(region, tuple) else (region, None)
+            mask = get_plane(name, reduction)
+            pmap.add_gridded_region([], lambda Z, mask=mask: mask, region_name=name, color=color)
+        return pmap
+# --------------------------------------------------------------------------------
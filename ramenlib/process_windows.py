@@ -0,0 +1,129 @@
+import numpy as np
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['ThresholdCrossings', 'find_threshold_crossings']
+
+# --------------------------------------------------------------------------------
+# Process window boundaries by root finding
+# For each x (e.g. each scan speed), find_threshold_crossings finds the y values (e.g.
+# the laser powers) at which a classifier changes, or at which a field crosses a
+# threshold, without evaluating the whole grid:
+# 1. the function is sampled at num_brackets+1 points in y for all x at once, and
+#    every pair of neighbouring samples with different classifications brackets a
+#    crossing
+# 2. all of the brackets are then bisected together, one vectorized function call
+#    per iteration, until they are smaller than tol
+# so a boundary costs O(N num_brackets + N log2(1/tol)) evaluations for N x values,
+# instead of O(N^2) for an N x N grid. For fields, the final estimate interpolates
+# linearly between the ends of the bracket, which is exact for linearly interpolated
+# point data once the bracket is inside one triangle.
+#
+# Two crossings within the same initial bracket cancel out and are not found, so
+# num_brackets should resolve the narrowest feature of interest. For fields, samples
+# that are NaN (e.g. outside the convex hull of the point data) do not bracket
+# crossings.
+# --------------------------------------------------------------------------------
+class ThresholdCrossings:
+    def __init__(self, x, y_bounds, y, state_at_y_min, num_evaluations):
+        self.x = x
+        self.y_bounds = y_bounds
+        # Crossings for each x in increasing order, shape (len(x), max number of
+        # crossings), padded with NaN
+        self.y = y
+        # Classification (or field > threshold) at y_bounds[0] for each x
+        self.state_at_y_min = state_at_y_min
+        # Number of points where the function was evaluated
+        self.num_evaluations = num_evaluations
+
+    def get_polylines(self):
+        # List of (n, 2) arrays of (x, y) vertices, one per run of consecutive x
+        # values that have a k-th crossing
+        polylines = []
+        for k in range(self.y.shape[1]):
+            valid = np.logical_not(np.isnan(self.y[:,k]))
+            edges = np.diff(np.concatenate(([0], valid.astype(int), [0])))
+            for start, end in zip(np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]):
+                polylines.append(np.column_stack((self.x[start:end], self.y[start:end,k])))
+        return polylines
+
+    def get_intervals(self, state=False):
+        # List with one (n, 2) array per x of the [y0, y1] intervals where the
+        # classification (or field > threshold) equals state, e.g. the process window
+        # where a defect classifier is False
+        intervals = []
+        for i in range(len(self.x)):
+            crossings = self.y[i][np.logical_not(np.isnan(self.y[i]))]
+            ends = np.concatenate(([self.y_bounds[0]], crossings, [self.y_bounds[1]]))
+            states = (np.arange(len(ends)-1) % 2 == 0) == bool(self.state_at_y_min[i])
+            if not state:
+                states = np.logical_not(states)
+            intervals.append(np.column_stack((ends[:-1][states], ends[1:][states])))
+        return intervals
+
+@instrumented()
+def find_threshold_crossings(func, x, y_bounds, threshold=None, num_brackets=32, tol=None):
+    # func(x_points, y_points): values at the points, as a 1D array
+    # threshold: None if func is a classifier returning booleans, otherwise the value
+    #   of the field to find
+    # tol: width of the final brackets, by default 1e-6 of the y range
+    x = np.asarray(x, dtype=float)
+    if tol is None:
+        tol = 1.0e-6 * (y_bounds[1] - y_bounds[0])
+
+    def evaluate(x_points, y_points):
+        values = np.asarray(func(x_points, y_points))
+        if threshold is None:
+            return values.astype(bool), None, np.ones(values.shape, dtype=bool)
+        values = values.astype(float)
+        return values > threshold, values, np.logical_not(np.isnan(values))
+
+    # Initial brackets
+    y_samples = np.linspace(y_bounds[0], y_bounds[1], num_brackets+1)
+    X, Y = np.meshgrid(x, y_samples, indexing='ij')
+    state, values, valid = evaluate(X.reshape(-1), Y.reshape(-1))
+    state = state.reshape(X.shape)
+    valid = valid.reshape(X.shape)
+    num_evaluations = X.size
+
+    changes = (state[:,1:] != state[:,:-1]) & valid[:,1:] & valid[:,:-1]
+    ix, ib = np.nonzero(changes)
+    lower = y_samples[ib]
+    upper = y_samples[ib+1]
+    state_lower = state[ix, ib]
+    if values is not None:
+        values = values.reshape(X.shape)
+        value_lower = values[ix, ib]
+        value_upper = values[ix, ib+1]
+
+    # Bisection of all of the brackets together
+    num_iterations = max(0, int(np.ceil(np.log2((y_samples[1] - y_samples[0]) / tol))))
+    for iteration in range(num_iterations):
+        if ix.size == 0:
+            break
+        middle = 0.5 * (lower + upper)
+        state_middle, value_middle, valid_middle = evaluate(x[ix], middle)
+        num_evaluations = num_evaluations + ix.size
+
+        # NaN values shrink the bracket towards the lower end
+        same = (state_middle == state_lower) & valid_middle
+        lower = np.where(same, middle, lower)
+        upper = np.where(same, upper, middle)
+        if values is not None:
+            value_lower = np.where(same, value_middle, value_lower)
+            value_upper = np.where(same, value_upper, value_middle)
+
+    crossings = 0.5 * (lower + upper)
+    if values is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            interpolated = lower + (threshold - value_lower) * (upper - lower) / (value_upper - value_lower)
+        use_interpolated = np.isfinite(interpolated) & (interpolated >= lower) & (interpolated <= upper)
+        crossings = np.where(use_interpolated, interpolated, crossings)
+
+    # Crossings per x, in increasing y
+    counts = np.sum(changes, axis=1)
+    y = np.full((len(x), int(np.max(counts, initial=0))), np.nan)
+    position = (np.cumsum(changes, axis=1) - 1)[ix, ib]
+    y[ix, position] = crossings
+
+    return ThresholdCrossings(x, y_bounds, y, state[:,0], num_evaluations)
+# --------------------------------------------------------------------------------
@@ -0,0 +1,196 @@
+import numpy as np
+from ramenlib.compiled_material import CompiledMaterial
+from ramenlib.core import get_eutectic_phase_fractions
+from ramenlib.core import get_eutectic_lamellar_spacing
+from ramenlib.core import get_orowan_strengthening_lamella
+from ramenlib.core import get_solid_solution_strengthening
+from ramenlib.core import get_grain_boundary_strengthening
+from ramenlib.instrumentation import instrumented
+
+__all__ = ['UNCERTAINTY_DISTRIBUTIONS', 'UNCERTAINTY_OUTPUTS', 'iterate_uncertainty_batches',
+           'propagate_uncertainty']
+
+_get_eutectic_lamellar_spacing = instrumented()(get_eutectic_lamellar_spacing.uncached)
+
+# --------------------------------------------------------------------------------
+# Uncertainty propagation through the yield strength chain
+# The uncertain material parameters are given by their CompiledMaterial names and in
+# the units CompiledMaterial stores them in (contact angles in radians), e.g.
+#   uncertainties = {'gamma_alphal': ('relative_normal', 0.1),
+#                    'theta_alpha': ('uniform', 0.05),
+#                    'k_HP': ('normal', 1.0e4)}
+# Each sample perturbs the nominal value from the material:
+#   ('normal', std), ('relative_normal', std / nominal value),
+#   ('uniform', half width), ('relative_uniform', half width / nominal value)
+#
+# The samples are drawn in batches of batch_size, either independently
+# (method='monte_carlo') or as a Latin hypercube per batch (method='latin_hypercube').
+# Each batch of parameter vectors is put in a CompiledMaterial as arrays, and the
+# phase fraction -> spacing -> strengthening chain is evaluated for the whole batch
+# with array operations. The process conditions (solute composition, solidification
+# velocity, grain diameter) are scalars or arrays that broadcast against each other;
+# the outputs of a batch have the shape (batch size,) + condition shape.
+#
+# iterate_uncertainty_batches yields the batches one at a time. propagate_uncertainty
+# reduces them to statistics as they are generated: the mean, standard deviation,
+# minimum and maximum are exact, and the quantiles are computed from a uniform random
+# subsample (reservoir) of at most reservoir_size samples, so they are exact when
+# num_samples <= reservoir_size. Memory use is set by batch_size and reservoir_size,
+# not by num_samples. The lamellar spacing is evaluated without the model cache of
+# ramenlib.memoization (as in ramenlib.pipelines): every batch has new samples, so
+# caching them would only keep every batch in memory.
+# --------------------------------------------------------------------------------
+UNCERTAINTY_DISTRIBUTIONS = ['normal', 'relative_normal', 'uniform', 'relative_uniform']
+UNCERTAINTY_OUTPUTS = ['lamellar_spacing', 'orowan_strengthening_lamella', 'solid_solution_strengthening',
+                       'grain_boundary_strengthening', 'yield_strength']
+
+def _get_unit_samples(rng, distribution, num_samples, method):
+    # Standard normal samples, or uniform samples on [-1, 1]
+    if method == 'monte_carlo':
+        if distribution.endswith('normal'):
+            return rng.standard_normal(num_samples)
+        return rng.uniform(-1.0, 1.0, num_samples)
+
+    # One sample in each of num_samples equal-probability strata, in random order
+    u = (rng.permutation(num_samples) + rng.random(num_samples)) / num_samples
+    if distribution.endswith('normal'):
+        from scipy.special import ndtri
+        return ndtri(u)
+    return 2.0*u - 1.0
+
+def _get_parameter_samples(mat, uncertainties, rng, num_samples, method):
+    samples = {}
+    for name, (distribution, width) in uncertainties.items():
+        nominal = getattr(mat, name)
+        if distribution.startswith('relative_'):
+            width = width * np.abs(nominal)
+        samples[name] = nominal + width * _get_unit_samples(rng, distribution, num_samples, method)
+    return samples
+
+def iterate_uncertainty_batches(mat, phases, solute_composition, solidification_velocity, grain_diameter, uncertainties,
+                                num_samples=10000, method='latin_hypercube', batch_size=65536, seed=None, P_backend=None):
+    # Returns an iterator over (parameter_samples, outputs) for every batch, where
+    # parameter_samples is a dictionary of parameter name -> (batch size,) array and
+    # outputs a dictionary with the keys in UNCERTAINTY_OUTPUTS
+    if not isinstance(mat, CompiledMaterial):
+        mat = CompiledMaterial(mat, phases)
+    if num_samples < 1:
+        raise ValueError("Expected at least one sample, got " + str(num_samples))
+    if method not in ['monte_carlo', 'latin_hypercube']:
+        raise ValueError("Unknown sampling method '" + str(method) + "', expected 'monte_carlo' or 'latin_hypercube'")
+    for name, (distribution, width) in uncertainties.items():
+        if name not in CompiledMaterial.__slots__ or name in ('phases', 'solutes', 'solute_misfits'):
+            raise ValueError("Unknown material parameter '" + str(name) + "'")
+        if distribution not in UNCERTAINTY_DISTRIBUTIONS:
+            raise ValueError("Unknown distribution '" + str(distribution) + "', expected one of " + str(UNCERTAINTY_DISTRIBUTIONS))
+
+    return _iterate_uncertainty_batches(mat, phases, solute_composition, solidification_velocity, grain_diameter,
+                                        uncertainties, num_samples, method, batch_size, seed, P_backend)
+
+def _iterate_uncertainty_batches(mat, phases, solute_composition, solidification_velocity, grain_diameter, uncertainties,
+                                 num_samples, method, batch_size, seed, P_backend):
+    matrix_phase = phases[0]
+    secondary_phase = phases[1]
+    solute_composition = np.asarray(solute_composition, dtype=float)
+    solidification_velocity = np.asarray(solidification_velocity, dtype=float)
+    grain_diameter = np.asarray(grain_diameter, dtype=float)
+    condition_shape = np.broadcast_shapes(solute_composition.shape, solidification_velocity.shape, grain_diameter.shape)
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_samples, batch_size):
+        num_batch_samples = min(batch_size, num_samples - start)
+        shape = (num_batch_samples,) + condition_shape
+
+        # Parameter arrays of shape (batch size, 1, ...) broadcast against the conditions
+        parameter_samples = _get_parameter_samples(mat, uncertainties, rng, num_batch_samples, method)
+        sampled_mat = mat.with_values({name: values.reshape((-1,) + (1,) * len(condition_shape))
+                                       for name, values in parameter_samples.items()})
+
+        phase_fractions = get_eutectic_phase_fractions(sampled_mat, phases, solute_composition)
+        spacing = _get_eutectic_lamellar_spacing(sampled_mat, phases, phase_fractions, solidification_velocity, P_backend)
+
+        outputs = {}
+        outputs['lamellar_spacing'] = np.broadcast_to(spacing, shape)
+        outputs['orowan_strengthening_lamella'] = np.broadcast_to(
+            get_orowan_strengthening_lamella(sampled_mat, matrix_phase, secondary_phase, spacing, phase_fractions), shape)
+        outputs['solid_solution_strengthening'] = np.broadcast_to(get_solid_solution_strengthening(sampled_mat, matrix_phase), shape)
+        outputs['grain_boundary_strengthening'] = np.broadcast_to(get_grain_boundary_strengthening(sampled_mat, grain_diameter), shape)
+        outputs['yield_strength'] = outputs['orowan_strengthening_lamella'] + outputs['solid_solution_strengthening'] \
+                                    + outputs['grain_boundary_strengthening']
+
+        yield parameter_samples, outputs
+
+class _RunningStatistics:
+    # Mean and variance merged batch by batch (Chan et al.), minimum, maximum and a
+    # reservoir sample for the quantiles
+    def __init__(self, reservoir_size, rng):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.reservoir = None
+        self.reservoir_size = reservoir_size
+        self.rng = rng
+
+    def update(self, values):
+        n = values.shape[0]
+        batch_mean = np.mean(values, axis=0)
+        batch_m2 = np.sum((values - batch_mean)**2, axis=0)
+        if self.count == 0:
+            self.mean = batch_mean
+            self.m2 = batch_m2
+            self.min = np.min(values, axis=0)
+            self.max = np.max(values, axis=0)
+            self.reservoir = np.empty((self.reservoir_size,) + values.shape[1:])
+        else:
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean = self.mean + delta * n / total
+            self.m2 = self.m2 + batch_m2 + delta**2 * self.count * n / total
+            self.min = np.minimum(self.min, np.min(values, axis=0))
+            self.max = np.maximum(self.max, np.max(values, axis=0))
+
+        # Reservoir sampling: the first reservoir_size samples fill the reservoir, and
+        # sample number t > reservoir_size then replaces a random entry with
+        # probability reservoir_size / t
+        num_fill = max(0, min(n, self.reservoir_size - self.count))
+        self.reservoir[self.count:self.count+num_fill] = values[:num_fill]
+        if num_fill < n:
+            t = self.count + np.arange(num_fill, n) + 1
+            slots = (self.rng.random(n - num_fill) * t).astype(np.int64)
+            replace = slots < self.reservoir_size
+            self.reservoir[slots[replace]] = values[num_fill:][replace]
+        self.count = self.count + n
+
+    def get_summary(self, quantiles):
+        subsample = self.reservoir[:min(self.count, self.reservoir_size)]
+        return {'mean': self.mean,
+                'std': np.sqrt(self.m2 / max(self.count - 1, 1)),
+                'min': self.min,
+                'max': self.max,
+                'quantiles': {q: np.quantile(subsample, q, axis=0) for q in quantiles}}
+
+@instrumented()
+def propagate_uncertainty(mat, phases, solute_composition, solidification_velocity, grain_diameter, uncertainties,
+                          num_samples=10000, method='latin_hypercube', batch_size=65536, seed=None,
+                          quantiles=(0.05, 0.5, 0.95), reservoir_size=100000, P_backend=None):
+    # Returns a dictionary with 'num_samples' and, for every name in
+    # UNCERTAINTY_OUTPUTS, a dictionary of 'mean', 'std' (sample standard deviation),
+    # 'min', 'max' and 'quantiles' (q -> value), each of the condition shape
+    # The samples are the same as from iterate_uncertainty_batches with the same seed;
+    # the reservoirs use a separate random stream
+    batches = iterate_uncertainty_batches(mat, phases, solute_composition, solidification_velocity, grain_diameter,
+                                          uncertainties, num_samples, method, batch_size, seed, P_backend)
+    reservoir_rng = np.random.default_rng(None if seed is None else [seed, 1])
+    statistics = {name: _RunningStatistics(reservoir_size, reservoir_rng) for name in UNCERTAINTY_OUTPUTS}
+
+    for parameter_samples, outputs in batches:
+        for name in UNCERTAINTY_OUTPUTS:
+            statistics[name].update(outputs[name])
+
+    results = {'num_samples': num_samples}
+    for name in UNCERTAINTY_OUTPUTS:
+        results[name] = statistics[name].get_summary(quantiles)
+    return results
+# --------------------------------------------------------------------------------
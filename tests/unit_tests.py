@@ -3,6 +3,11 @@ import sys
 import numpy as np
 import pandas as pd
 import time
+import glob
+import json
+import tempfile
+import subprocess
+import importlib
 
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -12,6 +17,8 @@ import mistlib as mist
 import ramenlib as ramen
 
 import unittest
+from scipy.interpolate import LinearNDInterpolator
+from scipy.special import erf
 
 # Quantity of interest function for point data, data
 def test_func1(data):
@@ -52,6 +59,16 @@ def test_func5(Z, i, j):
     else:
         return True
 
+# Classification function for gridded data for keyholing, on whole arrays
+def test_func6(Z):
+    return ramen.keyhole_porosity_classifier(Z[0], 55)
+
+# Gridded data function for process map jobs
+def test_func7(mat, pmap):
+    phases = ['alpha', 'theta']
+    phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, 2.6)
+    return ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, pmap.X)
+
 
 class TestSuite(unittest.TestCase):
     """Test cases."""
@@ -130,6 +147,864 @@ class TestSuite(unittest.TestCase):
 
         pmap.finalize(1.0)
 
+    def test_P_JH_closed_form(self):
+        print("Test: test_P_JH_closed_form")
+        for g in [0.01, 0.1, 0.25, 0.5, 0.75, 0.97]:
+            P, error = ramen.get_P_JH(g, return_error=True)
+            P_sum, error_sum = ramen.get_P_JH(g, n_max=10000, return_error=True)
+            P_long_sum = ramen.get_P_JH(g, n_max=1000000)
+
+            self.assertLess(error, 1.0e-15)
+            self.assertLessEqual(abs(P - P_sum), error + error_sum)
+            self.assertAlmostEqual(P, P_long_sum, delta=1.0e-12)
+
+    def test_lamellar_spacing_arrays(self):
+        print("Test: test_lamellar_spacing_arrays")
+        mat = mist.core.MaterialInformation(os.path.join("..", "examples", "AlCu.json"))
+        phases = ['alpha', 'theta']
+        c_Cu = np.linspace(2.6, 30.0, 7)
+        velocity = np.linspace(0.1, 2.0, 5)
+
+        phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, c_Cu[:, np.newaxis])
+        spacing = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity[np.newaxis, :])
+        self.assertEqual(spacing.shape, (c_Cu.size, velocity.size))
+
+        for i in range(c_Cu.size):
+            for j in range(velocity.size):
+                phase_fractions_ij = ramen.get_eutectic_phase_fractions(mat, phases, c_Cu[i])
+                spacing_ij = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions_ij, velocity[j])
+                self.assertAlmostEqual(spacing[i, j], spacing_ij, delta=1.0e-12*spacing_ij)
+
+        # Chunked evaluation gives the same result as a single chunk
+        g = phase_fractions['alpha'].ravel()
+        np.testing.assert_allclose(ramen.get_P_JH(g, chunk_size=2), ramen.get_P_JH(g), rtol=1.0e-14)
+
+    def test_P_JH_table(self):
+        print("Test: test_P_JH_table")
+        g = np.linspace(0.0, 1.0, 1001)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # The default cache directory is also a temporary one, so the table
+            # backend doesn't write to ~/.cache/ramen
+            old_cache_dir = os.environ.get('RAMEN_CACHE_DIR')
+            os.environ['RAMEN_CACHE_DIR'] = os.path.join(cache_dir, "user_cache")
+            try:
+                P, error = ramen.get_P_JH_interpolated(g, num_intervals=256, return_error=True, cache_dir=cache_dir)
+                self.assertTrue(os.path.exists(os.path.join(cache_dir, "P_JH_table_v1_256.npy")))
+                self.assertTrue(np.all(np.abs(P - ramen.get_P_JH(g)) <= error))
+
+                mat = mist.core.MaterialInformation(os.path.join("..", "examples", "AlCu.json"))
+                phases = ['alpha', 'theta']
+                phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, 2.6)
+                spacing_series = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.3)
+                ramen.set_P_JH_backend('table')
+                try:
+                    spacing_table = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 1.3)
+                finally:
+                    ramen.set_P_JH_backend('series')
+                self.assertAlmostEqual(spacing_table, spacing_series, delta=1.0e-12*spacing_series)
+                self.assertTrue(os.path.exists(os.path.join(cache_dir, "user_cache", "P_JH_table_v1_1024.npy")))
+            finally:
+                if old_cache_dir is None:
+                    del os.environ['RAMEN_CACHE_DIR']
+                else:
+                    os.environ['RAMEN_CACHE_DIR'] = old_cache_dir
+
+    def test_compiled_material(self):
+        print("Test: test_compiled_material")
+        mat = mist.core.MaterialInformation(os.path.join("..", "examples", "AlCu.json"))
+        phases = ['alpha', 'theta']
+        compiled_mat = ramen.CompiledMaterial(mat, phases)
+
+        for m in [mat, compiled_mat]:
+            phase_fractions = ramen.get_eutectic_phase_fractions(m, phases, 2.6)
+            spacing = ramen.get_eutectic_lamellar_spacing(m, phases, phase_fractions, 1.3)
+            results = [phase_fractions['alpha'], spacing,
+                       ramen.get_orowan_strengthening_lamella(m, 'alpha', 'theta', spacing, phase_fractions),
+                       ramen.get_solid_solution_strengthening(m, 'alpha'),
+                       ramen.get_grain_boundary_strengthening(m, 5.0e-6)]
+            if m is mat:
+                expected = results
+        self.assertEqual(results, expected)
+
+        with self.assertRaises(ValueError):
+            ramen.get_solid_solution_strengthening(compiled_mat, 'theta')
+
+    def test_predict_yield_strength(self):
+        print("Test: test_predict_yield_strength")
+        mat = mist.core.MaterialInformation(os.path.join("..", "examples", "AlCu.json"))
+        phases = ['alpha', 'theta']
+        c_Cu = np.linspace(2.6, 20.0, 4)[:, np.newaxis]
+        velocity = np.linspace(0.1, 2.0, 3)[np.newaxis, :]
+        grain_diameter = 5.0e-6
+
+        results = ramen.predict_yield_strength(mat, phases, c_Cu, velocity, grain_diameter, chunk_size=5)
+
+        phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, c_Cu)
+        spacing = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity)
+        orowan = ramen.get_orowan_strengthening_lamella(mat, 'alpha', 'theta', spacing, phase_fractions)
+        total = orowan + ramen.get_solid_solution_strengthening(mat, 'alpha') \
+                + ramen.get_grain_boundary_strengthening(mat, grain_diameter)
+
+        self.assertEqual(results['yield_strength'].shape, (4, 3))
+        self.assertTrue(results['yield_strength'].flags['C_CONTIGUOUS'])
+        np.testing.assert_allclose(results['lamellar_spacing'], spacing, rtol=1.0e-14)
+        np.testing.assert_allclose(results['orowan_strengthening_lamella'], orowan, rtol=1.0e-14)
+        np.testing.assert_allclose(results['yield_strength'], total, rtol=1.0e-14)
+
+        # Full-size inputs are sliced directly and single values are passed as scalars
+        c_full = np.broadcast_to(c_Cu, (4, 3)).copy()
+        results_full = ramen.predict_yield_strength(mat, phases, c_full, np.broadcast_to(velocity, (4, 3)).copy(),
+                                                    np.array([grain_diameter]), chunk_size=5)
+        for name in ['lamellar_spacing', 'orowan_strengthening_lamella', 'yield_strength']:
+            np.testing.assert_allclose(results_full[name], results[name], rtol=1.0e-14)
+        np.testing.assert_allclose(results_full['eutectic_phase_fractions']['theta'],
+                                   np.broadcast_to(phase_fractions['theta'], (4, 3)), rtol=1.0e-14)
+        results_scalar = ramen.predict_yield_strength(mat, phases, 2.6, velocity, grain_diameter, chunk_size=2)
+        np.testing.assert_allclose(results_scalar['yield_strength'], results['yield_strength'][:1], rtol=1.0e-14)
+        self.assertEqual(results_scalar['eutectic_phase_fractions']['alpha'].shape, (1, 3))
+
+    def test_vectorized_classifier(self):
+        print("Test: test_vectorized_classifier")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 100
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y)
+        Z = pmap.interpolate_point_data_to_grid(data, test_func3, x_name="2", y_name="1")
+
+        keyhole_mask = pmap.classify_grid([Z], lambda Z: ramen.keyhole_porosity_classifier(Z[0], 55))
+        lack_of_fusion_mask = pmap.classify_grid([Z], lambda Z: ramen.lack_of_fusion_porosity_classifier(Z[0], 30))
+
+        np.testing.assert_array_equal(keyhole_mask, pmap.classify_grid([Z], test_func4))
+        np.testing.assert_array_equal(lack_of_fusion_mask, pmap.classify_grid([Z], test_func5))
+
+        # Parameters with defaults don't make a classifier per-cell
+        def keyhole_classifier(Z, spot_size=55, layer_thickness=30):
+            return ramen.keyhole_porosity_classifier(Z[0], spot_size)
+        np.testing.assert_array_equal(pmap.classify_grid([Z], keyhole_classifier), keyhole_mask)
+
+        pmap.add_gridded_region([Z], lambda Z: ramen.keyhole_porosity_classifier(Z[0], 55), region_name="Keyhole regime")
+        pmap.finalize(1.0)
+
+    def test_interpolation_cache(self):
+        print("Test: test_interpolation_cache")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 100
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y)
+        for column in ["3", "4", "5"]:
+            Z = pmap.interpolate_point_data_to_grid(data, lambda data: data[column].values, x_name="2", y_name="1")
+            Z_reference = LinearNDInterpolator(list(zip(data["2"].values, data["1"].values)), data[column].values)(pmap.X, pmap.Y)
+            np.testing.assert_allclose(Z, Z_reference, rtol=1.0e-12, atol=1.0e-10)
+        pmap.interpolate_point_data_to_grid(data, test_func1, x_name="2", y_name="1", interpolator='cubic')
+
+        # One triangulation for all of the fields from the same point set
+        self.assertEqual(len(pmap._interpolation_cache), 1)
+
+    def test_lazy_process_maps(self):
+        print("Test: test_lazy_process_maps")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 100
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmaps = []
+        for spot_size in [45, 55]:
+            pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y, lazy=True)
+            pmap.add_point_data_plot(data, test_func1, x_name="2", y_name="1", label="Depth")
+            pmap.add_point_data_region(data, [test_func3], lambda Z: ramen.keyhole_porosity_classifier(Z[0], spot_size), x_name="2", y_name="1", region_name="Keyhole regime")
+            pmaps.append(pmap)
+
+            self.assertIsNone(pmap.fig)
+            self.assertEqual(len(pmap.get_gridded_data()), 1)
+            self.assertEqual(pmap.get_region_masks()[0][1].shape, pmap.X.shape)
+
+        # Lambdas can't be sent to worker processes, but the stored layers can
+        pmaps[0].save_figure(os.devnull)
+        with tempfile.TemporaryDirectory() as output_dir:
+            filenames = [os.path.join(output_dir, "map_" + str(i) + ".png") for i in range(len(pmaps))]
+            ramen.render_process_maps(pmaps, filenames, num_workers=2)
+            for filename in filenames:
+                self.assertTrue(os.path.exists(filename))
+
+    def test_process_map_jobs(self):
+        print("Test: test_process_map_jobs")
+        material_file = os.path.join("..", "examples", "AlCu.json")
+        regions = [{'fields': [test_func3], 'classifier': test_func6, 'name': "Keyhole regime"}]
+        jobs = []
+        for process_data_file in ["pmap_test_data.csv", "missing_data.csv", "pmap_test_data.csv"]:
+            jobs.append(ramen.ProcessMapJob(material_file, process_data_file, x_name="2", y_name="1", num_grid_points=[50, 50],
+                                            gridded_data=[(test_func7, "Lamellar spacing (m)")], regions=regions))
+
+        results = ramen.run_process_map_jobs(jobs, num_workers=2)
+
+        self.assertEqual(len(results), 3)
+        self.assertIsNone(results[0]['error'])
+        self.assertIn("missing_data.csv", results[1]['error'])
+        self.assertIsNone(results[2]['error'])
+        np.testing.assert_array_equal(results[0]['region_masks'][0][1], results[2]['region_masks'][0][1])
+        self.assertEqual(results[0]['gridded_data'][0][1].shape, (50, 50))
+
+    def test_read_point_data(self):
+        print("Test: test_read_point_data")
+        data = pd.read_csv("pmap_test_data.csv")
+
+        point_data = ramen.read_point_data("pmap_test_data.csv", ["1", "2", "5"], dtype=np.float32, chunksize=7)
+        self.assertEqual(len(point_data), len(data))
+        self.assertNotIn("3", point_data)
+        self.assertEqual(point_data["5"].values.dtype, np.float32)
+        np.testing.assert_allclose(point_data["5"].values, data["5"].values, rtol=1.0e-6)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for i in range(2):
+                point_data = ramen.read_point_data("pmap_test_data.csv", ["1", "2", "5"], chunksize=7, cache_dir=cache_dir)
+                np.testing.assert_array_equal(point_data["5"].values, data["5"].values)
+            self.assertIsInstance(point_data.columns["5"], np.memmap)
+
+            mesh_size = 100
+            grid_bounds_x = (min(point_data["2"]), max(point_data["2"]))
+            grid_bounds_y = (min(point_data["1"]), max(point_data["1"]))
+            pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y, lazy=True)
+            Z = pmap.interpolate_point_data_to_grid(point_data, test_func1, x_name="2", y_name="1")
+            np.testing.assert_array_equal(Z, pmap.interpolate_point_data_to_grid(data, test_func1, x_name="2", y_name="1"))
+            del point_data
+
+    def test_adaptive_region(self):
+        print("Test: test_adaptive_region")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 200
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y, lazy=True)
+        pmap.add_point_data_region(data, [test_func3], test_func6, x_name="2", y_name="1", region_name="Keyhole regime")
+        adaptive_classification = pmap.add_adaptive_point_data_region(data, [test_func3], test_func6, x_name="2", y_name="1", coarse_stride=8, color="k")
+
+        masks = pmap.get_region_masks()
+        np.testing.assert_array_equal(masks[1][1], masks[0][1])
+        self.assertLess(adaptive_classification.num_evaluations, mesh_size*mesh_size)
+        self.assertGreater(len(adaptive_classification.get_boundary_polylines()), 0)
+
+    def test_instrumentation(self):
+        print("Test: test_instrumentation")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 100
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        ramen.reset_instrumentation()
+        ramen.enable_instrumentation()
+        try:
+            ramen.predict_yield_strength(mat, ['alpha', 'theta'], 2.6, np.linspace(0.1, 1.3, 1000), 5.0e-6)
+            pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y, lazy=True)
+            pmap.add_point_data_region(data, [test_func3, test_func3], test_func6, x_name="2", y_name="1", region_name="Keyhole regime")
+            pmap.save_figure(os.devnull)
+        finally:
+            ramen.disable_instrumentation()
+
+        report = ramen.get_instrumentation_report()
+        self.assertEqual(report['predict_yield_strength']['calls'], 1)
+        self.assertEqual(report['get_orowan_strengthening_lamella']['max_elements'], 1000)
+        self.assertEqual(report['ProcessMap2D.interpolate_point_data_to_grid']['calls'], 2)
+        self.assertEqual(report['ProcessMap2D.triangulation']['calls'], 1)
+        self.assertEqual(report['ProcessMap2D.classify_grid']['max_elements'], mesh_size*mesh_size)
+        self.assertIn('ProcessMap2D.draw_region', report)
+
+        # Nothing is recorded while disabled
+        ramen.get_P_JH(0.5)
+        self.assertEqual(ramen.get_instrumentation_report()['get_P_JH']['calls'], report['get_P_JH']['calls'])
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            filename = os.path.join(output_dir, "trace.json")
+            ramen.export_instrumentation_trace(filename)
+            with open(filename, 'r') as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace['traceEvents']), sum(record['calls'] for record in report.values()))
+        ramen.reset_instrumentation()
+
+    def test_lazy_imports(self):
+        print("Test: test_lazy_imports")
+        code = ("import sys; import ramenlib as ramen; ramen.get_grain_boundary_strengthening; "
+                "print(','.join(m for m in ['matplotlib', 'pandas', 'scipy.interpolate'] if m in sys.modules))")
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.abspath('..')] + [p for p in [env.get('PYTHONPATH')] if p])
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "")
+
+        # The public names are unchanged
+        self.assertIs(ramen.ProcessMap2D, ramen.process_maps.ProcessMap2D)
+        self.assertIn('read_point_data', ramen.__all__)
+        for name in ['np', 'mist', 'os', 'pickle', 'OrderedDict', 'core', 'process_maps']:
+            self.assertNotIn(name, ramen.__all__)
+        for module_name in ['process_maps', 'incremental_maps', 'process_map_jobs', 'point_data']:
+            module = importlib.import_module('ramenlib.' + module_name)
+            for name in module.__all__:
+                self.assertIs(getattr(ramen, name), getattr(module, name))
+
+    def test_microstructure_fields(self):
+        print("Test: test_microstructure_fields")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+        phases = ['alpha', 'theta']
+
+        rng = np.random.default_rng(0)
+        velocity = rng.uniform(0.05, 2.0, (6, 5, 4))
+        velocity[0, 0, :] = 0.0
+        gradient = rng.uniform(1.0e5, 1.0e7, (6, 5, 4))
+        grain_diameter = 5.0e-6
+
+        reference = ramen.predict_yield_strength(mat, phases, 2.6, velocity[1:], grain_diameter)
+        fields = ramen.evaluate_microstructure_fields(mat, phases, velocity, 2.6, grain_diameter, thermal_gradient=gradient, block_size=7)
+        for name in ['lamellar_spacing', 'orowan_strengthening_lamella', 'grain_boundary_strengthening', 'yield_strength']:
+            self.assertEqual(fields[name].shape, velocity.shape)
+            np.testing.assert_allclose(fields[name][1:], reference[name], rtol=1.0e-14)
+            self.assertTrue(np.all(np.isnan(fields[name][0, 0, :])))
+        np.testing.assert_allclose(fields['cooling_rate'][1:], gradient[1:] * velocity[1:])
+
+        # A uniform composition is evaluated once per block, not once per cell
+        ramen.enable_instrumentation()
+        try:
+            ramen.reset_instrumentation()
+            ramen.evaluate_microstructure_fields(mat, phases, velocity, 2.6, grain_diameter, block_size=7)
+            report = ramen.get_instrumentation_report()
+        finally:
+            ramen.disable_instrumentation()
+            ramen.reset_instrumentation()
+        self.assertEqual(report['get_P_JH']['total_elements'], report['get_P_JH']['calls'])
+
+        # Memory-mapped outputs, with the grain diameter as a function of G and V
+        with tempfile.TemporaryDirectory() as output_dir:
+            fields = ramen.evaluate_microstructure_fields(mat, phases, velocity, 2.6, lambda G, V: 1.0e-3 / np.sqrt(G),
+                                                          thermal_gradient=gradient, fields=['yield_strength'],
+                                                          block_size=11, output_dir=output_dir, dtype=np.float32)
+            del fields
+            yield_strength = np.load(os.path.join(output_dir, "yield_strength.npy"), mmap_mode='r')
+            reference = ramen.predict_yield_strength(mat, phases, 2.6, velocity[1:], 1.0e-3 / np.sqrt(gradient[1:]))
+            np.testing.assert_allclose(yield_strength[1:], reference['yield_strength'], rtol=1.0e-6)
+            del yield_strength
+
+        with self.assertRaises(ValueError):
+            ramen.evaluate_microstructure_fields(mat, phases, velocity, 2.6, grain_diameter, fields=['cooling_rate'])
+
+    def test_model_cache(self):
+        print("Test: test_model_cache")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+        phases = ['alpha', 'theta']
+        velocities = np.array([0.1, 0.5, 1.3])
+
+        reference = ramen.get_eutectic_lamellar_spacing(mat, phases, ramen.get_eutectic_phase_fractions(mat, phases, 2.6), velocities)
+        cache = ramen.enable_model_cache(max_entries=2)
+        try:
+            for i in range(3):
+                phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, 2.6)
+                spacing = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocities)
+                np.testing.assert_array_equal(spacing, reference)
+            self.assertEqual(cache.get_stats()['misses'], 1)
+            self.assertEqual(cache.get_stats()['hits'], 2)
+            self.assertFalse(spacing.flags.writeable)
+
+            # Changing the material gives new results
+            mat.phase_properties['liquid'].properties['solute_diffusivities']['Cu'].value *= 4.0
+            spacing = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocities)
+            np.testing.assert_allclose(spacing, 2.0 * reference, rtol=1.0e-12)
+            self.assertEqual(cache.get_stats()['misses'], 2)
+
+            # Least recently used entries are evicted
+            ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, 2.0 * velocities)
+            self.assertEqual(cache.get_stats()['evictions'], 1)
+            self.assertEqual(cache.get_stats()['entries'], 2)
+
+            # A hit costs less than evaluating the spacing, also for small inputs
+            compiled_mat = ramen.CompiledMaterial(mat, phases)
+            def get_time(func):
+                times = []
+                for repeat in range(5):
+                    start = time.perf_counter()
+                    for i in range(50):
+                        func(compiled_mat, phases, phase_fractions, velocities)
+                    times.append(time.perf_counter() - start)
+                return min(times)
+            hit_time = get_time(ramen.get_eutectic_lamellar_spacing)
+            uncached_time = get_time(ramen.get_eutectic_lamellar_spacing.uncached)
+            self.assertLess(hit_time, uncached_time)
+
+            # The pipeline doesn't go through the cache
+            cache.clear()
+            results = ramen.predict_yield_strength(mat, phases, 2.6, velocities, 5.0e-6, chunk_size=2)
+            np.testing.assert_allclose(results['lamellar_spacing'], 2.0 * reference, rtol=1.0e-12)
+            self.assertEqual(cache.get_stats()['misses'], 0)
+            self.assertEqual(cache.get_stats()['entries'], 0)
+        finally:
+            ramen.disable_model_cache()
+        self.assertIsNone(ramen.get_model_cache())
+
+    def test_multicomponent_solid_solution(self):
+        print("Test: test_multicomponent_solid_solution")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+
+        # The binary case is the original model
+        np.testing.assert_allclose(ramen.get_multicomponent_solid_solution_strengthening(mat, 'alpha'),
+                                   ramen.get_solid_solution_strengthening(mat, 'alpha'), rtol=1.0e-14)
+
+        # Add Mn and Zr to the matrix phase
+        with open(path_to_example_data, 'r') as f:
+            material_data = json.load(f)
+        misfits = material_data['single_phase_properties']['alpha']['solute_misfit_strains']
+        for solute, misfit in [('Mn', -0.0251), ('Zr', 0.0361)]:
+            misfits[solute] = dict(misfits['Cu'])
+            misfits[solute]['value'] = misfit
+        with tempfile.TemporaryDirectory() as material_dir:
+            material_file = os.path.join(material_dir, "AlCuMnZr.json")
+            with open(material_file, 'w') as f:
+                json.dump(material_data, f)
+            mat = mist.core.MaterialInformation(material_file)
+
+        compositions = {'Cu': np.linspace(0.1, 2.0, 5), 'Mn': 0.3, 'Zr': np.array([[0.05], [0.1]])}
+        total, contributions = ramen.get_multicomponent_solid_solution_strengthening(mat, 'alpha', compositions, return_contributions=True)
+        self.assertEqual(total.shape, (2, 5))
+        for solute in ['Cu', 'Mn', 'Zr']:
+            self.assertEqual(contributions[solute].shape, (2, 5))
+        ratio = contributions['Zr'] / contributions['Mn']
+        np.testing.assert_allclose(ratio, (0.0361/0.0251)**(4./3.) * (compositions['Zr']/0.3)**(2./3.) * np.ones((2, 5)), rtol=1.0e-12)
+        np.testing.assert_allclose(total, contributions['Cu'] + contributions['Mn'] + contributions['Zr'], rtol=1.0e-14)
+
+        total = ramen.get_multicomponent_solid_solution_strengthening(mat, 'alpha', compositions, 'root_sum_square')
+        np.testing.assert_allclose(total, np.sqrt(sum(contribution**2 for contribution in contributions.values())), rtol=1.0e-14)
+        total = ramen.get_multicomponent_solid_solution_strengthening(ramen.CompiledMaterial(mat, ['alpha', 'theta']), 'alpha', compositions, 'labusch')
+        np.testing.assert_allclose(total, sum(contribution**1.5 for contribution in contributions.values())**(2./3.), rtol=1.0e-14)
+
+        with self.assertRaises(ValueError):
+            ramen.get_multicomponent_solid_solution_strengthening(mat, 'alpha')
+        with self.assertRaises(ValueError):
+            ramen.get_multicomponent_solid_solution_strengthening(mat, 'alpha', compositions, 'quadratic')
+
+    def test_uncertainty_propagation(self):
+        print("Test: test_uncertainty_propagation")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+        phases = ['alpha', 'theta']
+        velocities = np.array([0.1, 1.3])
+        uncertainties = {'gamma_alphal': ('relative_normal', 0.1), 'theta_alpha': ('uniform', 0.05), 'k_HP': ('relative_normal', 0.1)}
+
+        # Batches of samples, checked against the Python-level calls with perturbed materials
+        compiled_mat = ramen.CompiledMaterial(mat, phases)
+        batches = list(ramen.iterate_uncertainty_batches(mat, phases, 2.6, velocities, 5.0e-6, uncertainties, num_samples=1000, batch_size=300, seed=2))
+        self.assertEqual([outputs['yield_strength'].shape for samples, outputs in batches], [(300, 2), (300, 2), (300, 2), (100, 2)])
+        samples, outputs = batches[1]
+        for i in [0, 150, 299]:
+            sampled_mat = compiled_mat.with_values({name: values[i] for name, values in samples.items()})
+            reference = ramen.predict_yield_strength(sampled_mat, phases, 2.6, velocities, 5.0e-6)
+            np.testing.assert_allclose(outputs['yield_strength'][i], reference['yield_strength'], rtol=1.0e-12)
+
+        # Streaming statistics
+        results = ramen.propagate_uncertainty(mat, phases, 2.6, velocities, 5.0e-6, uncertainties, num_samples=1000, batch_size=300, seed=2)
+        yield_strength = np.concatenate([outputs['yield_strength'] for samples, outputs in batches])
+        np.testing.assert_allclose(results['yield_strength']['mean'], np.mean(yield_strength, axis=0), rtol=1.0e-12)
+        np.testing.assert_allclose(results['yield_strength']['std'], np.std(yield_strength, axis=0, ddof=1), rtol=1.0e-10)
+        np.testing.assert_allclose(results['yield_strength']['quantiles'][0.5], np.quantile(yield_strength, 0.5, axis=0), rtol=1.0e-12)
+        np.testing.assert_array_equal(results['yield_strength']['max'], np.max(yield_strength, axis=0))
+
+        # The sampled batches don't go through the model cache
+        cache = ramen.enable_model_cache()
+        try:
+            cached_results = ramen.propagate_uncertainty(mat, phases, 2.6, velocities, 5.0e-6, uncertainties, num_samples=1000,
+                                                         batch_size=300, seed=2)
+            self.assertEqual(cache.get_stats()['entries'], 0)
+            self.assertEqual(cache.get_stats()['misses'], 0)
+        finally:
+            ramen.disable_model_cache()
+        np.testing.assert_array_equal(cached_results['yield_strength']['mean'], results['yield_strength']['mean'])
+
+        # Latin hypercube samples of the Hall-Petch coefficient: one per stratum
+        k_HP = np.concatenate([samples['k_HP'] for samples, outputs in batches[:1]])
+        nominal = compiled_mat.k_HP
+        strata = np.floor(300 * 0.5 * (1.0 + erf((k_HP - nominal) / (0.1 * nominal * np.sqrt(2.0))))).astype(int)
+        np.testing.assert_array_equal(np.sort(strata), np.arange(300))
+
+        # Subsampled quantiles with a small reservoir
+        results = ramen.propagate_uncertainty(mat, phases, 2.6, 1.3, 5.0e-6, {'k_HP': ('relative_uniform', 0.1)}, num_samples=20000,
+                                              method='monte_carlo', batch_size=4096, seed=3, reservoir_size=5000)
+        grain_boundary_strengthening = ramen.get_grain_boundary_strengthening(mat, 5.0e-6)
+        np.testing.assert_allclose(results['grain_boundary_strengthening']['quantiles'][0.05], 0.91 * grain_boundary_strengthening, rtol=5.0e-3)
+        np.testing.assert_allclose(results['grain_boundary_strengthening']['mean'], grain_boundary_strengthening, rtol=5.0e-3)
+
+        with self.assertRaises(ValueError):
+            ramen.iterate_uncertainty_batches(mat, phases, 2.6, 1.3, 5.0e-6, {'k_HP': ('cauchy', 0.1)})
+
+    def test_analytic_derivatives(self):
+        print("Test: test_analytic_derivatives")
+        path_to_example_data = os.path.join("..", "examples", "AlCu.json")
+        mat = mist.core.MaterialInformation(path_to_example_data)
+        phases = ['alpha', 'theta']
+
+        # dP/dg against central differences, including the mapped and symmetric ranges
+        g = np.array([0.01, 0.1, 0.3, 0.7, 0.99, 1.3, -0.2])
+        h = 1.0e-6
+        np.testing.assert_allclose(ramen.get_dP_JH_dg(g), (ramen.get_P_JH(g+h) - ramen.get_P_JH(g-h)) / (2.0*h), rtol=1.0e-7)
+        np.testing.assert_allclose(ramen.get_dP_JH_dg(np.array([0.0, 0.5, 1.0])), 0.0, atol=1.0e-15)
+
+        solute_composition = np.array([[2.6], [5.0], [10.0]])
+        velocity = np.array([0.1, 1.3])
+        grain_diameter = 5.0e-6
+        results = ramen.predict_yield_strength(mat, phases, solute_composition, velocity, grain_diameter, chunk_size=4, return_derivatives=True)
+
+        relative_step = 1.0e-6
+        for input_name, inputs in [('solute_composition', (solute_composition, velocity, grain_diameter)),
+                                   ('solidification_velocity', (solute_composition, velocity, grain_diameter)),
+                                   ('grain_diameter', (solute_composition, velocity, grain_diameter))]:
+            index = ['solute_composition', 'solidification_velocity', 'grain_diameter'].index(input_name)
+            up = list(inputs)
+            down = list(inputs)
+            up[index] = inputs[index] * (1.0 + relative_step)
+            down[index] = inputs[index] * (1.0 - relative_step)
+            results_up = ramen.predict_yield_strength(mat, phases, *up)
+            results_down = ramen.predict_yield_strength(mat, phases, *down)
+            for name, derivatives in results['derivatives'].items():
+                if input_name in derivatives:
+                    finite_difference = (results_up[name] - results_down[name]) / (2.0 * relative_step * inputs[index])
+                    np.testing.assert_allclose(derivatives[input_name], finite_difference, rtol=1.0e-6)
+
+        # The individual models
+        phase_fractions = ramen.get_eutectic_phase_fractions(mat, phases, 2.6)
+        spacing, derivatives = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity, return_derivatives=True)
+        np.testing.assert_allclose(derivatives['solidification_velocity'], -0.5 * spacing / velocity, rtol=1.0e-14)
+        spacing_up = ramen.get_eutectic_lamellar_spacing(mat, phases, {'alpha': phase_fractions['alpha'] + h, 'theta': phase_fractions['theta'] - h}, velocity)
+        spacing_down = ramen.get_eutectic_lamellar_spacing(mat, phases, {'alpha': phase_fractions['alpha'] - h, 'theta': phase_fractions['theta'] + h}, velocity)
+        np.testing.assert_allclose(derivatives['phase_fraction'], (spacing_up - spacing_down) / (2.0*h), rtol=1.0e-6)
+
+        # The table backend differentiates its own (interpolated) P(g)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            g = np.array([0.01, 0.1, 0.3, 0.7, 0.99, 1.3, -0.2])
+            np.testing.assert_allclose(ramen.get_dP_JH_dg_interpolated(g, cache_dir=cache_dir),
+                                       (ramen.get_P_JH_interpolated(g+h, cache_dir=cache_dir)
+                                        - ramen.get_P_JH_interpolated(g-h, cache_dir=cache_dir)) / (2.0*h), rtol=1.0e-7)
+
+            old_cache_dir = os.environ.get('RAMEN_CACHE_DIR')
+            os.environ['RAMEN_CACHE_DIR'] = cache_dir
+            try:
+                spacing, derivatives = ramen.get_eutectic_lamellar_spacing(mat, phases, phase_fractions, velocity, 'table', True)
+                spacing_up = ramen.get_eutectic_lamellar_spacing(mat, phases, {'alpha': phase_fractions['alpha'] + h,
+                                                                               'theta': phase_fractions['theta'] - h}, velocity, 'table')
+                spacing_down = ramen.get_eutectic_lamellar_spacing(mat, phases, {'alpha': phase_fractions['alpha'] - h,
+                                                                                 'theta': phase_fractions['theta'] + h}, velocity, 'table')
+            finally:
+                if old_cache_dir is None:
+                    del os.environ['RAMEN_CACHE_DIR']
+                else:
+                    os.environ['RAMEN_CACHE_DIR'] = old_cache_dir
+        np.testing.assert_allclose(derivatives['phase_fraction'], (spacing_up - spacing_down) / (2.0*h), rtol=1.0e-6)
+
+    def test_process_window_boundary(self):
+        print("Test: test_process_window_boundary")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 200
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=grid_bounds_x, grid_bounds_y=grid_bounds_y, lazy=True)
+        pmap.add_point_data_region(data, [test_func3], test_func6, x_name="2", y_name="1", region_name="Keyhole regime")
+        mask = pmap.get_region_masks()[0][1]
+
+        boundary = pmap.get_point_data_boundary(data, [test_func3], test_func6, x_name="2", y_name="1")
+        self.assertLess(boundary.num_evaluations, mesh_size*mesh_size)
+        self.assertEqual(boundary.y.shape[0], mesh_size)
+        self.assertGreater(len(boundary.get_polylines()), 0)
+
+        # The crossings are between the grid rows where the classification changes
+        dy = pmap.y[1] - pmap.y[0]
+        for j in range(mesh_size):
+            rows = np.nonzero(mask[1:,j] != mask[:-1,j])[0]
+            crossings = boundary.y[j][np.logical_not(np.isnan(boundary.y[j]))]
+            self.assertEqual(len(crossings), len(rows))
+            for row, crossing in zip(rows, crossings):
+                self.assertTrue(pmap.y[row] - 1.0e-6*dy <= crossing <= pmap.y[row+1] + 1.0e-6*dy)
+            intervals = boundary.get_intervals(True)[j]
+            num_runs = np.sum(np.diff(np.concatenate(([0], mask[:,j].astype(int)))) == 1)
+            self.assertEqual(intervals.shape[0], num_runs)
+
+        # Root of the interpolated field: depth/spot_size = 2
+        threshold = pmap.get_point_data_threshold(data, test_func3, 2.0*55, x_name="2", y_name="1")
+        interpolant = pmap.get_point_data_interpolator(data, test_func3, x_name="2", y_name="1")
+        found = np.logical_not(np.isnan(threshold.y[:,0]))
+        np.testing.assert_allclose(interpolant(pmap.x[found], threshold.y[found,0]), 2.0*55, rtol=1.0e-10)
+
+    def test_process_map_nd(self):
+        print("Test: test_process_map_nd")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 60
+        speeds = np.linspace(min(data["2"]), max(data["2"]), mesh_size)
+        powers = np.linspace(min(data["1"]), max(data["1"]), mesh_size+1)
+        spot_sizes = np.array([45.0, 55.0, 65.0])
+        layer_thicknesses = np.array([20.0, 30.0, 40.0, 50.0])
+
+        pmap_nd = ramen.ProcessMapND([('power', powers), ('speed', speeds), ('spot_size', spot_sizes),
+                                      ('layer_thickness', layer_thicknesses)])
+        pmap_nd.add_point_data_field('depth', data, test_func3, {'speed': "2", 'power': "1"})
+        pmap_nd.add_region('keyhole', ['depth'], lambda Z, grid: ramen.keyhole_porosity_classifier(Z[0], grid['spot_size']))
+        pmap_nd.add_region('lack_of_fusion', ['depth'],
+                           lambda Z, grid: ramen.lack_of_fusion_porosity_classifier(Z[0], grid['layer_thickness']))
+        pmap_nd.add_field('energy_density', lambda grid: grid['power'] / (grid['speed'] * grid['spot_size']))
+        pmap_nd.add_region('keyhole_55', ['depth'], lambda Z, spot_size=55.0: ramen.keyhole_porosity_classifier(Z[0], spot_size))
+        self.assertEqual(pmap_nd.regions['keyhole_55'].shape, (mesh_size+1, mesh_size, 1, 1))
+
+        # Only the axes each array depends on are stored
+        self.assertEqual(pmap_nd.fields['depth'].shape, (mesh_size+1, mesh_size, 1, 1))
+        self.assertEqual(pmap_nd.regions['keyhole'].shape, (mesh_size+1, mesh_size, 3, 1))
+        self.assertEqual(pmap_nd.regions['lack_of_fusion'].shape, (mesh_size+1, mesh_size, 1, 4))
+
+        # Slices match the 2D process map on the same grid
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size+1], grid_bounds_x=(speeds[0], speeds[-1]),
+                                  grid_bounds_y=(powers[0], powers[-1]), lazy=True)
+        pmap.add_point_data_region(data, [test_func3], test_func6, x_name="2", y_name="1")
+        keyhole_slice = pmap_nd.get_slice('keyhole', 'speed', 'power', {'spot_size': 55.0, 'layer_thickness': 30.0})
+        np.testing.assert_array_equal(keyhole_slice, pmap.get_region_masks()[0][1])
+        np.testing.assert_array_equal(pmap_nd.get_slice('keyhole_55', 'speed', 'power', {'spot_size': 0, 'layer_thickness': 0}),
+                                      keyhole_slice)
+        depth = pmap.interpolate_point_data_to_grid(data, test_func3, "2", "1")
+        np.testing.assert_allclose(pmap_nd.get_slice('depth', 'speed', 'power', {'spot_size': 0, 'layer_thickness': 0}), depth)
+        energy_slice = pmap_nd.get_slice('energy_density', 'power', 'spot_size', {'speed': speeds[5], 'layer_thickness': 20})
+        np.testing.assert_allclose(energy_slice, powers[np.newaxis,:] / (speeds[5] * spot_sizes[:,np.newaxis]))
+
+        # Projections reduce over the other axes
+        projection = pmap_nd.get_projection('keyhole', 'speed', 'power', 'any')
+        expected = np.zeros(projection.shape, dtype=bool)
+        for spot_size in spot_sizes:
+            expected |= pmap_nd.get_slice('keyhole', 'speed', 'power', {'spot_size': spot_size, 'layer_thickness': 20})
+        np.testing.assert_array_equal(projection, expected)
+        self.assertTrue(np.all(pmap_nd.get_projection('lack_of_fusion', 'speed', 'power', 'all')
+                               <= pmap_nd.get_projection('lack_of_fusion', 'speed', 'power', 'any')))
+
+        # 2D maps for plotting with the existing rendering
+        pmap_slice = pmap_nd.to_process_map_2d('speed', 'power', fixed_values={'spot_size': 55.0, 'layer_thickness': 30.0},
+                                               fields=[('depth', 'Depth')], regions=['keyhole', 'lack_of_fusion'])
+        np.testing.assert_array_equal(pmap_slice.get_region_masks()[0][1], keyhole_slice)
+        np.testing.assert_allclose(pmap_slice.get_gridded_data()[0][1], depth)
+        with tempfile.TemporaryDirectory() as directory:
+            pmap_slice.save_figure(os.path.join(directory, "slice.png"))
+            self.assertTrue(os.path.exists(os.path.join(directory, "slice.png")))
+
+    def test_incremental_region(self):
+        print("Test: test_incremental_region")
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0.0, 1.0, (320, 2))
+        data = pd.DataFrame({'speed': points[:,0], 'power': points[:,1],
+                             'depth': np.sin(3.0*points[:,0]) + points[:,1]**2})
+        depth_func = lambda data: data['depth'].values
+        classifier_func = lambda Z: Z[0] > 0.8
+        mesh_size = 200
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=(0.0, 1.0), grid_bounds_y=(0.0, 1.0), lazy=True)
+        incremental = pmap.add_incremental_point_data_region(data.iloc[:300], [depth_func], classifier_func, "speed", "power")
+        self.assertIs(pmap.get_region_masks()[0][1], incremental.mask)
+
+        # One new point at a time, then a batch
+        for num_points in list(range(301, 311)) + [320]:
+            previous_mask = incremental.mask.copy()
+            update = incremental.update(data.iloc[:num_points])
+            self.assertLess(update.updated_cells.size, mesh_size*mesh_size)
+            flipped = np.zeros(previous_mask.shape, dtype=bool)
+            flipped[update.flipped] = True
+            np.testing.assert_array_equal(flipped, previous_mask != incremental.mask)
+
+        # Same as rebuilding the map with all of the points
+        rebuilt = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size], grid_bounds_x=(0.0, 1.0), grid_bounds_y=(0.0, 1.0), lazy=True)
+        rebuilt.add_point_data_region(data, [depth_func], classifier_func, "speed", "power")
+        np.testing.assert_array_equal(incremental.mask, rebuilt.get_region_masks()[0][1])
+        np.testing.assert_allclose(incremental.Z_collection[0], rebuilt.interpolate_point_data_to_grid(data, depth_func, "speed", "power"))
+
+        # New values at the existing points update every cell
+        update = incremental.update(data.assign(depth=data['depth'] + 0.1))
+        self.assertEqual(update.updated_cells.size, mesh_size*mesh_size)
+        with self.assertRaises(ValueError):
+            incremental.update(data.iloc[:10])
+
+        # Triangle keys don't collide for vertex indices above 2**21
+        large = 3000000
+        simplices = np.array([[large, 1, 2], [2, large, 1], [1, 2, large+1], [0, 2**40, 1]])
+        keys = ramen.incremental_maps._get_simplex_keys(simplices)
+        np.testing.assert_array_equal(np.isin(keys, keys[:1]), [True, True, False, False])
+
+    def test_process_map_artifact(self):
+        print("Test: test_process_map_artifact")
+        data = pd.read_csv("pmap_test_data.csv")
+        mesh_size = 120
+        grid_bounds_x = (min(data["2"]), max(data["2"]))
+        grid_bounds_y = (min(data["1"]), max(data["1"]))
+
+        pmap = ramen.ProcessMap2D(num_grid_points=[mesh_size, mesh_size+10], grid_bounds_x=grid_bounds_x,
+                                  grid_bounds_y=grid_bounds_y, lazy=True)
+        pmap.add_point_data_plot(data, test_func3, x_name="2", y_name="1", label="Depth")
+        pmap.add_point_data_region(data, [test_func3], test_func6, x_name="2", y_name="1", region_name="Keyhole")
+        depth = pmap.get_gridded_data()[0][1]
+        mask = pmap.get_region_masks()[0][1]
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "map.ramen")
+            pmap.save_artifact(filename)
+
+            # Bit-packed masks and float32 fields
+            self.assertLess(os.path.getsize(filename), depth.size * 4 + mask.size // 8 + 1024)
+
+            artifact = ramen.ProcessMapArtifact(filename)
+            self.assertEqual(artifact.field_names, ["Depth"])
+            self.assertEqual(artifact.region_names, ["Keyhole"])
+            np.testing.assert_array_equal(artifact.get_region_mask("Keyhole"), mask)
+            np.testing.assert_array_equal(artifact.get_field("Depth"), depth.astype(np.float32))
+
+            # Point queries at the grid points, between them and off the map
+            rng = np.random.default_rng(0)
+            i = rng.integers(0, mesh_size+10, 1000)
+            j = rng.integers(0, mesh_size, 1000)
+            np.testing.assert_array_equal(artifact.query_region("Keyhole", pmap.x[j], pmap.y[i]), mask[i,j])
+            np.testing.assert_allclose(artifact.query_field("Depth", pmap.x[j], pmap.y[i]), depth[i,j], rtol=1.0e-6)
+            i = np.minimum(i, mesh_size+8)
+            j = np.minimum(j, mesh_size-2)
+            x = pmap.x[j] + 0.25*(pmap.x[1] - pmap.x[0])
+            y = pmap.y[i] + 0.6*(pmap.y[1] - pmap.y[0])
+            expected = 0.4*(0.75*depth[i,j] + 0.25*depth[i,j+1]) + 0.6*(0.75*depth[i+1,j] + 0.25*depth[i+1,j+1])
+            np.testing.assert_allclose(artifact.query_field("Depth", x, y), expected, rtol=1.0e-6)
+            np.testing.assert_array_equal(artifact.query_region("Keyhole", x, y), mask[i+1,j])
+            results = artifact.query([grid_bounds_x[0] - 1.0], [grid_bounds_y[0]])
+            self.assertFalse(results["Keyhole"][0])
+            self.assertTrue(np.isnan(results["Depth"][0]))
+
+            # The loader works on its own, without ramenlib, mist, scipy or matplotlib
+            script = ("import sys, importlib.util\n"
+                      "spec = importlib.util.spec_from_file_location('artifacts', sys.argv[1])\n"
+                      "module = importlib.util.module_from_spec(spec)\n"
+                      "spec.loader.exec_module(module)\n"
+                      "artifact = module.ProcessMapArtifact(sys.argv[2])\n"
+                      "print(int(artifact.query_region('Keyhole', [float(sys.argv[3])], [float(sys.argv[4])])[0]))\n"
+                      "print(sorted(name for name in ('scipy', 'matplotlib', 'pandas', 'mistlib', 'ramenlib') if name in sys.modules))\n")
+            module_file = os.path.join(os.path.dirname(ramen.__file__), "process_map_artifacts.py")
+            output = subprocess.run([sys.executable, "-c", script, module_file, filename, str(pmap.x[3]), str(pmap.y[5])],
+                                    capture_output=True, text=True, check=True).stdout.split("\n")
+            self.assertEqual(int(output[0]), int(mask[5,3]))
+            self.assertEqual(output[1], "[]")
+
+    def test_material_registry(self):
+        print("Test: test_material_registry")
+        material_file = os.path.join("..", "examples", "AlCu.json")
+        phases = ['alpha', 'theta']
+        expected = ramen.CompiledMaterial(mist.core.MaterialInformation(material_file), phases)
+
+        def assert_same_material(compiled_mat, expected):
+            for name in ramen.CompiledMaterial.__slots__:
+                np.testing.assert_array_equal(getattr(compiled_mat, name), getattr(expected, name))
+
+        with tempfile.TemporaryDirectory() as directory:
+            material_dir = os.path.join(directory, "materials")
+            cache_dir = os.path.join(directory, "cache")
+            os.makedirs(material_dir)
+            with open(material_file, 'r') as f:
+                material_data = json.load(f)
+            for index in range(4):
+                material_data['thermophysical_properties']['hall_petch_coefficient']['value'] = 0.1 * (index + 1)
+                with open(os.path.join(material_dir, "alloy_" + str(index) + ".json"), 'w') as f:
+                    json.dump(material_data, f)
+            filename = os.path.join(material_dir, "alloy_0.json")
+
+            registry = ramen.MaterialRegistry(cache_dir)
+            compiled_mat = registry.get(filename, phases)
+            assert_same_material(compiled_mat, ramen.CompiledMaterial(mist.core.MaterialInformation(filename), phases))
+            self.assertEqual(set(registry.get_all(filename).keys()),
+                             {('alpha', 'theta'), ('theta', 'alpha')})
+            with self.assertRaises(ValueError):
+                registry.get(filename, ['alpha', 'liquid'])
+
+            # A cache directory that can't be created: the materials are only kept in memory
+            unwritable_cache_dir = os.path.join(filename, "cache")
+            unwritable_registry = ramen.MaterialRegistry(unwritable_cache_dir)
+            assert_same_material(unwritable_registry.get(filename, phases), compiled_mat)
+            unwritable_registry.clear()
+            self.assertFalse(os.path.exists(unwritable_cache_dir))
+
+            # A new registry (e.g. in another process) loads the cache without mist
+            compile_material_file = ramen.material_registry.compile_material_file
+            ramen.material_registry.compile_material_file = None
+            try:
+                assert_same_material(ramen.MaterialRegistry(cache_dir).get(filename, phases), compiled_mat)
+            finally:
+                ramen.material_registry.compile_material_file = compile_material_file
+
+            # Bulk loading, in worker processes for the files that aren't cached
+            materials = ramen.MaterialRegistry(cache_dir).load_directory(material_dir, num_workers=2)
+            self.assertEqual(sorted(materials.keys()), sorted(glob.glob(os.path.join(material_dir, "*.json"))))
+            for index in range(4):
+                k_HP = materials[os.path.join(material_dir, "alloy_" + str(index) + ".json")][tuple(phases)].k_HP
+                self.assertAlmostEqual(k_HP, 0.1 * (index + 1))
+
+            # Edited files are parsed again
+            material_data['thermophysical_properties']['hall_petch_coefficient']['value'] = 7.0
+            with open(filename, 'w') as f:
+                json.dump(material_data, f)
+            os.utime(filename, ns=(os.stat(filename).st_atime_ns, os.stat(filename).st_mtime_ns + 10**9))
+            self.assertEqual(registry.get(filename, phases).k_HP, 7.0)
+            self.assertEqual(ramen.load_compiled_material(filename, phases, cache_dir).k_HP, 7.0)
+
+            # The entries are plain arrays, and the default cache is the per-user ramen cache
+            entries = os.listdir(os.path.join(cache_dir, "materials"))
+            self.assertTrue(len(entries) > 0 and all(entry.endswith(".npz") for entry in entries))
+            old_cache_dir = os.environ.get('RAMEN_CACHE_DIR')
+            os.environ['RAMEN_CACHE_DIR'] = os.path.join(directory, "user_cache")
+            try:
+                self.assertEqual(ramen.MaterialRegistry().cache_dir, os.path.join(directory, "user_cache", "materials"))
+            finally:
+                if old_cache_dir is None:
+                    del os.environ['RAMEN_CACHE_DIR']
+                else:
+                    os.environ['RAMEN_CACHE_DIR'] = old_cache_dir
+
+    def test_inverse_design(self):
+        print("Test: test_inverse_design")
+        mat = mist.core.MaterialInformation(os.path.join("..", "examples", "AlCu.json"))
+        phases = ['alpha', 'theta']
+        compiled_mat = ramen.CompiledMaterial(mat, phases)
+
+        # Candidate alloys (rows) against process conditions (columns)
+        solute_composition = np.linspace(2.6, 5.0, 7)[:,np.newaxis]
+        velocity = np.logspace(-3.0, 1.0, 9)[np.newaxis,:]
+        grain_diameter = 2.0e-5
+        results = ramen.predict_yield_strength(compiled_mat, phases, solute_composition, velocity, grain_diameter)
+        self.assertTrue(np.all(np.isfinite(results['yield_strength'])))
+
+        velocity_for_spacing = ramen.get_solidification_velocity_for_spacing(mat, phases, solute_composition, results['lamellar_spacing'])
+        np.testing.assert_allclose(velocity_for_spacing, np.broadcast_to(velocity, velocity_for_spacing.shape), rtol=1.0e-12)
+
+        velocity_for_strength = ramen.get_solidification_velocity_for_strength(compiled_mat, phases, results['yield_strength'],
+                                                                              solute_composition, grain_diameter)
+        np.testing.assert_allclose(velocity_for_strength, np.broadcast_to(velocity, velocity_for_strength.shape), rtol=1.0e-10)
+
+        grain_diameter_for_strength = ramen.get_grain_diameter_for_strength(compiled_mat, phases, results['yield_strength'],
+                                                                            solute_composition, velocity)
+        np.testing.assert_allclose(grain_diameter_for_strength, grain_diameter, rtol=1.0e-10)
+
+        # Targets below the contributions that don't depend on the unknown, or above the
+        # largest Orowan strengthening, can't be reached
+        baseline = ramen.get_solid_solution_strengthening(compiled_mat, 'alpha') \
+                   + ramen.get_grain_boundary_strengthening(compiled_mat, grain_diameter)
+        unreachable = ramen.get_solidification_velocity_for_strength(compiled_mat, phases, [0.5*baseline, 1.0e6*baseline],
+                                                                    3.0, grain_diameter)
+        self.assertTrue(np.all(np.isnan(unreachable)))
+        self.assertTrue(np.isnan(ramen.get_grain_diameter_for_strength(compiled_mat, phases, 0.0, 3.0, 1.0)))
+
+        # Unreachable targets don't hold back the Newton iterations of the others
+        phase_fractions = ramen.get_eutectic_phase_fractions(compiled_mat, phases, 3.0)
+        spacing = np.array([1.0e-7, 1.0e-6])
+        orowan_strengthening = ramen.get_orowan_strengthening_lamella(compiled_mat, 'alpha', 'theta', spacing, phase_fractions)
+        spacing_for_strength = ramen.get_lamellar_spacing_for_orowan_strengthening(compiled_mat, phases,
+                                                                                   np.append(orowan_strengthening, [1.0e12, -1.0]),
+                                                                                   phase_fractions, max_iterations=10)
+        np.testing.assert_allclose(spacing_for_strength[:2], spacing, rtol=1.0e-12)
+        self.assertTrue(np.all(np.isnan(spacing_for_strength[2:])))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file